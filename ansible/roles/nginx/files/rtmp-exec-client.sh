@@ -0,0 +1,21 @@
+#!/bin/sh
+# Forwards an nginx-rtmp exec event to the rtmp-exec daemon, falling back to
+# running rtmp-exec.py directly when the daemon isn't listening.
+SOCKET=/run/rtmp-exec/rtmp-exec.sock
+
+while getopts "e:w:n:p:" opt; do
+    case "$opt" in
+        e) EVENT="$OPTARG" ;;
+        w) WEBROOT="$OPTARG" ;;
+        n) NAME="$OPTARG" ;;
+        p) EVENT_PATH="$OPTARG" ;;
+        *) exit 64 ;;
+    esac
+done
+
+if [ -S "$SOCKET" ]; then
+    printf '%s\t%s\t%s\t%s\n' "$EVENT" "$WEBROOT" "$NAME" "$EVENT_PATH" \
+        | nc -U "$SOCKET" | grep -q '^OK' && exit 0
+fi
+
+exec /etc/nginx/rtmp-exec.py -e "$EVENT" -w "$WEBROOT" -n "$NAME" ${EVENT_PATH:+-p "$EVENT_PATH"}
@@ -1,44 +1,117 @@
 #!/usr/bin/env python3
+import json
 import os
 import shlex
+import signal
 import sys
+import time
 from os.path import exists, join as pathjoin
-from glob import glob
 from shutil import rmtree
 from argparse import ArgumentParser
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
+from socketserver import StreamRequestHandler, UnixStreamServer
 from subprocess import Popen
+from threading import BoundedSemaphore, Lock
+from urllib.parse import urlencode
+from urllib.request import urlopen
+
+THUMB_WIDTHS = [
+    int(width)
+    for width in os.environ.get("RTMP_EXEC_THUMB_WIDTHS", "300,360,400,1280").split(",")
+]
+THUMB_FORMATS = os.environ.get("RTMP_EXEC_THUMB_FORMATS", "jpg").split(",")
+THUMBNAILERS = {}
+THUMBNAILERS_LOCK = Lock()
+VOD_RECORD_DONE_URL = os.environ.get(
+    "RTMP_EXEC_VOD_RECORD_DONE_URL", "http://127.0.0.1:8081/vod-record-done"
+)
+
+
+def get_thumbnailer_cmd(rootdir, name):
+    variants = [(w, fmt) for w in THUMB_WIDTHS for fmt in THUMB_FORMATS]
+    graph = f"[0:v]split={len(variants)}" + "".join(
+        f"[s{i}]" for i in range(len(variants))
+    )
+    for i, (width, _) in enumerate(variants):
+        graph += f";[s{i}]scale={width}:-2[o{i}]"
+
+    cmd = [
+        "ffmpeg", "-hide_banner", "-v", "quiet", "-skip_frame", "nokey",
+        "-i", f"rtmp://127.0.0.1/live/{name}", "-an", "-filter_complex", graph,
+    ]
+    for i, (width, fmt) in enumerate(variants):
+        cmd += [
+            "-map", f"[o{i}]", "-vsync", "vfr", "-q:v", "3",
+            "-f", "image2", "-update", "1", "-atomic_writing", "1",
+            "-y", pathjoin(rootdir, f"{width}.{fmt}"),
+        ]
+    return cmd
+
+
+def stop_thumbnailer(rootdir):
+    try:
+        with open(pathjoin(rootdir, ".pid")) as f:
+            os.killpg(int(f.read()), signal.SIGTERM)
+    except (FileNotFoundError, ProcessLookupError, ValueError):
+        pass
+
+
+def reap_thumbnailers():
+    with THUMBNAILERS_LOCK:
+        for name, proc in list(THUMBNAILERS.items()):
+            if proc.poll() is not None:
+                del THUMBNAILERS[name]
+
+
+def live_publish(webroot, name):
+    """Start one long-lived decoder writing the latest keyframe of a stream
+    as pre-sized images under ``thumbs/<name>/``."""
+    rootdir = pathjoin(webroot, "thumbs", name)
+    os.makedirs(rootdir, exist_ok=True)
+    stop_thumbnailer(rootdir)
+
+    with open(os.devnull, "wb") as f:
+        proc = Popen(
+            get_thumbnailer_cmd(rootdir, name),
+            stdin=f,
+            stdout=f,
+            stderr=f,
+            start_new_session=True,
+        )
+
+    with open(pathjoin(rootdir, ".pid"), "w") as f:
+        f.write(str(proc.pid))
+    with THUMBNAILERS_LOCK:
+        THUMBNAILERS[name] = proc
 
 
 def live_publish_done(webroot, name):
-    for part in ("live", "keys"):
+    stop_thumbnailer(pathjoin(webroot, "thumbs", name))
+
+    for part in ("live", "keys", "thumbs", "dvr"):
         try:
             rmtree(pathjoin(webroot, part, name))
         except FileNotFoundError:
             pass
 
-    for ext in ("mp4", "flv"):
-        rootdir = pathjoin(webroot, "record")
-        for path in glob(f"{rootdir}/{name}*_thumb.{ext}"):
-            os.remove(path)
-
-
-def thumb_record_done(webroot, name, path):
-    cmd = (
-        f"ffmpeg -hide_banner -v quiet -y -i '{path}' "
-        f"-movflags +faststart -an -c:v copy '{webroot}/record/{name}_thumb.mp4'"
-    )
-
-    with open(os.devnull, "wb") as f:
-        Popen(shlex.split(cmd), stdout=f, stderr=f).wait()
 
+def vod_record_done(webroot, name, path):
+    """Hand the recording to the app's VOD finalization queue, falling back to
+    a local remux into ``vod/<name>/`` when the app can't be reached."""
+    data = urlencode({"name": name, "path": path}).encode()
     try:
-        os.remove(path)
-    except FileNotFoundError:
-        pass
+        with urlopen(VOD_RECORD_DONE_URL, data=data, timeout=10) as resp:
+            if resp.status == 200:
+                return
+    except OSError as e:
+        print(f"vod_record_done {name}: {e}", file=sys.stderr)
 
+    vod_remux(webroot, name, path)
 
-def vod_record_done(webroot, name, path):
+
+def vod_remux(webroot, name, path):
     rootdir = pathjoin(webroot, "vod", name)
     try:
         os.mkdir(rootdir)
@@ -59,28 +132,171 @@ def vod_record_done(webroot, name, path):
         pass
 
 
+EVENTS = {
+    "live_publish": live_publish,
+    "live_publish_done": live_publish_done,
+    "vod_record_done": vod_record_done,
+}
+PATH_EVENTS = ("vod_record_done",)
+
+
+def run_event(event, webroot, name, path=None):
+    reap_thumbnailers()
+    if event in PATH_EVENTS:
+        EVENTS[event](webroot, name, path)
+    else:
+        EVENTS[event](webroot, name)
+
+
+class EventMetrics:
+    def __init__(self):
+        self.lock = Lock()
+        self.counts = defaultdict(int)
+        self.errors = defaultdict(int)
+        self.rejected = defaultdict(int)
+        self.total_seconds = defaultdict(float)
+        self.max_seconds = defaultdict(float)
+
+    def record(self, event, seconds, ok=True):
+        with self.lock:
+            self.counts[event] += 1
+            self.total_seconds[event] += seconds
+            self.max_seconds[event] = max(self.max_seconds[event], seconds)
+            if not ok:
+                self.errors[event] += 1
+
+    def reject(self, event):
+        with self.lock:
+            self.rejected[event] += 1
+
+    def as_dict(self):
+        with self.lock:
+            return {
+                event: {
+                    "count": self.counts[event],
+                    "errors": self.errors[event],
+                    "rejected": self.rejected[event],
+                    "avg_seconds": self.total_seconds[event] / self.counts[event]
+                    if self.counts[event]
+                    else 0.0,
+                    "max_seconds": self.max_seconds[event],
+                }
+                for event in EVENTS
+            }
+
+
+class EventHandler(StreamRequestHandler):
+    """Reads one tab separated ``event webroot name path`` line per connection.
+
+    The line ``stats`` returns the event metrics as JSON instead.
+    """
+
+    def handle(self):
+        line = self.rfile.readline().decode().rstrip("\n")
+        if line == "stats":
+            self.wfile.write(json.dumps(self.server.metrics.as_dict()).encode())
+            return
+
+        event, webroot, name, path = (line.split("\t") + [""] * 4)[:4]
+        if event not in EVENTS or not webroot or not name:
+            self.wfile.write(b"ERR bad event\n")
+            return
+
+        if event in PATH_EVENTS and not path:
+            self.wfile.write(b"ERR path is required\n")
+            return
+
+        if not self.server.submit(event, webroot, name, path or None):
+            self.wfile.write(b"ERR busy\n")
+            return
+
+        self.wfile.write(b"OK\n")
+
+
+class EventServer(UnixStreamServer):
+    def __init__(self, socket_path, workers, max_pending):
+        self.metrics = EventMetrics()
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.pending = BoundedSemaphore(max_pending)
+        super().__init__(socket_path, EventHandler)
+
+    def submit(self, event, webroot, name, path):
+        if not self.pending.acquire(blocking=False):
+            self.metrics.reject(event)
+            return False
+
+        self.executor.submit(self.run, event, webroot, name, path)
+        return True
+
+    def run(self, event, webroot, name, path):
+        start, ok = time.monotonic(), True
+        try:
+            run_event(event, webroot, name, path)
+        except Exception as e:
+            ok = False
+            print(f"{event} {name} failed: {e}", file=sys.stderr)
+        finally:
+            self.pending.release()
+            self.metrics.record(event, time.monotonic() - start, ok=ok)
+
+    def server_close(self):
+        super().server_close()
+        self.executor.shutdown(wait=True)
+
+
+def serve(socket_path, workers, max_pending):
+    try:
+        os.remove(socket_path)
+    except FileNotFoundError:
+        pass
+
+    server = EventServer(socket_path, workers, max_pending)
+    os.chmod(socket_path, 0o660)
+
+    def shutdown(signum, frame):
+        raise KeyboardInterrupt
+
+    signal.signal(signal.SIGTERM, shutdown)
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.remove(socket_path)
+
+
 def main():
     parser = ArgumentParser(description="RTMP exec actions")
-    parser.add_argument("-w", "--webroot", required=True)
-    parser.add_argument("-e", "--event", required=True)
-    parser.add_argument("-n", "--name", required=True)
+    parser.add_argument("-w", "--webroot")
+    parser.add_argument("-e", "--event")
+    parser.add_argument("-n", "--name")
     parser.add_argument("-p", "--path")
+    parser.add_argument("-d", "--daemon", action="store_true")
+    parser.add_argument("-s", "--socket", default="/run/rtmp-exec/rtmp-exec.sock")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--max-pending", type=int, default=1024)
     args = parser.parse_args()
 
-    if args.event in ("thumb_record_done", "vod_record_done") and not args.path:
+    if args.daemon:
+        serve(args.socket, args.workers, args.max_pending)
+        return
+
+    if not (args.webroot and args.event and args.name):
+        print("-w/--webroot, -e/--event and -n/--name are required", file=sys.stderr)
+        sys.exit(os.EX_USAGE)
+
+    if args.event in PATH_EVENTS and not args.path:
         print("-p/--path is required", file=sys.stderr)
         sys.exit(os.EX_USAGE)
 
-    if args.event == "live_publish_done":
-        live_publish_done(args.webroot, args.name)
-    elif args.event == "thumb_record_done":
-        thumb_record_done(args.webroot, args.name, args.path)
-    elif args.event == "vod_record_done":
-        vod_record_done(args.webroot, args.name, args.path)
-    else:
+    if args.event not in EVENTS:
         print(f"unknown event {args.event}", file=sys.stderr)
         sys.exit(os.EX_USAGE)
 
+    run_event(args.event, args.webroot, args.name, args.path)
+
 
 if __name__ == "__main__":
     main()
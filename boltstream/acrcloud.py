@@ -3,10 +3,11 @@ import time
 from base64 import b64encode
 from hashlib import sha1
 
-import requests
 from django.conf import settings
 from furl import furl
 
+from .metrics import http
+
 
 def get_signature(message):
     access_secret = settings.ACRCLOUD_CONSOLE_ACCESS_SECRET
@@ -46,16 +47,29 @@ def get_api_url(api_path):
     return furl(settings.ACRCLOUD_API_ENDPOINT).join(api_path).url
 
 
-def get_all_channels():
+def get_all_channels(page=1):
     api_path = f"/v1/buckets/{settings.ACRCLOUD_BUCKET_NAME}/channels"
     headers = get_headers("GET", api_path)
     url = get_api_url(api_path)
 
-    r = requests.get(url, headers=headers, verify=True)
+    r = http.get(url, headers=headers, params={"page": page}, verify=True)
     r.raise_for_status()
     return r.json()
 
 
+def iter_all_channels():
+    """Yield the channels of every page of the bucket's channel list."""
+    page = 1
+    while True:
+        resp = get_all_channels(page)
+        yield from resp.get("data") or []
+
+        meta = resp.get("meta") or {}
+        if not resp.get("data") or page >= meta.get("last_page", page):
+            return
+        page += 1
+
+
 def get_channel(stream):
     if not stream.acrcloud_acr_id:
         return None
@@ -64,7 +78,7 @@ def get_channel(stream):
     headers = get_headers("GET", api_path)
     url = get_api_url(api_path)
 
-    r = requests.get(url, headers=headers, verify=True)
+    r = http.get(url, headers=headers, verify=True)
     r.raise_for_status()
     return r.json()
 
@@ -82,7 +96,7 @@ def create_channel(stream):
         "custom_value[]": [str(stream.uuid), stream.started_at.isoformat()],
     }
 
-    r = requests.post(url, headers=headers, data=data, verify=True)
+    r = http.post(url, headers=headers, data=data, verify=True)
     r.raise_for_status()
     return r.json()
 
@@ -100,14 +114,18 @@ def update_channel(stream):
         "custom_value[]": [str(stream.uuid), stream.started_at.isoformat()],
     }
 
-    r = requests.put(url, headers=headers, data=data, verify=True)
+    r = http.put(url, headers=headers, data=data, verify=True)
     r.raise_for_status()
     return r.json()
 
 
 def delete_channel(stream):
-    api_path = f"/v1/channels/{stream.acrcloud_acr_id}"
+    delete_channel_by_acr_id(stream.acrcloud_acr_id)
+
+
+def delete_channel_by_acr_id(acr_id):
+    api_path = f"/v1/channels/{acr_id}"
     headers = get_headers("DELETE", api_path)
     url = get_api_url(api_path)
-    r = requests.delete(url, headers=headers, verify=True)
+    r = http.delete(url, headers=headers, verify=True)
     r.raise_for_status()
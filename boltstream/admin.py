@@ -3,11 +3,47 @@ import json
 from django.conf import settings
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin as DjangoUserAdmin
-from django.db.models import Count
-from django.utils.html import format_html
+from django.core.exceptions import PermissionDenied
+from django.db import transaction
+from django.db.models import Count, Max, Sum
+from django.http import HttpResponse
+from django.shortcuts import get_object_or_404
+from django.urls import path, reverse
+from django.utils.html import format_html, format_html_join
 from django.utils.translation import gettext as _
 
-from .models import Credit, Feed, FeedItem, Profile, Stream, User, Viewer
+from .models import (
+    Credit,
+    Feed,
+    FeedItem,
+    Profile,
+    Recording,
+    RequestProfile,
+    Stream,
+    StreamSession,
+    StreamSessionHour,
+    User,
+    Viewer,
+)
+from .tasks import publish_feed_items
+from .telemetry import FIELDS as TELEMETRY_FIELDS
+from .telemetry import get_samples
+
+
+def render_sparkline(values, width=240, height=32):
+    top = max(values) or 1
+    step = width / max(len(values) - 1, 1)
+    points = " ".join(
+        f"{i * step:.1f},{height - value / top * height:.1f}"
+        for i, value in enumerate(values)
+    )
+    return format_html(
+        '<svg width="{}" height="{}"><polyline points="{}" fill="none" '
+        'stroke="#417690" stroke-width="1" /></svg>',
+        width,
+        height,
+        points,
+    )
 
 
 class LiveNow(admin.SimpleListFilter):
@@ -57,6 +93,7 @@ class StreamAdmin(admin.ModelAdmin):
         "stream_manifest_url",
         "stream_image",
         "stream_info",
+        "stream_telemetry",
     )
 
     def get_queryset(self, request):
@@ -100,6 +137,146 @@ class StreamAdmin(admin.ModelAdmin):
 
     stream_info.short_description = _("Stream info")
 
+    def stream_telemetry(self, stream):
+        if not settings.TELEMETRY_ENABLED:
+            return "-"
+
+        samples = get_samples(stream)
+        if not samples["timestamps"]:
+            return "-"
+
+        rows = format_html_join(
+            "",
+            "<tr><th>{}</th><td>{}</td><td>{}</td></tr>",
+            (
+                (field, render_sparkline(samples[field]), f"{samples[field][-1]:g}")
+                for field in TELEMETRY_FIELDS
+            ),
+        )
+        return format_html("<table>{}</table>", rows)
+
+    stream_telemetry.short_description = _("Telemetry")
+
+
+class StreamSessionHourInline(admin.TabularInline):
+    model = StreamSessionHour
+    fields = ("hour", "peak_viewers", "viewer_minutes")
+    readonly_fields = fields
+    extra = 0
+    can_delete = False
+
+
+@admin.register(StreamSession)
+class StreamSessionAdmin(admin.ModelAdmin):
+    raw_id_fields = ("stream",)
+    search_fields = ("stream__uuid", "stream__user__username", "uuid")
+    list_display = (
+        "__str__",
+        "started_at",
+        "stopped_at",
+        "ingest_host",
+        "peak_viewers",
+        "viewer_minutes",
+    )
+    readonly_fields = ("uuid", "sync_offset")
+    inlines = (StreamSessionHourInline,)
+
+    def get_queryset(self, request):
+        qs = super().get_queryset(request)
+        return qs.annotate(
+            peak_viewers=Max("hours__peak_viewers"),
+            viewer_minutes=Sum("hours__viewer_minutes"),
+        )
+
+    def peak_viewers(self, session):
+        return session.peak_viewers or 0
+
+    peak_viewers.short_description = _("Peak viewers")
+    peak_viewers.admin_order_field = "peak_viewers"
+
+    def viewer_minutes(self, session):
+        return session.viewer_minutes or 0
+
+    viewer_minutes.short_description = _("Viewer minutes")
+    viewer_minutes.admin_order_field = "viewer_minutes"
+
+
+@admin.register(Recording)
+class RecordingAdmin(admin.ModelAdmin):
+    raw_id_fields = ("stream",)
+    search_fields = ("stream__uuid", "stream__user__username", "key")
+    list_display = (
+        "__str__",
+        "size",
+        "remux_seconds",
+        "upload_seconds",
+        "upload_bytes_per_second",
+        "uploaded_at",
+    )
+    readonly_fields = (
+        "uuid",
+        "key",
+        "size",
+        "remux_seconds",
+        "upload_seconds",
+        "uploaded_at",
+    )
+
+
+@admin.register(RequestProfile)
+class RequestProfileAdmin(admin.ModelAdmin):
+    raw_id_fields = ("user",)
+    search_fields = ("view_name", "path", "user__username")
+    list_display = (
+        "view_name",
+        "method",
+        "path",
+        "status",
+        "seconds",
+        "samples",
+        "user",
+        "created_at",
+    )
+    readonly_fields = (
+        "uuid",
+        "user",
+        "created_at",
+        "view_name",
+        "method",
+        "path",
+        "status",
+        "seconds",
+        "samples",
+        "download_stacks",
+        "stacks",
+    )
+
+    def has_add_permission(self, request):
+        return False
+
+    def get_urls(self):
+        return [
+            path(
+                "<int:pk>/stacks.txt",
+                self.admin_site.admin_view(self.stacks_view),
+                name="boltstream_requestprofile_stacks",
+            )
+        ] + super().get_urls()
+
+    def stacks_view(self, request, pk):
+        if not self.has_view_permission(request):
+            raise PermissionDenied
+        profile = get_object_or_404(RequestProfile, pk=pk)
+        resp = HttpResponse(profile.stacks, content_type="text/plain; charset=utf-8")
+        resp["Content-Disposition"] = f'attachment; filename="{profile.uuid}.txt"'
+        return resp
+
+    def download_stacks(self, profile):
+        url = reverse("admin:boltstream_requestprofile_stacks", args=(profile.pk,))
+        return format_html('<a href="{}">{}</a>', url, _("Download"))
+
+    download_stacks.short_description = _("Collapsed stacks")
+
 
 @admin.register(Credit)
 class CreditAdmin(admin.ModelAdmin):
@@ -163,3 +340,7 @@ class FeedItemAdmin(admin.ModelAdmin):
     list_display = ("feed", "starts_at", "ends_at")
     search_fields = ("feed__name",)
     raw_id_fields = ("feed",)
+
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        transaction.on_commit(lambda: publish_feed_items.delay([str(obj.uuid)]))
@@ -0,0 +1,30 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Q
+from django.utils import timezone
+
+from .models import StreamSessionHour
+
+
+def rollup_viewers(sessions, at=None):
+    """Record the concurrent viewer count of each of ``sessions`` into the
+    minute of ``at`` in their hourly buckets."""
+    if at is None:
+        at = timezone.now()
+
+    since = at - timedelta(seconds=settings.EXPIRE_VIEWER_SECONDS)
+    sessions = sessions.annotate(
+        viewer_count=Count(
+            "stream__viewers", filter=Q(stream__viewers__last_viewed_at__gt=since)
+        )
+    )
+    hour = at.replace(minute=0, second=0, microsecond=0)
+    for session in sessions:
+        with transaction.atomic():
+            bucket, _ = StreamSessionHour.objects.select_for_update().get_or_create(
+                session=session, hour=hour
+            )
+            bucket.set_viewers(at.minute, session.viewer_count)
+            bucket.save()
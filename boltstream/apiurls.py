@@ -1,11 +1,18 @@
 from django.urls import include, path
 from rest_framework.routers import DefaultRouter
 
-from .viewsets import AuthorizeKeyAccessView, StreamViewSet, UserViewSet
+from .viewsets import (
+    AuthorizeKeyAccessView,
+    FeedItemBulkView,
+    RecordingViewSet,
+    StreamViewSet,
+    UserViewSet,
+)
 
 router = DefaultRouter()
 router.register("users", UserViewSet)
 router.register("streams", StreamViewSet)
+router.register("recordings", RecordingViewSet)
 
 urlpatterns = [
     path("", include(router.urls)),
@@ -14,4 +21,9 @@ urlpatterns = [
         AuthorizeKeyAccessView.as_view(),
         name="authorize-key-access",
     ),
+    path(
+        "feeds/<feed_uuid>/items/bulk",
+        FeedItemBulkView.as_view(),
+        name="feed-items-bulk",
+    ),
 ]
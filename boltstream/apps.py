@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class BoltstreamAppConfig(AppConfig):
     name = "boltstream"
     verbose_name = "boltstream"
+
+    def ready(self):
+        from . import signals  # noqa
@@ -0,0 +1,93 @@
+import time
+
+import numpy as np
+
+from . import metrics
+
+# Full scale of signed 16-bit PCM samples
+PCM_FULL_SCALE = 32768.0
+
+
+# Bands of the coarse magnitude spectrum windows are compared by
+SPECTRUM_BANDS = 512
+
+
+def analyze_pcm(buf):
+    """Return the normalized RMS energy of ``buf`` and its magnitude spectrum
+    summed into ``SPECTRUM_BANDS`` bands, scaled to unit length."""
+    samples = np.frombuffer(buf, dtype="<i2", count=len(buf) // 2)
+    if not samples.size:
+        return 0.0, np.zeros(SPECTRUM_BANDS, dtype=np.float32)
+
+    samples = samples.astype(np.float32)
+    rms = float(np.sqrt(np.mean(np.square(samples)))) / PCM_FULL_SCALE
+
+    magnitudes = np.abs(np.fft.rfft(samples)).astype(np.float32)
+    edges = np.linspace(0, magnitudes.size, SPECTRUM_BANDS, endpoint=False)
+    bands = np.add.reduceat(magnitudes, edges.astype(int))
+    norm = float(np.linalg.norm(bands))
+    if norm:
+        bands /= norm
+    return rms, bands
+
+
+class SilenceGate:
+    """Decides whether a decoded PCM window is worth fingerprinting.
+
+    Windows that are silent, or whose energy and spectrum are unchanged from
+    the last fingerprinted window (a static slate), are skipped.  Comparing
+    with the last fingerprinted window rather than the previous one means
+    slow drift still adds up to a change.  At most ``max_skip_seconds`` pass
+    between fingerprints so the channel stays alive.  Skipped windows are
+    counted in ``boltstream.metrics`` under ``name``.
+    """
+
+    def __init__(self, rms_threshold, change_threshold, max_skip_seconds, name=""):
+        self.name = name
+        self.rms_threshold = rms_threshold
+        self.change_threshold = change_threshold
+        self.max_skip_seconds = max_skip_seconds
+        self.last_features = None
+        self.last_fingerprint_at = None
+        self.skipped_silent = 0
+        self.skipped_unchanged = 0
+
+    def is_unchanged(self, rms, spectrum):
+        """Whether the RMS changed by at most ``change_threshold`` of the last
+        fingerprinted window's and the spectra's cosine distance is at most
+        ``change_threshold``."""
+        if self.last_features is None:
+            return False
+
+        last_rms, last_spectrum = self.last_features
+        if not last_rms:
+            return False
+
+        distance = 1.0 - float(np.dot(spectrum, last_spectrum))
+        return (
+            abs(rms - last_rms) <= self.change_threshold * last_rms
+            and distance <= self.change_threshold
+        )
+
+    def should_fingerprint(self, buf, now=None):
+        if now is None:
+            now = time.monotonic()
+
+        rms, spectrum = analyze_pcm(buf)
+        silent = rms < self.rms_threshold
+        unchanged = not silent and self.is_unchanged(rms, spectrum)
+
+        if (silent or unchanged) and self.last_fingerprint_at is not None:
+            if now - self.last_fingerprint_at < self.max_skip_seconds:
+                if silent:
+                    self.skipped_silent += 1
+                    reason = "silent"
+                else:
+                    self.skipped_unchanged += 1
+                    reason = "unchanged"
+                metrics.fingerprint_windows_skipped.labels(self.name, reason).inc()
+                return False
+
+        self.last_features = (rms, spectrum)
+        self.last_fingerprint_at = now
+        return True
@@ -0,0 +1,126 @@
+import os
+import tempfile
+from subprocess import DEVNULL, run
+
+import numpy as np
+from django.conf import settings
+
+from .storage import get_s3_client
+
+# One row per video keyframe: presentation time in seconds and byte offset
+INDEX_DTYPE = np.dtype([("pts", "<f8"), ("pos", "<i8")])
+
+
+def build_index(path):
+    cmd = [
+        settings.FFPROBE_PATH,
+        "-v",
+        "error",
+        "-select_streams",
+        "v:0",
+        "-show_entries",
+        "packet=pts_time,pos,flags",
+        "-of",
+        "compact=p=0",
+        path,
+    ]
+    out = run(cmd, stdin=DEVNULL, capture_output=True, check=True, text=True).stdout
+
+    rows = []
+    for line in out.splitlines():
+        packet = dict(field.split("=", 1) for field in line.split("|"))
+        if "K" in packet.get("flags", "") and "N/A" not in (
+            packet.get("pts_time", "N/A"),
+            packet.get("pos", "N/A"),
+        ):
+            rows.append((float(packet["pts_time"]), int(packet["pos"])))
+
+    return np.array(rows, dtype=INDEX_DTYPE)
+
+
+def write_index(index, path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        np.save(f, index, allow_pickle=False)
+
+
+def load_index(path):
+    return np.load(path, mmap_mode="r", allow_pickle=False)
+
+
+def find_clip_range(index, start, end):
+    """Widen ``start``/``end`` to the surrounding keyframes.
+
+    Returns the keyframe times to cut at and the approximate size in bytes of
+    the range.  The end is None when the clip runs to the end of the recording.
+    """
+    if not len(index):
+        raise ValueError("Recording has no keyframes")
+
+    pts, pos = index["pts"], index["pos"]
+    i = max(int(np.searchsorted(pts, start, side="right")) - 1, 0)
+    j = int(np.searchsorted(pts, end, side="left"))
+
+    if j < len(pts):
+        return float(pts[i]), float(pts[j]), int(pos[j] - pos[i])
+    return float(pts[i]), None, None
+
+
+def get_recording_source(recording):
+    if recording.uploaded_at:
+        return get_s3_client().generate_presigned_url(
+            "get_object",
+            Params={"Bucket": settings.VOD_STORAGE_BUCKET_NAME, "Key": recording.key},
+            ExpiresIn=600,
+        )
+    return os.path.join(settings.WEB_ROOT, recording.key)
+
+
+def get_clip_key(recording, start, end):
+    end_ms = "end" if end is None else int(end * 1000)
+    return f"clips/{recording.uuid}/{int(start * 1000)}-{end_ms}.mp4"
+
+
+def get_clip_path(key):
+    return os.path.join(settings.WEB_ROOT, key)
+
+
+def get_clip_lock_key(key):
+    return f"clip-lock:{key}"
+
+
+def plan_clip(recording, start, end):
+    """Snap ``start``..``end`` seconds of ``recording`` to keyframes with its
+    index.  Returns the clip's key, the snapped range and its approximate
+    size in bytes."""
+    start, end, size = find_clip_range(load_index(recording.index_path), start, end)
+    return get_clip_key(recording, start, end), start, end, size
+
+
+def extract_clip(recording, start, end):
+    """Cut the keyframe range ``start``..``end`` out of ``recording`` by
+    stream copy, so ffmpeg seeks straight to the first packet instead of
+    scanning the file.  Clips are written once, through a unique temporary
+    file so identical requests never write to the same file."""
+    key = get_clip_key(recording, start, end)
+    dst = get_clip_path(key)
+    if os.path.exists(dst):
+        return key
+
+    os.makedirs(os.path.dirname(dst), exist_ok=True)
+    fd, tmp = tempfile.mkstemp(suffix=".mp4", dir=os.path.dirname(dst))
+    os.close(fd)
+    try:
+        cmd = [settings.FFMPEG_PATH, "-hide_banner", "-v", "error", "-y"]
+        cmd += ["-ss", f"{start:.3f}", "-i", get_recording_source(recording)]
+        if end is not None:
+            cmd += ["-t", f"{end - start:.3f}"]
+        cmd += ["-c", "copy", "-movflags", "+faststart", tmp]
+        run(cmd, stdin=DEVNULL, stdout=DEVNULL, check=True)
+        os.chmod(tmp, 0o644)
+        os.replace(tmp, dst)
+    except BaseException:
+        os.remove(tmp)
+        raise
+
+    return key
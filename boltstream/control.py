@@ -1,12 +1,14 @@
-import requests
 from django.conf import settings
 from django.urls import reverse
 from furl import furl
 from xmltodict import parse as parsexml
 
+from .metrics import http
+
 
 def build_url(host, path, scheme="http"):
-    return furl().set(scheme=scheme, host=host, path=path).url
+    # furl's host only takes a hostname, so hosts with a port are parsed
+    return furl(f"{scheme}://{host}").set(path=path).url
 
 
 def build_headers(headers=None):
@@ -19,15 +21,14 @@ def build_headers(headers=None):
 def drop_stream(stream):
     data = {"app": "app", "name": stream.uuid}
     url = build_url(stream.ingest_host, reverse("drop-stream"))
-    r = requests.post(url, headers=build_headers(), data=data)
+    r = http.post(url, headers=build_headers(), data=data)
     r.raise_for_status()
 
 
-def fetch_info(stream):
-    url = build_url(stream.ingest_host, reverse("stream-info"))
-    r = requests.get(url, headers=build_headers())
-    r.raise_for_status()
-    info = parsexml(r.text)
+def parse_streams(xml):
+    """Return the live ``app`` streams of an nginx-rtmp stat document keyed by
+    name."""
+    info = parsexml(xml)
     for app in info["rtmp"]["server"]["application"]:
         if app["name"] == "app" and "live" in app and "stream" in app["live"]:
             if hasattr(app["live"]["stream"], "items"):
@@ -35,6 +36,16 @@ def fetch_info(stream):
             else:
                 streams = app["live"]["stream"]
 
-            for s in streams:
-                if s["name"] == str(stream.uuid):
-                    return s
+            return {s["name"]: s for s in streams}
+    return {}
+
+
+def fetch_streams_info(host):
+    url = build_url(host, reverse("stream-info"))
+    r = http.get(url, headers=build_headers())
+    r.raise_for_status()
+    return parse_streams(r.text)
+
+
+def fetch_info(stream):
+    return fetch_streams_info(stream.ingest_host).get(str(stream.uuid))
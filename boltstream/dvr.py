@@ -0,0 +1,193 @@
+import os
+from datetime import timedelta
+from shutil import rmtree
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+from m3u8 import load as load_m3u8
+
+
+def get_index_key(stream):
+    return f"dvr:{stream.uuid}:index"
+
+
+def get_manifest_key(stream):
+    return f"dvr:{stream.uuid}:m3u8"
+
+
+def get_lock_key(stream):
+    return f"dvr:{stream.uuid}:lock"
+
+
+def get_bucket(program_date_time):
+    return program_date_time.strftime("%Y%m%d%H")
+
+
+def get_manifest(stream):
+    return cache.get(get_manifest_key(stream))
+
+
+def clear(stream):
+    cache.delete_many([get_index_key(stream), get_manifest_key(stream)])
+
+
+def make_index(stream, target_duration):
+    return {
+        "started_at": stream.started_at,
+        "target_duration": target_duration,
+        "last_sequence": -1,
+        "segments": [],
+    }
+
+
+def render_segment(segment):
+    lines = []
+    if segment["discontinuity"]:
+        lines.append("#EXT-X-DISCONTINUITY")
+    lines.append(f"#EXT-X-PROGRAM-DATE-TIME:{segment['program_date_time']}")
+    lines.append(f"#EXTINF:{segment['duration']:.3f},")
+    lines.append(segment["uri"])
+    return "\n".join(lines) + "\n"
+
+
+def render_manifest(index):
+    segments = index["segments"]
+    lines = [
+        "#EXTM3U",
+        "#EXT-X-VERSION:3",
+        f"#EXT-X-TARGETDURATION:{index['target_duration']}",
+        f"#EXT-X-MEDIA-SEQUENCE:{segments[0]['sequence'] if segments else 0}",
+    ]
+    body, key = [], None
+    for segment in segments:
+        if segment["key"] != key:
+            key = segment["key"]
+            if key:
+                body.append(f'#EXT-X-KEY:METHOD=AES-128,URI="{key}"\n')
+            else:
+                body.append("#EXT-X-KEY:METHOD=NONE\n")
+        body.append(segment["text"])
+    return "\n".join(lines) + "\n" + "".join(body)
+
+
+def link(src, dst):
+    os.makedirs(os.path.dirname(dst), exist_ok=True)
+    try:
+        os.link(src, dst)
+    except FileExistsError:
+        pass
+
+
+def add_segment(stream, index, sequence, segment):
+    """Hard link ``segment`` and its key into the stream's DVR directory,
+    where nginx-rtmp's HLS cleanup can't remove them, and append it to the
+    index."""
+    program_date_time = segment.current_program_date_time
+    name = os.path.basename(segment.uri)
+    bucket = get_bucket(program_date_time)
+    base = os.path.join("dvr", str(stream.uuid), bucket)
+    path = os.path.join(base, name)
+    link(
+        os.path.join(settings.WEB_ROOT, "live", str(stream.uuid), name),
+        os.path.join(settings.WEB_ROOT, path),
+    )
+
+    key = None
+    if segment.key and segment.key.uri:
+        key = os.path.join(base, os.path.basename(segment.key.uri))
+        link(
+            os.path.join(settings.WEB_ROOT, segment.key.uri.lstrip("/")),
+            os.path.join(settings.WEB_ROOT, key),
+        )
+        key = f"/{key}"
+
+    entry = {
+        "sequence": sequence,
+        "bucket": bucket,
+        "timestamp": program_date_time.timestamp(),
+        "program_date_time": program_date_time.isoformat(),
+        "duration": segment.duration,
+        "uri": f"/{path}",
+        "key": key,
+        "discontinuity": segment.discontinuity,
+    }
+    entry["text"] = render_segment(entry)
+    index["segments"].append(entry)
+    index["last_sequence"] = sequence
+
+
+def expire_segments(stream, index, now=None):
+    if now is None:
+        now = timezone.now()
+
+    cutoff = (now - timedelta(seconds=settings.DVR_WINDOW_SECONDS)).timestamp()
+    segments = index["segments"]
+    expired = 0
+    while expired < len(segments) and segments[expired]["timestamp"] < cutoff:
+        expired += 1
+
+    if expired:
+        buckets = {segment["bucket"] for segment in segments[:expired]}
+        del segments[:expired]
+        # Segments are stored in hourly buckets so retention removes whole
+        # directories instead of unlinking segment by segment.
+        for bucket in buckets - {segment["bucket"] for segment in segments[:1]}:
+            rmtree(
+                os.path.join(settings.WEB_ROOT, "dvr", str(stream.uuid), bucket),
+                ignore_errors=True,
+            )
+
+    return expired
+
+
+def index_segments(stream):
+    """Append the segments nginx-rtmp added to the live playlist since the last
+    run to the stream's DVR index, and re-render its sliding window playlist.
+
+    Skipped while another worker indexes the stream, as both would append
+    the same segments.
+    """
+    lock_key = get_lock_key(stream)
+    if not cache.add(lock_key, True, settings.DVR_LOCK_SECONDS):
+        return 0
+    try:
+        return _index_segments(stream)
+    finally:
+        cache.delete(lock_key)
+
+
+def _index_segments(stream):
+    path = os.path.join(settings.WEB_ROOT, "live", str(stream.uuid), "index.m3u8")
+    try:
+        playlist = load_m3u8(path)
+    except FileNotFoundError:
+        return 0
+
+    index = cache.get(get_index_key(stream))
+    if index is None or index["started_at"] != stream.started_at:
+        index = make_index(stream, playlist.target_duration)
+
+    added = 0
+    for offset, segment in enumerate(playlist.segments):
+        sequence = (playlist.media_sequence or 0) + offset
+        if sequence <= index["last_sequence"]:
+            continue
+        if not segment.current_program_date_time:
+            continue
+        try:
+            add_segment(stream, index, sequence, segment)
+        except FileNotFoundError:
+            continue
+        added += 1
+
+    expired = expire_segments(stream, index)
+    if added or expired:
+        cache.set_many(
+            {
+                get_index_key(stream): index,
+                get_manifest_key(stream): render_manifest(index),
+            },
+            None,
+        )
+    return added
@@ -0,0 +1,245 @@
+import os
+import threading
+from collections import deque
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+from xml.sax.saxutils import escape
+
+from django.conf import settings
+from django.urls import reverse
+from django.utils import timezone
+
+# A null MPEG-TS packet; segments only need to be the right shape on disk
+TS_PACKET = b"\x47\x1f\xff\x10" + b"\xff" * 184
+
+
+def make_stream_xml(name, meta):
+    return (
+        "<stream>"
+        f"<name>{escape(name)}</name>"
+        f"<time>{meta.get('time', 0)}</time>"
+        f"<bw_in>{meta.get('bw_in', 2500000)}</bw_in>"
+        f"<bw_out>{meta.get('bw_out', 2500000)}</bw_out>"
+        "<meta><video>"
+        f"<width>{meta.get('width', 1280)}</width>"
+        f"<height>{meta.get('height', 720)}</height>"
+        f"<frame_rate>{meta.get('frame_rate', 30)}</frame_rate>"
+        "<codec>H264</codec>"
+        "</video><audio><codec>AAC</codec><sample_rate>44100</sample_rate>"
+        "<channels>2</channels></audio></meta>"
+        f"<nclients>{meta.get('nclients', 1)}</nclients>"
+        "<publishing/><active/>"
+        "</stream>"
+    )
+
+
+def make_stat_xml(streams):
+    """Return an ``rtmp_stat all`` document with ``streams`` (a mapping of
+    stream name to metadata) publishing to the ``app`` application."""
+    app_streams = "".join(make_stream_xml(name, meta) for name, meta in streams)
+    return (
+        '<?xml version="1.0" encoding="utf-8" ?>'
+        "<rtmp><server>"
+        f"<application><name>app</name><live>{app_streams}"
+        f"<nclients>{len(streams)}</nclients></live></application>"
+        "<application><name>live</name><live><nclients>0</nclients></live>"
+        "</application>"
+        "</server></rtmp>"
+    )
+
+
+class FakeIngestHandler(BaseHTTPRequestHandler):
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_body(self, status, body, content_type="text/plain"):
+        body = body.encode()
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def is_authorized(self):
+        return self.headers.get("X-RTMP-Secret") == settings.RTMP_SECRET
+
+    def do_GET(self):
+        if self.path.startswith("/live/") and self.server.web_root:
+            return self.send_file()
+        if self.path != reverse("stream-info"):
+            return self.send_body(404, "Not found")
+        if not self.is_authorized():
+            return self.send_body(403, "Forbidden")
+
+        xml = make_stat_xml(self.server.get_streams())
+        self.send_body(200, xml, "text/xml")
+
+    def send_file(self):
+        path = os.path.normpath(self.path.split("?", 1)[0]).lstrip("/")
+        try:
+            with open(os.path.join(self.server.web_root, path), "rb") as f:
+                body = f.read()
+        except (FileNotFoundError, IsADirectoryError):
+            return self.send_body(404, "Not found")
+
+        content_type = "video/mp2t"
+        if path.endswith(".m3u8"):
+            content_type = "application/vnd.apple.mpegurl"
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        if self.path != reverse("drop-stream"):
+            return self.send_body(404, "Not found")
+        if not self.is_authorized():
+            return self.send_body(403, "Forbidden")
+
+        length = int(self.headers.get("Content-Length") or 0)
+        data = parse_qs(self.rfile.read(length).decode())
+        name = data.get("name", [""])[0]
+        dropped = self.server.drop(name)
+        self.send_body(200, str(int(dropped)))
+
+
+class FakeIngestServer(ThreadingHTTPServer):
+    """Serve the ingest host's ``/stream-info`` stat XML and honor
+    ``/stream-control/drop/publisher`` for the streams it is publishing.
+
+    ``on_drop`` is called with a dropped stream's name from a new thread,
+    the way nginx-rtmp fires ``on_publish_done`` after answering the
+    control request.  HLS files under ``web_root`` are served at ``/live/``.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address=("127.0.0.1", 0), web_root=None, on_drop=None):
+        super().__init__(address, FakeIngestHandler)
+        self.web_root = web_root
+        self.on_drop = on_drop
+        self.lock = threading.Lock()
+        self.streams = {}
+        self.dropped = []
+
+    @property
+    def host(self):
+        host, port = self.server_address[:2]
+        return f"{host}:{port}"
+
+    def publish(self, name, **meta):
+        with self.lock:
+            self.streams[name] = meta
+
+    def unpublish(self, name):
+        with self.lock:
+            return self.streams.pop(name, None) is not None
+
+    def drop(self, name):
+        if not self.unpublish(name):
+            return False
+
+        self.dropped.append(name)
+        if self.on_drop:
+            threading.Thread(target=self.on_drop, args=(name,), daemon=True).start()
+        return True
+
+    def get_streams(self):
+        with self.lock:
+            return list(self.streams.items())
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return thread
+
+
+class HlsWriter:
+    """Write rolling ``live/<name>/index.m3u8`` playlists, with
+    ``#EXT-X-PROGRAM-DATE-TIME`` and key rotation, under ``web_root``."""
+
+    def __init__(
+        self,
+        web_root,
+        segment_seconds=2,
+        playlist_segments=5,
+        fragments_per_key=3,
+        segment_packets=16,
+    ):
+        self.web_root = web_root
+        self.segment_seconds = segment_seconds
+        self.playlist_segments = playlist_segments
+        self.fragments_per_key = fragments_per_key
+        self.segment = TS_PACKET * segment_packets
+        self.streams = {}
+
+    def get_dir(self, name):
+        return os.path.join(self.web_root, "live", name)
+
+    def add(self, name):
+        os.makedirs(self.get_dir(name), exist_ok=True)
+        self.streams[name] = {"sequence": 0, "segments": deque()}
+
+    def remove(self, name):
+        state = self.streams.pop(name, None)
+        if state is None:
+            return
+        for sequence, _pdt in state["segments"]:
+            self.unlink(name, f"{sequence}.ts")
+        self.unlink(name, "index.m3u8")
+
+    def unlink(self, name, filename):
+        try:
+            os.remove(os.path.join(self.get_dir(name), filename))
+        except FileNotFoundError:
+            pass
+
+    def render(self, name, segments):
+        first = segments[0][0]
+        lines = [
+            "#EXTM3U",
+            "#EXT-X-VERSION:3",
+            f"#EXT-X-MEDIA-SEQUENCE:{first}",
+            f"#EXT-X-TARGETDURATION:{self.segment_seconds}",
+        ]
+        for sequence, pdt in segments:
+            if sequence == first or sequence % self.fragments_per_key == 0:
+                key = sequence // self.fragments_per_key
+                lines.append(
+                    f'#EXT-X-KEY:METHOD=AES-128,URI="/keys/{name}/{key}.key",'
+                    f"IV=0x{sequence:032x}"
+                )
+            lines.append(
+                "#EXT-X-PROGRAM-DATE-TIME:" + pdt.isoformat(timespec="milliseconds")
+            )
+            lines.append(f"#EXTINF:{self.segment_seconds:.3f},")
+            lines.append(f"{sequence}.ts")
+        return "\n".join(lines) + "\n"
+
+    def tick(self, now=None):
+        """Append one segment to every stream's playlist."""
+        if now is None:
+            now = timezone.now()
+        pdt = now - timedelta(seconds=self.segment_seconds)
+
+        for name, state in list(self.streams.items()):
+            sequence = state["sequence"]
+            state["sequence"] += 1
+            with open(os.path.join(self.get_dir(name), f"{sequence}.ts"), "wb") as f:
+                f.write(self.segment)
+
+            segments = state["segments"]
+            segments.append((sequence, pdt))
+            while len(segments) > self.playlist_segments:
+                expired, _pdt = segments.popleft()
+                self.unlink(name, f"{expired}.ts")
+
+            path = os.path.join(self.get_dir(name), "index.m3u8")
+            with open(f"{path}.tmp", "w") as f:
+                f.write(self.render(name, segments))
+            os.replace(f"{path}.tmp", path)
@@ -4,6 +4,10 @@ from django_filters import CharFilter, FilterSet
 from .models import Stream
 
 
+def normalize_search(value):
+    return " ".join(value.lower().split())
+
+
 class StreamFilter(FilterSet):
 
     search = CharFilter(method="filter_streams")
@@ -13,6 +17,7 @@ class StreamFilter(FilterSet):
         fields = ("search",)
 
     def filter_streams(self, queryset, name, value):
+        value = normalize_search(value)
         q = (
             Q(title__icontains=value)
             | Q(user__username__icontains=value)
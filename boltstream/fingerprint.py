@@ -0,0 +1,89 @@
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from multiprocessing import get_context
+from multiprocessing.shared_memory import SharedMemory
+
+import acrcloud_stream_decode
+
+
+def create_fingerprint(shm_name, size):
+    shm = SharedMemory(name=shm_name)
+    try:
+        buf = bytes(shm.buf[:size])
+    finally:
+        shm.close()
+    return acrcloud_stream_decode.create_fingerprint(buf, False)
+
+
+def release(shm):
+    shm.close()
+    shm.unlink()
+
+
+class SharedWindow:
+    """A shared memory segment holding the PCM window of one stream.
+
+    ``future`` is the fingerprint task reading the segment; the segment is
+    not written to or unlinked until that task is done.
+    """
+
+    def __init__(self, size):
+        self.shm = SharedMemory(create=True, size=size)
+        self.future = None
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    @property
+    def busy(self):
+        return self.future is not None and not self.future.done()
+
+    def write(self, buf):
+        if self.busy:
+            raise RuntimeError("window is still being fingerprinted")
+        if len(buf) > self.shm.size:
+            release(self.shm)
+            self.shm = SharedMemory(create=True, size=len(buf))
+        self.shm.buf[: len(buf)] = buf
+        return len(buf)
+
+    def close(self):
+        if self.busy:
+            shm = self.shm
+            self.future.add_done_callback(lambda future: release(shm))
+        else:
+            release(self.shm)
+
+
+class FingerprintPool:
+    """Runs ``create_fingerprint`` in worker processes, outside of the GIL.
+
+    Workers are started from a forkserver so they don't inherit the decode
+    threads of the parent, and PCM windows are handed over by shared memory
+    name rather than pickled.
+    """
+
+    def __init__(self, max_workers=None, timeout=None):
+        self.timeout = timeout
+        self.executor = ProcessPoolExecutor(
+            max_workers=max_workers, mp_context=get_context("forkserver")
+        )
+
+    def create_fingerprint(self, window, buf):
+        """Fingerprint ``buf`` through ``window``.  Returns None without
+        queuing anything while a timed out task still holds the window, so
+        stale tasks can't pile up behind a stuck worker."""
+        if window.busy:
+            return None
+
+        size = window.write(buf)
+        window.future = self.executor.submit(create_fingerprint, window.name, size)
+        try:
+            return window.future.result(timeout=self.timeout)
+        except TimeoutError:
+            # Drops the task if no worker has picked it up yet
+            window.future.cancel()
+            raise
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
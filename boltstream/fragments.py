@@ -0,0 +1,24 @@
+import time
+
+from django.core.cache import cache
+
+LIVE_VERSION_KEY = "live-version"
+
+
+def get_live_version():
+    """Return the version of the live set, which fragments listing live
+    streams are keyed on."""
+    version = cache.get(LIVE_VERSION_KEY)
+    if version is None:
+        # Start from the clock so a lost version never revives old fragments
+        version = int(time.time())
+        if not cache.add(LIVE_VERSION_KEY, version, None):
+            version = cache.get(LIVE_VERSION_KEY, version)
+    return version
+
+
+def bump_live_version():
+    try:
+        cache.incr(LIVE_VERSION_KEY)
+    except ValueError:
+        cache.set(LIVE_VERSION_KEY, int(time.time()), None)
@@ -0,0 +1,143 @@
+import json
+
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .models import FeedItem
+
+MAX_ERRORS = 100
+
+
+class InvalidItem(ValueError):
+    pass
+
+
+def iter_ndjson(stream):
+    for lineno, line in enumerate(iter(stream.readline, b""), 1):
+        line = line.strip()
+        if line:
+            yield lineno, line
+
+
+def parse_date(data, field):
+    try:
+        value = parse_datetime(data[field])
+    except KeyError:
+        raise InvalidItem(f"{field} is required")
+    except (TypeError, ValueError):
+        value = None
+
+    if value is None:
+        raise InvalidItem(f"{field} is not a valid date")
+    if timezone.is_naive(value):
+        raise InvalidItem(f"{field} must include a UTC offset")
+    return value
+
+
+def parse_item(feed, data):
+    if not isinstance(data, dict):
+        raise InvalidItem("item must be an object")
+
+    starts_at = parse_date(data, "starts_at")
+    ends_at = parse_date(data, "ends_at")
+    if ends_at < starts_at:
+        raise InvalidItem("ends_at is before starts_at")
+
+    external_id = data.get("id")
+    if external_id is not None:
+        external_id = str(external_id)
+        if len(external_id) > 200:
+            raise InvalidItem("id is longer than 200 characters")
+
+    item = FeedItem(
+        feed=feed,
+        starts_at=starts_at,
+        ends_at=ends_at,
+        payload=data.get("payload", {}),
+        external_id=external_id,
+    )
+    # bulk_create() skips the pre_save signal
+    item.cue = item.encode_cue()
+    return item
+
+
+def save_chunk(feed, items):
+    """Create ``items``, skipping any whose external ID already exists in the
+    chunk or the feed.  Returns only the items actually inserted."""
+    seen, unique = set(), []
+    for item in items:
+        if item.external_id is not None:
+            if item.external_id in seen:
+                continue
+            seen.add(item.external_id)
+        unique.append(item)
+
+    existing = set()
+    if seen:
+        existing = set(
+            feed.items.filter(external_id__in=seen).values_list(
+                "external_id", flat=True
+            )
+        )
+
+    new = [item for item in unique if item.external_id not in existing]
+    FeedItem.objects.bulk_create(new, ignore_conflicts=True)
+
+    # A concurrent request may have inserted some of the same external IDs
+    # since the check above, and ignore_conflicts doesn't say which rows it
+    # skipped, so look up the new UUIDs to find the ones actually inserted.
+    inserted = set(
+        FeedItem.objects.filter(uuid__in=[item.uuid for item in new]).values_list(
+            "uuid", flat=True
+        )
+    )
+    return [item for item in new if item.uuid in inserted]
+
+
+def ingest_feed_items(feed, records, chunk_size):
+    """Validate and bulk create feed items from ``(lineno, data)`` records.
+
+    ``data`` is either a decoded JSON value or a raw JSON line.  Items are
+    written every ``chunk_size`` records and the accept/reject counts of each
+    chunk are reported.
+    """
+    result = {
+        "accepted": 0,
+        "duplicates": 0,
+        "rejected": 0,
+        "batches": [],
+        "errors": [],
+        "created": [],
+    }
+    chunk, rejected = [], 0
+
+    def flush():
+        created = save_chunk(feed, chunk)
+        batch = {
+            "accepted": len(created),
+            "duplicates": len(chunk) - len(created),
+            "rejected": rejected,
+        }
+        for key, value in batch.items():
+            result[key] += value
+        result["batches"].append(batch)
+        result["created"].extend(str(item.uuid) for item in created)
+
+    for lineno, data in records:
+        try:
+            if isinstance(data, (bytes, str)):
+                data = json.loads(data)
+            chunk.append(parse_item(feed, data))
+        except ValueError as e:
+            rejected += 1
+            if len(result["errors"]) < MAX_ERRORS:
+                result["errors"].append({"line": lineno, "error": str(e)})
+
+        if len(chunk) + rejected >= chunk_size:
+            flush()
+            chunk, rejected = [], 0
+
+    if chunk or rejected:
+        flush()
+
+    return result
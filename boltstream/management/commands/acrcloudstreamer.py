@@ -2,18 +2,189 @@ import logging
 import socket
 import struct
 import time
+from collections import deque
 from multiprocessing import Process
-from queue import Queue
-from threading import Event, Thread
+from threading import Condition, Event, Lock, Thread
 
 import acrcloud_stream_decode
+from django.conf import settings
 from django.core.management import BaseCommand
 
-from boltstream import acrcloud
+from boltstream import acrcloud, metrics
+from boltstream.audio import SilenceGate
+from boltstream.fingerprint import FingerprintPool, SharedWindow
 from boltstream.models import Stream
 
 logger = logging.getLogger(__name__)
 
+# Bytes of decoded PCM per second of audio
+SAMPLE_CONST = 16000
+FINGERPRINT_MAX_TIME = 12
+
+
+class MemoryBudget:
+    """Tracks the PCM bytes queued across every stream in this process."""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.used = 0
+        self.lock = Lock()
+
+    def exceeded(self, size=0):
+        with self.lock:
+            return self.used + size > self.max_bytes
+
+    def add(self, size):
+        with self.lock:
+            self.used += size
+
+    def release(self, size):
+        with self.lock:
+            self.used -= size
+
+
+class AudioQueue:
+    """Bounded queue of decoded PCM chunks between decode and fingerprinting.
+
+    When the queue is full the policy decides what happens to a new chunk:
+    ``block`` waits for the fingerprinter, ``drop_oldest`` discards the oldest
+    queued chunk and ``coalesce`` appends to the newest queued chunk, keeping
+    at most ``max_chunk_bytes`` of it.
+
+    The process-wide ``budget`` is applied the same way: ``block`` waits until
+    other queues release enough of it, while the other policies shed queued
+    chunks oldest-first and drop the new chunk when nothing is left to shed.
+    Dropped and coalesced audio is counted in ``boltstream.metrics`` under
+    ``name``.
+    """
+
+    POLICY_BLOCK = "block"
+    POLICY_DROP_OLDEST = "drop_oldest"
+    POLICY_COALESCE = "coalesce"
+    POLICY_CHOICES = (POLICY_BLOCK, POLICY_DROP_OLDEST, POLICY_COALESCE)
+
+    # Other queues release the budget without notifying this one
+    BUDGET_WAIT_SECONDS = 0.1
+
+    def __init__(
+        self, maxsize, policy=POLICY_BLOCK, max_chunk_bytes=None, budget=None, name=""
+    ):
+        if policy not in self.POLICY_CHOICES:
+            raise ValueError(f"unknown queue policy {policy!r}")
+
+        self.chunks = deque()
+        self.maxsize = maxsize
+        self.policy = policy
+        self.max_chunk_bytes = max_chunk_bytes
+        self.budget = budget
+        self.name = name
+        self.lock = Lock()
+        self.not_empty = Condition(self.lock)
+        self.not_full = Condition(self.lock)
+        self.dropped_bytes = 0
+        self.coalesced_bytes = 0
+
+    def __len__(self):
+        with self.lock:
+            return len(self.chunks)
+
+    @property
+    def dropped_seconds(self):
+        return self.dropped_bytes / SAMPLE_CONST
+
+    @property
+    def coalesced_seconds(self):
+        return self.coalesced_bytes / SAMPLE_CONST
+
+    def put(self, buf, timeout=None):
+        """Queue ``buf``, returning False if a blocking put timed out."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        blocking = self.policy == self.POLICY_BLOCK
+
+        with self.lock:
+            # Other streams' queues can use up the budget while this one
+            # waits, so it is checked again after every wait.
+            while True:
+                if not blocking:
+                    self._shed(len(buf))
+                over_budget = self.budget is not None and self.budget.exceeded(len(buf))
+                if not over_budget and len(self.chunks) < self.maxsize:
+                    break
+
+                if blocking:
+                    remaining = None
+                    if deadline is not None:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            return False
+                    if over_budget and (
+                        remaining is None or remaining > self.BUDGET_WAIT_SECONDS
+                    ):
+                        remaining = self.BUDGET_WAIT_SECONDS
+                    self.not_full.wait(remaining)
+                elif over_budget:
+                    self._count_dropped(len(buf), "budget")
+                    return True
+                elif self.policy == self.POLICY_DROP_OLDEST:
+                    self._drop_oldest("policy")
+                else:
+                    self._coalesce(buf)
+                    return True
+
+            self._append(buf)
+            return True
+
+    def get(self, timeout=None):
+        """Return the oldest chunk, or None if ``timeout`` expired first."""
+        with self.lock:
+            if not self.not_empty.wait_for(lambda: self.chunks, timeout):
+                return None
+
+            buf = self.chunks.popleft()
+            if self.budget is not None:
+                self.budget.release(len(buf))
+            self.not_full.notify()
+            return buf
+
+    def _append(self, buf):
+        self.chunks.append(buf)
+        if self.budget is not None:
+            self.budget.add(len(buf))
+        self.not_empty.notify()
+
+    def _count_dropped(self, size, reason):
+        self.dropped_bytes += size
+        metrics.audio_dropped_seconds.labels(self.name, reason).inc(size / SAMPLE_CONST)
+
+    def _drop_oldest(self, reason):
+        buf = self.chunks.popleft()
+        if self.budget is not None:
+            self.budget.release(len(buf))
+        self._count_dropped(len(buf), reason)
+        self.not_full.notify()
+
+    def _coalesce(self, buf):
+        last = self.chunks.pop()
+        if self.budget is not None:
+            self.budget.release(len(last))
+
+        merged = last + buf
+        if self.max_chunk_bytes and len(merged) > self.max_chunk_bytes:
+            start = len(merged) - self.max_chunk_bytes
+            self._count_dropped(start, "policy")
+            merged = merged[start:]
+
+        self.coalesced_bytes += len(buf)
+        metrics.audio_coalesced_seconds.labels(self.name).inc(len(buf) / SAMPLE_CONST)
+        self._append(merged)
+
+    def _shed(self, size):
+        if self.budget is None:
+            return
+
+        while self.chunks and self.budget.exceeded(size):
+            self._drop_oldest("budget")
+
 
 class DecodeWorker(Thread):
     def __init__(self, stream, channel, queue):
@@ -57,22 +228,34 @@ class DecodeWorker(Thread):
         if self.stopped.is_set():
             return 1
 
-        self.queue.put(buf)
+        while not self.queue.put(buf, timeout=1.0):
+            if self.stopped.is_set():
+                return 1
+
         return 0
 
 
 class FingerprintWorker(Thread):
-    def __init__(self, stream, channel, queue):
+    def __init__(self, stream, channel, queue, pool=None):
         super().__init__()
         self.daemon = True
         self.stream = stream
         self.channel = channel
         self.queue = queue
+        self.pool = pool
+        self.window = None
+        self.fingerprints = 0
+        self.gate = SilenceGate(
+            settings.ACRCLOUD_STREAMER_SILENCE_RMS,
+            settings.ACRCLOUD_STREAMER_UNCHANGED_THRESHOLD,
+            settings.ACRCLOUD_STREAMER_MAX_SKIP_SECONDS,
+            name=str(stream.uuid),
+        )
         self.stopped = Event()
 
-        self.sample_const = 16000  # ???
+        self.sample_const = SAMPLE_CONST
         self.fingerprint_time = 6
-        self.fingerprint_max_time = 12
+        self.fingerprint_max_time = FINGERPRINT_MAX_TIME
         self.fingerprint_interval = 2
         self.doc_pre_time = self.fingerprint_time - self.fingerprint_interval  # ???
         self.upload_timeout = 10
@@ -81,15 +264,48 @@ class FingerprintWorker(Thread):
         self.stopped.set()
 
     def run(self):
+        if self.pool is not None:
+            self.window = SharedWindow(
+                (self.fingerprint_max_time + self.fingerprint_interval)
+                * self.sample_const
+            )
+
+        try:
+            self.fingerprint_loop()
+        finally:
+            if self.window is not None:
+                self.window.close()
+
+    def create_fingerprint(self, buf):
+        if self.pool is None:
+            return acrcloud_stream_decode.create_fingerprint(buf, False)
+        return self.pool.create_fingerprint(self.window, buf)
+
+    def fingerprint_loop(self):
         last_buf = b""
 
         while not self.stopped.is_set():
             live_upload = True
-            buf = self.queue.get()
+            buf = self.queue.get(timeout=1.0)
+            if buf is None:
+                continue
+
             cur_buf = last_buf + buf
             last_buf = cur_buf
 
-            fingerprint = acrcloud_stream_decode.create_fingerprint(cur_buf, False)
+            if not self.gate.should_fingerprint(buf):
+                if len(last_buf) > self.doc_pre_time * self.sample_const:
+                    idx = -1 * self.doc_pre_time * self.sample_const
+                    last_buf = last_buf[idx:]
+                continue
+
+            try:
+                fingerprint = self.create_fingerprint(cur_buf)
+            except Exception as e:
+                logger.exception(e)
+                fingerprint = None
+            else:
+                self.fingerprints += 1
 
             if fingerprint:
                 try:
@@ -125,36 +341,72 @@ class FingerprintWorker(Thread):
 
 
 class LiveStreamWorker:
-    def __init__(self, stream, channel):
-        queue = Queue()
-        self.decode_worker = DecodeWorker(stream, channel, queue)
-        self.fingerprint_worker = FingerprintWorker(stream, channel, queue)
+    def __init__(self, stream, channel, budget=None, pool=None):
+        self.stream = stream
+        self.queue = AudioQueue(
+            settings.ACRCLOUD_STREAMER_QUEUE_SIZE,
+            policy=settings.ACRCLOUD_STREAMER_QUEUE_POLICY,
+            max_chunk_bytes=FINGERPRINT_MAX_TIME * SAMPLE_CONST,
+            budget=budget,
+            name=str(stream.uuid),
+        )
+        self.decode_worker = DecodeWorker(stream, channel, self.queue)
+        self.fingerprint_worker = FingerprintWorker(
+            stream, channel, self.queue, pool=pool
+        )
 
     def start(self):
         self.decode_worker.start()
         self.fingerprint_worker.start()
 
-    def join(self):
-        self.decode_worker.join()
-        self.fingerprint_worker.join()
+    def join(self, timeout=None):
+        self.decode_worker.join(timeout)
+        self.fingerprint_worker.join(timeout)
+
+    def is_alive(self):
+        return self.decode_worker.is_alive() or self.fingerprint_worker.is_alive()
+
+    def log_stats(self):
+        logger.info(
+            f"stream={self.stream.uuid}, queued={len(self.queue)}, "
+            f"fingerprints={self.fingerprint_worker.fingerprints}, "
+            f"skipped_silent={self.fingerprint_worker.gate.skipped_silent}, "
+            f"skipped_unchanged={self.fingerprint_worker.gate.skipped_unchanged}, "
+            f"dropped_seconds={self.queue.dropped_seconds:.1f}, "
+            f"coalesced_seconds={self.queue.coalesced_seconds:.1f}"
+        )
 
 
 class LiveStreamManagerProcess(Process):
+    # Not a daemon: daemonic processes can't start the fingerprint pool workers.
     def __init__(self, streams_channels):
         super().__init__()
-        self.daemon = True
         self.workers = []
         self.streams_channels = streams_channels
 
     def run(self):
-        for stream, channel in self.streams_channels.items():
-            worker = LiveStreamWorker(stream, channel)
-            worker.start()
-            self.workers.append(worker)
-
-        while self.workers:
-            for worker in self.workers:
-                worker.join()
+        budget = MemoryBudget(settings.ACRCLOUD_STREAMER_MAX_QUEUED_BYTES)
+        pool = None
+        if settings.ACRCLOUD_STREAMER_FINGERPRINT_PROCESSES:
+            pool = FingerprintPool(
+                max_workers=settings.ACRCLOUD_STREAMER_FINGERPRINT_PROCESSES,
+                timeout=settings.ACRCLOUD_STREAMER_FINGERPRINT_TIMEOUT,
+            )
+
+        try:
+            for stream, channel in self.streams_channels.items():
+                worker = LiveStreamWorker(stream, channel, budget=budget, pool=pool)
+                worker.start()
+                self.workers.append(worker)
+
+            while self.workers:
+                time.sleep(settings.ACRCLOUD_STREAMER_STATS_INTERVAL)
+                for worker in self.workers:
+                    worker.log_stats()
+                self.workers = [w for w in self.workers if w.is_alive()]
+        finally:
+            if pool is not None:
+                pool.shutdown()
 
 
 class Command(BaseCommand):
@@ -163,7 +415,7 @@ class Command(BaseCommand):
 
     def handle(self, *args, **kwargs):
         streams = Stream.objects.live().filter(acrcloud_acr_id__isnull=False)
-        streams_channels = {
-            stream: acrcloud.get_channel(stream.acrcloud_acr_id) for stream in streams
-        }
-        LiveStreamManagerProcess(streams_channels)
+        streams_channels = {stream: acrcloud.get_channel(stream) for stream in streams}
+        manager = LiveStreamManagerProcess(streams_channels)
+        manager.start()
+        manager.join()
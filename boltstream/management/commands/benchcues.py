@@ -0,0 +1,102 @@
+import json
+from datetime import timedelta
+from time import perf_counter
+
+from django.core.management import BaseCommand
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+from django.utils.translation import gettext as _
+from webvtt import Caption, WebVTT
+
+from boltstream.models import FeedItem
+from boltstream.views import FeedWebVTTView
+from boltstream.vtt import iter_webvtt
+
+
+def make_items(count, epoch):
+    items = []
+    for i in range(count):
+        starts_at = epoch + timedelta(seconds=i)
+        item = FeedItem(
+            starts_at=starts_at,
+            ends_at=starts_at + timedelta(seconds=5),
+            payload={
+                "id": i,
+                "type": "shotmade",
+                "description": "Jump shot made from 18 feet",
+                "clock": "07:42",
+                "home_points": 52,
+                "away_points": 48,
+                "attribution": {"name": "Home", "market": "City"},
+            },
+        )
+        item.cue = item.encode_cue()
+        items.append(item)
+    return items
+
+
+def render_payload(view, epoch, items):
+    """The previous rendering path, encoding every payload per request."""
+    webvtt = WebVTT()
+    for item in items:
+        start_timecode = view.get_vtt_timecode(epoch, item.starts_at)
+        end_timecode = view.get_vtt_timecode(epoch, item.ends_at)
+        data = {
+            "uuid": item.uuid,
+            "starts_at": item.starts_at.isoformat(),
+            "ends_at": item.ends_at.isoformat(),
+            "start_timecode": start_timecode,
+            "end_timecode": end_timecode,
+            "payload": item.payload,
+        }
+        cap = Caption(
+            start_timecode, end_timecode, [json.dumps(data, cls=DjangoJSONEncoder)]
+        )
+        webvtt.captions.append(cap)
+    return webvtt.content
+
+
+def render_cue(view, epoch, items):
+    webvtt = WebVTT()
+    for item in items:
+        start_timecode = view.get_vtt_timecode(epoch, item.starts_at)
+        end_timecode = view.get_vtt_timecode(epoch, item.ends_at)
+        text = view.get_cue_text(start_timecode, end_timecode, item.cue)
+        webvtt.captions.append(Caption(start_timecode, end_timecode, [text]))
+    return webvtt.content
+
+
+def render_direct(view, epoch, items):
+    items = ((item.starts_at, item.ends_at, item.cue) for item in items)
+    return "".join(iter_webvtt(view.iter_cues(epoch, items)))
+
+
+class Command(BaseCommand):
+
+    help = _("Benchmark WebVTT cue rendering")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "-n", "--items", type=int, default=1000, help=_("Cues per rendering")
+        )
+        parser.add_argument(
+            "-r", "--repeat", type=int, default=20, help=_("Renderings per method")
+        )
+
+    def handle(self, *args, **kwargs):
+        view = FeedWebVTTView()
+        epoch = timezone.now()
+        items = make_items(kwargs["items"], epoch)
+
+        methods = (
+            ("payload", render_payload),
+            ("cue", render_cue),
+            ("direct", render_direct),
+        )
+        for name, render in methods:
+            t = perf_counter()
+            for _i in range(kwargs["repeat"]):
+                render(view, epoch, items)
+            elapsed = perf_counter() - t
+            rate = kwargs["items"] * kwargs["repeat"] / elapsed
+            self.stdout.write(f"{name}: {rate:.0f} cues/sec")
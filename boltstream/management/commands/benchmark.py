@@ -0,0 +1,222 @@
+import json
+import os
+import tempfile
+import threading
+from datetime import timedelta
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from time import perf_counter
+
+from django.contrib.auth import get_user_model
+from django.core.management import BaseCommand, CommandError
+from django.db import connection
+from django.test import RequestFactory
+from django.test.utils import setup_test_environment, teardown_test_environment
+from django.utils import timezone
+from django.utils.translation import gettext as _
+from rest_framework.request import Request
+from rest_framework.versioning import URLPathVersioning
+
+from boltstream.control import parse_streams
+from boltstream.fakeingest import HlsWriter, make_stat_xml
+from boltstream.manifests import make_feed_manifest, make_master_manifest
+from boltstream.models import Feed, FeedItem, Stream
+from boltstream.serializers import StreamSerializer
+from boltstream.views import FeedWebVTTView
+from boltstream.vtt import iter_webvtt
+
+User = get_user_model()
+
+PLAYLIST_SEGMENTS = (5, 50, 500)
+FEED_ITEMS = 10000
+STAT_STREAMS = 1000
+SERIALIZER_STREAMS = 100
+
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+def timeit(func, number, repeat):
+    """Return the best seconds per call of ``func`` over ``repeat`` rounds."""
+    best = None
+    for _i in range(repeat):
+        start = perf_counter()
+        for _j in range(number):
+            func()
+        elapsed = (perf_counter() - start) / number
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+class Fixtures:
+    """Synthetic streams, feeds, playlists and stat XML shared by the
+    benchmarks.  Everything is created in the test database."""
+
+    def __init__(self, web_root, port):
+        now = timezone.now().replace(microsecond=0)
+        self.epoch = now - timedelta(hours=1)
+
+        owner = User.objects.create_user("benchmark")
+        self.feed = Feed.objects.create(name="Benchmark")
+        items = []
+        for i in range(FEED_ITEMS):
+            starts_at = self.epoch + timedelta(seconds=i / 2)
+            item = FeedItem(
+                feed=self.feed,
+                starts_at=starts_at,
+                ends_at=starts_at + timedelta(seconds=5),
+                payload={"id": i, "type": "shotmade", "clock": "07:42"},
+            )
+            item.cue = item.encode_cue()
+            items.append(item)
+        FeedItem.objects.bulk_create(items)
+        self.items = list(
+            self.feed.items.order_by("starts_at").values_list(
+                "starts_at", "ends_at", "cue"
+            )
+        )
+
+        Stream.objects.bulk_create(
+            Stream(user=owner, title=f"Stream {i}", started_at=self.epoch)
+            for i in range(SERIALIZER_STREAMS)
+        )
+        self.streams = list(Stream.objects.order_by("pk"))
+        for stream in self.streams:
+            stream.sessions.create(started_at=self.epoch)
+        self.stream = self.streams[0]
+        self.stream.feeds.add(self.feed)
+        self.stream.info = {
+            "bw_out": "2500000",
+            "meta": {"video": {"width": "1280", "height": "720"}},
+        }
+
+        # One playlist per length, each on a stream of its own
+        self.playlists = {}
+        for count, stream in zip(PLAYLIST_SEGMENTS, self.streams[1:]):
+            stream.feeds.add(self.feed)
+            hls = HlsWriter(web_root, playlist_segments=count)
+            hls.add(str(stream.uuid))
+            for i in range(count):
+                hls.tick(self.epoch + timedelta(seconds=2 * (i + 1)))
+            self.playlists[count] = stream
+
+        self.stat_xml = make_stat_xml(
+            [(f"stream-{i}", {"nclients": i}) for i in range(STAT_STREAMS)]
+        )
+
+        # RequestFactory.get() resets SERVER_PORT, so the port goes in the host
+        factory = RequestFactory(HTTP_HOST=f"127.0.0.1:{port}")
+        self.request = factory.get("/")
+        self.api_request = Request(factory.get("/api/v1/streams/"))
+        self.api_request.version = "v1"
+        self.api_request.versioning_scheme = URLPathVersioning()
+
+
+def get_benchmarks(fixtures):
+    view = FeedWebVTTView()
+    stream, feed = fixtures.stream, fixtures.feed
+    benchmarks = {
+        "master_manifest": lambda: make_master_manifest(fixtures.request, stream),
+        "vtt_timecode": lambda: [
+            view.get_vtt_timecode(fixtures.epoch, starts_at)
+            for starts_at, _ends_at, _cue in fixtures.items
+        ],
+        "vtt_render": lambda: "".join(
+            iter_webvtt(view.iter_cues(fixtures.epoch, fixtures.items))
+        ),
+        "stream_serializer": lambda: StreamSerializer(
+            fixtures.streams, many=True, context={"request": fixtures.api_request}
+        ).data,
+        "stat_parse": lambda: parse_streams(fixtures.stat_xml).get("stream-500"),
+    }
+    for count, playlist_stream in fixtures.playlists.items():
+        benchmarks[f"feed_manifest_{count}"] = partial(
+            make_feed_manifest, fixtures.request, playlist_stream, feed
+        )
+    return benchmarks
+
+
+class Command(BaseCommand):
+
+    help = _("Run the microbenchmark suite and compare it against a baseline")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "-b",
+            "--baseline",
+            default="benchmarks/baseline.json",
+            help=_("Baseline JSON file"),
+        )
+        parser.add_argument(
+            "--save", action="store_true", help=_("Save the results as the baseline")
+        )
+        parser.add_argument(
+            "-t",
+            "--threshold",
+            type=float,
+            default=0.2,
+            help=_("Allowed slowdown over the baseline, as a fraction"),
+        )
+        parser.add_argument("-n", "--number", type=int, default=5)
+        parser.add_argument("-r", "--repeat", type=int, default=5)
+        parser.add_argument("-k", "--only", help=_("Run benchmarks containing this"))
+
+    def handle(self, *args, **kwargs):
+        if not kwargs["save"] and not os.path.exists(kwargs["baseline"]):
+            raise CommandError(
+                _("No baseline at %(path)s, save one with --save")
+                % {"path": kwargs["baseline"]}
+            )
+
+        results = self.run_benchmarks(kwargs)
+
+        if kwargs["save"]:
+            os.makedirs(os.path.dirname(kwargs["baseline"]) or ".", exist_ok=True)
+            with open(kwargs["baseline"], "w") as f:
+                json.dump(results, f, indent=2, sort_keys=True)
+            self.stdout.write(_("Saved %(path)s") % {"path": kwargs["baseline"]})
+            return
+
+        with open(kwargs["baseline"]) as f:
+            baseline = json.load(f)
+
+        regressions = []
+        for name, seconds in results.items():
+            line = f"{name:<24}{seconds * 1000:>12.3f}ms"
+            if name in baseline:
+                ratio = seconds / baseline[name]
+                line += f"{ratio:>8.2f}x"
+                if ratio > 1 + kwargs["threshold"]:
+                    regressions.append(name)
+                    line += "  " + _("REGRESSION")
+            self.stdout.write(line)
+
+        if regressions:
+            raise CommandError(
+                _("Slower than baseline: %(names)s") % {"names": ", ".join(regressions)}
+            )
+
+    def run_benchmarks(self, kwargs):
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            with tempfile.TemporaryDirectory() as web_root:
+                server = ThreadingHTTPServer(
+                    ("127.0.0.1", 0), partial(QuietHandler, directory=web_root)
+                )
+                threading.Thread(target=server.serve_forever, daemon=True).start()
+                try:
+                    fixtures = Fixtures(web_root, server.server_address[1])
+                    results = {}
+                    for name, func in get_benchmarks(fixtures).items():
+                        if kwargs["only"] and kwargs["only"] not in name:
+                            continue
+                        results[name] = timeit(func, kwargs["number"], kwargs["repeat"])
+                finally:
+                    server.shutdown()
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+        return results
@@ -6,6 +6,7 @@ from django.utils.translation import gettext as _
 
 from boltstream.models import Feed
 from boltstream.sportradar import get_play_by_play
+from boltstream.tasks import publish_feed_items
 
 
 class Command(BaseCommand):
@@ -19,6 +20,7 @@ class Command(BaseCommand):
     def handle(self, *args, **kwargs):
         feed = Feed.objects.get(uuid=kwargs["feed"])
         pbp = get_play_by_play(kwargs["game-id"])
+        item_uuids = []
         for period in pbp["periods"]:
             for event in period["events"]:
                 if "wall_clock" in event:
@@ -27,4 +29,8 @@ class Command(BaseCommand):
                     item = feed.items.create(
                         starts_at=starts_at, ends_at=ends_at, payload=event
                     )
+                    item_uuids.append(str(item.uuid))
                     self.stdout.write(str(item))
+
+        if item_uuids:
+            publish_feed_items.delay(item_uuids)
@@ -0,0 +1,358 @@
+import json
+import os
+import random
+import re
+import tempfile
+import threading
+from collections import defaultdict
+from datetime import timedelta
+from time import perf_counter, sleep
+from urllib.parse import urljoin
+
+import requests
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management import BaseCommand, CommandError
+from django.core.servers.basehttp import ThreadedWSGIServer, WSGIRequestHandler
+from django.db import connection
+from django.test import Client, override_settings
+from django.test.utils import setup_test_environment, teardown_test_environment
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.crypto import get_random_string
+from django.utils.translation import gettext as _
+
+from boltstream.fakeingest import FakeIngestServer, HlsWriter
+from boltstream.middleware import QueryCounter
+from boltstream.models import Feed, FeedItem, Stream
+
+User = get_user_model()
+
+ENDPOINTS = (
+    ("master", re.compile(r"^/live/[^/]+/master\.m3u8$")),
+    ("index", re.compile(r"^/live/[^/]+/index\.m3u8$")),
+    ("authorize", re.compile(r"^/api/[^/]+/authorize/")),
+    ("feed-manifest", re.compile(r"^/feed/[^/]+\.m3u8$")),
+    ("feed-vtt", re.compile(r"^/feed/[^/]+\.vtt$")),
+)
+KEY_URI_RE = re.compile(r'#EXT-X-KEY:METHOD=AES-128,URI="([^"]+)"')
+
+
+def get_endpoint(path):
+    for name, pattern in ENDPOINTS:
+        if pattern.match(path):
+            return name
+    return "other"
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(int(len(values) * p / 100), len(values) - 1)]
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+class LoadTestApp:
+    """The Django app plus the static ``live`` files nginx would serve,
+    counting queries per endpoint."""
+
+    def __init__(self, web_root):
+        self.web_root = web_root
+        self.django = WSGIHandler()
+        self.queries = defaultdict(list)
+
+    def serve_file(self, path, start_response):
+        try:
+            with open(os.path.join(self.web_root, path.lstrip("/")), "rb") as f:
+                body = f.read()
+        except FileNotFoundError:
+            start_response("404 Not Found", [("Content-Type", "text/plain")])
+            return [b"Not found"]
+        start_response(
+            "200 OK",
+            [
+                ("Content-Type", "application/vnd.apple.mpegurl"),
+                ("Content-Length", str(len(body))),
+            ],
+        )
+        return [body]
+
+    def __call__(self, environ, start_response):
+        path = environ["PATH_INFO"]
+        endpoint = get_endpoint(path)
+        if endpoint == "index":
+            return self.serve_file(path, start_response)
+
+        counter = QueryCounter()
+        with connection.execute_wrapper(counter):
+            response = self.django(environ, start_response)
+        self.queries[endpoint].append(counter.count)
+        return response
+
+
+class Viewer(threading.Thread):
+    """Poll a live stream the way a player with a feed subtitle track does."""
+
+    def __init__(self, base_url, stream, feed, cookie, interval, results):
+        super().__init__(daemon=True)
+        self.base_url = base_url
+        self.stream = stream
+        self.feed = feed
+        self.interval = interval
+        self.results = results
+        self.finished = threading.Event()
+        self.session = requests.Session()
+        self.session.headers["Cookie"] = f"{settings.SESSION_COOKIE_NAME}={cookie}"
+
+    def fetch(self, endpoint, path, **kwargs):
+        start = perf_counter()
+        try:
+            r = self.session.get(urljoin(self.base_url, path), **kwargs)
+            status = r.status_code
+        except requests.RequestException:
+            r, status = None, 0
+        self.results[endpoint].append((perf_counter() - start, status))
+        return r
+
+    def run(self):
+        # Stagger joins across a segment like a real audience
+        if self.finished.wait(random.uniform(0, self.interval)):
+            return
+
+        self.fetch("master", self.stream.master_manifest_url)
+        authorize_url = reverse(
+            "authorize-key-access",
+            kwargs={"version": "v1", "stream_uuid": self.stream.uuid},
+        )
+        feed_url = f"{self.feed.manifest_url}?stream={self.stream.uuid}"
+        keys, cues = set(), set()
+
+        while not self.finished.is_set():
+            r = self.fetch("index", self.stream.index_manifest_url)
+            if r is not None and r.ok:
+                # nginx authorizes each new key with an auth_request
+                for uri in set(KEY_URI_RE.findall(r.text)) - keys:
+                    keys.add(uri)
+                    self.fetch(
+                        "authorize",
+                        authorize_url,
+                        headers={"X-RTMP-Secret": settings.RTMP_SECRET},
+                    )
+
+            r = self.fetch("feed-manifest", feed_url)
+            if r is not None and r.ok:
+                for line in r.text.splitlines():
+                    if line and not line.startswith("#") and line not in cues:
+                        cues.add(line)
+                        self.fetch("feed-vtt", urljoin(self.feed.manifest_url, line))
+
+            self.finished.wait(self.interval)
+
+    def stop(self):
+        self.finished.set()
+
+
+class Command(BaseCommand):
+
+    help = _("Load test the HLS viewer request mix against local stand-ins")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "-a",
+            "--audiences",
+            default="10,50,100",
+            help=_("Comma separated concurrent viewer counts"),
+        )
+        parser.add_argument(
+            "-d", "--duration", type=int, default=30, help=_("Seconds per audience")
+        )
+        parser.add_argument(
+            "-s", "--segment-seconds", type=int, default=2, help=_("Segment length")
+        )
+        parser.add_argument("-o", "--output", help=_("Write results as JSON"))
+
+    def handle(self, *args, **kwargs):
+        if not settings.RTMP_SECRET:
+            raise CommandError(_("RTMP_SECRET must be set"))
+
+        audiences = [int(n) for n in kwargs["audiences"].split(",")]
+
+        # Fixtures and stream callbacks write to a throwaway database, and the
+        # callbacks' Varnish purges are skipped
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            with override_settings(VARNISH_ENABLED=False):
+                results = self.run_audiences(audiences, kwargs)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        if kwargs["output"]:
+            with open(kwargs["output"], "w") as f:
+                json.dump(results, f, indent=2)
+
+        failed = sorted(
+            {
+                endpoint
+                for summary in results.values()
+                for endpoint, row in summary.items()
+                if row["errors"]
+            }
+        )
+        if failed:
+            raise CommandError(
+                _("Requests failed: %(endpoints)s") % {"endpoints": ", ".join(failed)}
+            )
+
+    def run_audiences(self, audiences, kwargs):
+        segment_seconds = kwargs["segment_seconds"]
+
+        with tempfile.TemporaryDirectory() as web_root:
+            ingest = FakeIngestServer()
+            ingest.start()
+            hls = HlsWriter(web_root, segment_seconds=segment_seconds)
+            app = LoadTestApp(web_root)
+            server = ThreadedWSGIServer(("127.0.0.1", 0), QuietRequestHandler)
+            server.set_app(app)
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            base_url = "http://127.0.0.1:{}".format(server.server_address[1])
+
+            run_id = get_random_string(6).lower()
+            stream, feed, cookies = self.create_fixtures(
+                run_id, max(audiences), len(audiences) * kwargs["duration"]
+            )
+            ticking = threading.Event()
+            try:
+                self.start_stream(base_url, stream, ingest)
+                stream.refresh_from_db()
+                hls.add(str(stream.uuid))
+                hls.tick()
+                threading.Thread(
+                    target=self.tick, args=(hls, segment_seconds, ticking), daemon=True
+                ).start()
+
+                results = {}
+                for audience in audiences:
+                    app.queries.clear()
+                    results[audience] = self.run_audience(
+                        base_url,
+                        stream,
+                        feed,
+                        cookies[:audience],
+                        segment_seconds,
+                        kwargs["duration"],
+                        app.queries,
+                    )
+                    self.report(audience, results[audience])
+            finally:
+                ticking.set()
+                self.stop_stream(base_url, stream, ingest)
+                server.shutdown()
+                ingest.shutdown()
+
+        return results
+
+    def create_fixtures(self, run_id, viewers, seconds):
+        owner = User.objects.create_user(f"loadtest-{run_id}")
+        stream = Stream.objects.create(user=owner, title=f"Load test {run_id}")
+        feed = Feed.objects.create(name=f"Load test {run_id}")
+        stream.feeds.add(feed)
+
+        # One play by play item a second around the run
+        now = timezone.now()
+        items = []
+        for i in range(-60, seconds + 120):
+            starts_at = now + timedelta(seconds=i)
+            item = FeedItem(
+                feed=feed,
+                starts_at=starts_at,
+                ends_at=starts_at + timedelta(seconds=5),
+                payload={"id": i, "description": f"Event {i}"},
+            )
+            item.cue = item.encode_cue()
+            items.append(item)
+        FeedItem.objects.bulk_create(items)
+
+        User.objects.bulk_create(
+            User(username=f"loadtest-{run_id}-{i}") for i in range(viewers)
+        )
+        cookies = []
+        for user in User.objects.filter(username__startswith=f"loadtest-{run_id}-"):
+            client = Client()
+            client.force_login(user)
+            cookies.append(client.cookies[settings.SESSION_COOKIE_NAME].value)
+        return stream, feed, cookies
+
+    def post_callback(self, base_url, name, stream, ingest):
+        r = requests.post(
+            urljoin(base_url, reverse(name)),
+            data={"app": "app", "name": stream.key},
+            headers={
+                "X-RTMP-Secret": settings.RTMP_SECRET,
+                "X-Ingest-Host": ingest.host,
+            },
+            allow_redirects=False,
+        )
+        if r.status_code >= 400:
+            raise CommandError(f"{name}: {r.status_code}")
+
+    def start_stream(self, base_url, stream, ingest):
+        self.post_callback(base_url, "start-stream", stream, ingest)
+        ingest.publish(str(stream.uuid))
+
+    def stop_stream(self, base_url, stream, ingest):
+        ingest.unpublish(str(stream.uuid))
+        self.post_callback(base_url, "stop-stream", stream, ingest)
+
+    def tick(self, hls, interval, finished):
+        while not finished.wait(interval):
+            hls.tick()
+
+    def run_audience(
+        self, base_url, stream, feed, cookies, interval, duration, queries
+    ):
+        results = defaultdict(list)
+        viewers = [
+            Viewer(base_url, stream, feed, cookie, interval, results)
+            for cookie in cookies
+        ]
+        for viewer in viewers:
+            viewer.start()
+        sleep(duration)
+        for viewer in viewers:
+            viewer.stop()
+        for viewer in viewers:
+            viewer.join()
+
+        summary = {}
+        for endpoint, samples in sorted(results.items()):
+            latencies = [latency for latency, _status in samples]
+            counts = queries.get(endpoint) or [0]
+            errors = [status for _latency, status in samples if not 0 < status < 400]
+            summary[endpoint] = {
+                "requests": len(samples),
+                "errors": len(errors),
+                "rps": len(samples) / duration,
+                "p50_ms": percentile(latencies, 50) * 1000,
+                "p99_ms": percentile(latencies, 99) * 1000,
+                "queries": sum(counts) / len(counts),
+            }
+        return summary
+
+    def report(self, audience, summary):
+        self.stdout.write(_("%(count)d viewers") % {"count": audience})
+        self.stdout.write(
+            f"  {'endpoint':<14}{'requests':>9}{'errors':>8}{'req/s':>9}"
+            f"{'p50 ms':>9}{'p99 ms':>9}{'queries':>9}"
+        )
+        for endpoint, row in summary.items():
+            self.stdout.write(
+                f"  {endpoint:<14}{row['requests']:>9}{row['errors']:>8}"
+                f"{row['rps']:>9.1f}{row['p50_ms']:>9.1f}{row['p99_ms']:>9.1f}"
+                f"{row['queries']:>9.1f}"
+            )
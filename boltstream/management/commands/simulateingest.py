@@ -0,0 +1,195 @@
+import random
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from time import monotonic, sleep
+from urllib.parse import urljoin
+
+import requests
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management import BaseCommand, CommandError
+from django.urls import reverse
+from django.utils.translation import gettext as _
+
+from boltstream.fakeingest import FakeIngestServer, HlsWriter
+from boltstream.models import Stream
+
+User = get_user_model()
+
+SIMULATOR_USERNAME = "ingest-simulator"
+
+
+class Command(BaseCommand):
+
+    help = _("Simulate an nginx-rtmp ingest host publishing many streams")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--app-url",
+            default="http://127.0.0.1:8000",
+            help=_("Base URL of the app receiving the callbacks"),
+        )
+        parser.add_argument(
+            "--bind", default="127.0.0.1:8081", help=_("Address of the fake host")
+        )
+        parser.add_argument(
+            "-n", "--streams", type=int, default=10, help=_("Streams to publish")
+        )
+        parser.add_argument(
+            "--create",
+            action="store_true",
+            help=_("Create missing streams under the %(username)s user")
+            % {"username": SIMULATOR_USERNAME},
+        )
+        parser.add_argument(
+            "--web-root", help=_("Write HLS output here instead of a temp dir")
+        )
+        parser.add_argument("--segment-seconds", type=int, default=2)
+        parser.add_argument("--playlist-segments", type=int, default=5)
+        parser.add_argument(
+            "--churn",
+            type=float,
+            default=0.0,
+            help=_("Chance per segment that a stream republishes"),
+        )
+        parser.add_argument(
+            "-d",
+            "--duration",
+            type=int,
+            default=0,
+            help=_("Seconds to run for, or until interrupted"),
+        )
+        parser.add_argument(
+            "-c", "--concurrency", type=int, default=16, help=_("Callback threads")
+        )
+
+    def handle(self, *args, **kwargs):
+        if not settings.RTMP_SECRET:
+            raise CommandError(_("RTMP_SECRET must be set"))
+
+        self.app_url = kwargs["app_url"]
+        self.http = requests.Session()
+        self.lock = threading.Lock()
+        self.keys = {}
+
+        streams = self.get_streams(kwargs["streams"], kwargs["create"])
+        web_root = kwargs["web_root"] or tempfile.mkdtemp(prefix="boltstream-")
+        host, port = kwargs["bind"].rsplit(":", 1)
+        self.ingest = FakeIngestServer(
+            (host, int(port)), web_root=web_root, on_drop=self.on_drop
+        )
+        self.ingest.start()
+        self.hls = HlsWriter(
+            web_root,
+            segment_seconds=kwargs["segment_seconds"],
+            playlist_segments=kwargs["playlist_segments"],
+        )
+        self.stdout.write(
+            _("Ingest host %(host)s writing HLS to %(web_root)s")
+            % {"host": self.ingest.host, "web_root": web_root}
+        )
+
+        pool = ThreadPoolExecutor(kwargs["concurrency"])
+        try:
+            published = sum(pool.map(self.publish, streams))
+            self.stdout.write(_("Published %(count)d streams") % {"count": published})
+            self.simulate(pool, streams, kwargs)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            names = [name for name, _meta in self.ingest.get_streams()]
+            list(pool.map(self.unpublish, names))
+            pool.shutdown()
+            self.ingest.shutdown()
+            if not kwargs["web_root"]:
+                shutil.rmtree(web_root, ignore_errors=True)
+
+    def get_streams(self, count, create):
+        streams = list(Stream.objects.active().order_by("pk")[:count])
+        if len(streams) < count:
+            if not create:
+                raise CommandError(
+                    _("Only %(count)d active streams, use --create for more")
+                    % {"count": len(streams)}
+                )
+            user, _created = User.objects.get_or_create(username=SIMULATOR_USERNAME)
+            Stream.objects.bulk_create(
+                Stream(user=user, title=f"Simulated {i}")
+                for i in range(count - len(streams))
+            )
+            streams = list(Stream.objects.active().order_by("pk")[:count])
+        return streams
+
+    def simulate(self, pool, streams, kwargs):
+        interval = kwargs["segment_seconds"]
+        started = monotonic()
+        deadline = started + kwargs["duration"] if kwargs["duration"] else None
+
+        while deadline is None or monotonic() < deadline:
+            tick_started = monotonic()
+            with self.lock:
+                self.hls.tick()
+            elapsed = monotonic() - tick_started
+            if elapsed > interval:
+                self.stderr.write(
+                    _("Segment writes took %(elapsed).2fs, over %(interval)ds")
+                    % {"elapsed": elapsed, "interval": interval}
+                )
+
+            if kwargs["churn"]:
+                churned = [s for s in streams if random.random() < kwargs["churn"]]
+                list(pool.map(self.republish, churned))
+
+            sleep(max(interval - (monotonic() - tick_started), 0))
+
+    def callback(self, name, key):
+        return self.http.post(
+            urljoin(self.app_url, reverse(name)),
+            data={"app": "app", "name": key},
+            headers={
+                "X-RTMP-Secret": settings.RTMP_SECRET,
+                "X-Ingest-Host": self.ingest.host,
+            },
+            allow_redirects=False,
+        )
+
+    def publish(self, stream):
+        """Fire ``on_publish`` and start publishing under the name the app
+        redirects to, like nginx-rtmp."""
+        try:
+            r = self.callback("start-stream", stream.key)
+        except requests.RequestException as e:
+            self.stderr.write(str(e))
+            return False
+        if not r.is_redirect:
+            self.stderr.write(f"start-stream {stream.uuid}: {r.status_code}")
+            return False
+
+        name = r.headers["Location"].rsplit("/", 1)[-1]
+        with self.lock:
+            self.keys[name] = stream.key
+            self.hls.add(name)
+        self.ingest.publish(name, bw_in=random.randint(1000000, 6000000))
+        return True
+
+    def unpublish(self, name):
+        """Stop publishing and fire ``on_publish_done``."""
+        self.ingest.unpublish(name)
+        self.on_drop(name)
+
+    def on_drop(self, name):
+        with self.lock:
+            self.hls.remove(name)
+            key = self.keys.pop(name, None)
+        if key is None:
+            return
+        try:
+            self.callback("stop-stream", key)
+        except requests.RequestException as e:
+            self.stderr.write(str(e))
+
+    def republish(self, stream):
+        self.unpublish(str(stream.uuid))
+        self.publish(stream)
@@ -1,13 +1,46 @@
+import json
 import logging
+import os
+from base64 import b64encode
 from datetime import timedelta
 from os.path import basename
+from urllib.parse import quote
 
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
 from furl import furl
 from m3u8 import M3U8, Media, Playlist, Segment
 from m3u8 import load as load_m3u8
+from m3u8 import loads as loads_m3u8
+
+from .models import FeedItem
+from .signing import get_signature
+from .vtt import get_offset
 
 logger = logging.getLogger(__name__)
 
+FEED_DELIVERY_WEBVTT = "webvtt"
+FEED_DELIVERY_DATERANGE = "daterange"
+
+
+def get_sync_offset(stream):
+    """Offset from the playlist's program date time to feed item wall clock."""
+    session = stream.current_session
+    if session:
+        return session.sync_offset
+    return stream.get_sync_offset()
+
+
+def sign_key_uris(request, stream, manifest):
+    if "#EXT-X-KEY:METHOD=AES-128" not in manifest:
+        return manifest
+
+    token = request.META.get("HTTP_AUTHORIZATION") or request.COOKIES.get(
+        settings.SESSION_COOKIE_NAME, ""
+    )
+    sig = get_signature(settings.RTMP_SECRET, f"{token} {stream.uuid}").decode()
+    return manifest.replace('.key"', f'.key?s={quote(sig)}"')
+
 
 def make_master_manifest(request, stream):
     if stream.info:
@@ -22,11 +55,20 @@ def make_master_manifest(request, stream):
     else:
         stream_info = {"bandwidth": 1000}
 
-    p = Playlist(basename(stream.index_manifest_url), stream_info, None, None)
+    feeds = list(stream.feeds.all())
+    if settings.DVR_ENABLED and request.GET.get("dvr"):
+        uri = basename(stream.dvr_manifest_url)
+    elif feeds and settings.FEED_DELIVERY == FEED_DELIVERY_DATERANGE:
+        uri = basename(stream.metadata_manifest_url)
+        feeds = []
+    else:
+        uri = basename(stream.index_manifest_url)
+
+    p = Playlist(uri, stream_info, None, None)
     m = M3U8()
     m.add_playlist(p)
 
-    for feed in stream.feeds.all():
+    for feed in feeds:
         media = Media(
             type="SUBTITLES",
             group_id="feeds",
@@ -49,21 +91,36 @@ def make_feed_manifest(request, stream, feed):
     m.version = p.version
     m.target_duration = p.target_duration
     m.media_sequence = p.media_sequence
+    session = stream.current_session
     for s in p.segments:
         if not m.program_date_time:
             m.program_date_time = s.current_program_date_time
 
-        vtt_url = furl(basename(feed.webvtt_url)).set({"stream": stream.uuid})
-        if s.current_program_date_time:
-            vtt_url.args.update(
+        # Segments are referenced by integer millisecond offsets into the
+        # session so their URLs stay stable between playlist refreshes.
+        vtt_url = furl(basename(feed.webvtt_url))
+        if session and s.current_program_date_time:
+            vtt_url.set(
                 {
-                    "start": s.current_program_date_time.isoformat(),
-                    "end": (
-                        s.current_program_date_time + timedelta(seconds=s.duration)
-                    ).isoformat(),
-                    "epoch": stream.started_at.isoformat(),
+                    "session": session.uuid,
+                    "t": get_offset(session.started_at, s.current_program_date_time),
+                    "d": int(s.duration * 1000),
                 }
             )
+        elif not session:
+            # Streams live since before sessions existed have none, so their
+            # cues are located by timestamps as before
+            vtt_url.set({"stream": stream.uuid})
+            if s.current_program_date_time:
+                vtt_url.args.update(
+                    {
+                        "start": s.current_program_date_time.isoformat(),
+                        "end": (
+                            s.current_program_date_time + timedelta(seconds=s.duration)
+                        ).isoformat(),
+                        "epoch": stream.started_at.isoformat(),
+                    }
+                )
         v = Segment(
             base_uri=vtt_url.url,
             uri=vtt_url.url,
@@ -74,3 +131,54 @@ def make_feed_manifest(request, stream, feed):
         m.add_segment(v)
 
     return m.dumps()
+
+
+def make_daterange(item, offset):
+    payload = json.dumps(item.payload, cls=DjangoJSONEncoder, separators=(",", ":"))
+    attrs = (
+        f'ID="{item.uuid}"',
+        f'CLASS="me.boltstream.feed.{item.feed.type}"',
+        f'START-DATE="{(item.starts_at - offset).isoformat()}"',
+        f'END-DATE="{(item.ends_at - offset).isoformat()}"',
+        f'X-FEED="{item.feed.uuid}"',
+        f'X-PAYLOAD="{b64encode(payload.encode()).decode()}"',
+    )
+    return "#EXT-X-DATERANGE:" + ",".join(attrs)
+
+
+def make_metadata_manifest(request, stream):
+    """The live media playlist with the feed items of its segment window
+    inlined as EXT-X-DATERANGE tags, so players get timed metadata without
+    requesting a separate subtitle track."""
+    path = os.path.join(settings.WEB_ROOT, "live", str(stream.uuid), "index.m3u8")
+    with open(path) as f:
+        manifest = f.read()
+
+    segments = [s for s in loads_m3u8(manifest).segments if s.current_program_date_time]
+    if not segments:
+        return sign_key_uris(request, stream, manifest)
+
+    offset = get_sync_offset(stream)
+    start = segments[0].current_program_date_time + offset - timedelta(seconds=5)
+    end = (
+        segments[-1].current_program_date_time
+        + timedelta(seconds=segments[-1].duration + 5)
+        + offset
+    )
+    items = (
+        FeedItem.objects.filter(
+            feed__streams=stream, starts_at__gte=start, ends_at__lt=end
+        )
+        .select_related("feed")
+        .order_by("starts_at")
+    )
+    tags = "".join(f"{make_daterange(item, offset)}\n" for item in items)
+
+    # Tags go right before the first segment, after the playlist header.
+    lines = manifest.splitlines(keepends=True)
+    for i, line in enumerate(lines):
+        if line.startswith(("#EXTINF", "#EXT-X-PROGRAM-DATE-TIME", "#EXT-X-KEY")):
+            lines.insert(i, tags)
+            break
+
+    return sign_key_uris(request, stream, "".join(lines))
@@ -0,0 +1,110 @@
+import os
+from time import perf_counter
+from urllib.parse import urlsplit
+
+import requests
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Histogram,
+    generate_latest,
+)
+from prometheus_client import multiprocess
+
+# Gunicorn workers and Celery processes write their samples to this directory
+# when it is set so a scrape of any web worker aggregates all of them.
+MULTIPROC_DIR_ENV = "prometheus_multiproc_dir"
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+
+request_seconds = Histogram(
+    "boltstream_request_seconds",
+    "Time spent handling requests per view.",
+    ("view", "method", "status"),
+    buckets=LATENCY_BUCKETS,
+)
+request_queries = Histogram(
+    "boltstream_request_queries",
+    "Database queries per request per view.",
+    ("view",),
+    buckets=QUERY_BUCKETS,
+)
+request_query_seconds = Histogram(
+    "boltstream_request_query_seconds",
+    "Database time per request per view.",
+    ("view",),
+    buckets=LATENCY_BUCKETS,
+)
+sql_budget_exceeded = Counter(
+    "boltstream_sql_budget_exceeded_total",
+    "Requests over the SQL query or time budget per view.",
+    ("view",),
+)
+audio_dropped_seconds = Counter(
+    "boltstream_audio_dropped_seconds_total",
+    "Decoded audio dropped before fingerprinting per stream, by the queue "
+    "policy or to stay within the memory budget.",
+    ("stream", "reason"),
+)
+audio_coalesced_seconds = Counter(
+    "boltstream_audio_coalesced_seconds_total",
+    "Decoded audio merged into the newest queued chunk per stream.",
+    ("stream",),
+)
+fingerprint_windows_skipped = Counter(
+    "boltstream_fingerprint_windows_skipped_total",
+    "Audio windows not fingerprinted per stream, as silent or unchanged.",
+    ("stream", "reason"),
+)
+http_client_seconds = Histogram(
+    "boltstream_http_client_seconds",
+    "Outbound HTTP request time per host.",
+    ("host", "method", "status"),
+    buckets=LATENCY_BUCKETS,
+)
+http_client_errors = Counter(
+    "boltstream_http_client_errors_total",
+    "Outbound HTTP requests that failed without a response per host.",
+    ("host", "method"),
+)
+
+
+def observe_request(view, method, status, seconds, queries, query_seconds):
+    request_seconds.labels(view, method, status).observe(seconds)
+    request_queries.labels(view).observe(queries)
+    request_query_seconds.labels(view).observe(query_seconds)
+
+
+class InstrumentedSession(requests.Session):
+    """A requests session timing every request by host."""
+
+    def request(self, method, url, *args, **kwargs):
+        host = urlsplit(url).netloc
+        start = perf_counter()
+        try:
+            r = super().request(method, url, *args, **kwargs)
+        except requests.RequestException:
+            http_client_errors.labels(host, method).inc()
+            raise
+        http_client_seconds.labels(host, method, r.status_code).observe(
+            perf_counter() - start
+        )
+        return r
+
+
+http = InstrumentedSession()
+
+
+def get_registry():
+    if MULTIPROC_DIR_ENV in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return registry
+    return REGISTRY
+
+
+def render():
+    return generate_latest(get_registry()), CONTENT_TYPE_LATEST
@@ -0,0 +1,212 @@
+import logging
+import os
+import random
+import sys
+import threading
+from collections import defaultdict
+from hashlib import sha1
+from time import perf_counter
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection
+
+from . import metrics
+from .models import RequestProfile
+from .profiler import Sampler
+
+logger = logging.getLogger(__name__)
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def get_view_name(request):
+    match = getattr(request, "resolver_match", None)
+    if match is None:
+        return "<unresolved>"
+    return match.view_name
+
+
+class QueryCounter:
+    """Database execute wrapper counting queries and their time."""
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.seconds += perf_counter() - start
+
+
+def get_stack():
+    """Return the app frames calling into the database, innermost first."""
+    stack, frame = [], sys._getframe(2)
+    while frame is not None:
+        filename = frame.f_code.co_filename
+        if filename.startswith(APP_DIR) and filename != __file__:
+            path = os.path.relpath(filename, APP_DIR)
+            stack.append(f"{path}:{frame.f_lineno} {frame.f_code.co_name}")
+        frame = frame.f_back
+    return tuple(stack)
+
+
+class QueryRecorder(QueryCounter):
+    """Query counter that also keeps each query's SQL, time and calling
+    stack."""
+
+    def __init__(self):
+        super().__init__()
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        start = perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            seconds = perf_counter() - start
+            self.count += 1
+            self.seconds += seconds
+            self.queries.append((sql, params, seconds, get_stack()))
+
+    def get_groups(self):
+        """Group queries by SQL and stack fingerprint, most frequent first.
+        A group repeated many times is usually an N+1."""
+        groups = defaultdict(lambda: {"count": 0, "seconds": 0.0})
+        for sql, _params, seconds, stack in self.queries:
+            fingerprint = sha1("\n".join(stack).encode()).hexdigest()[:8]
+            group = groups[(sql, fingerprint)]
+            group["count"] += 1
+            group["seconds"] += seconds
+            group.setdefault("stack", stack)
+        return sorted(
+            ((sql, fingerprint, group) for (sql, fingerprint), group in groups.items()),
+            key=lambda g: (g[2]["count"], g[2]["seconds"]),
+            reverse=True,
+        )
+
+    def get_slowest(self):
+        return max(self.queries, key=lambda q: q[2], default=None)
+
+
+def explain(sql, params):
+    with connection.cursor() as cursor:
+        cursor.execute(f"EXPLAIN {sql}", params)
+        return "\n".join(" ".join(str(col) for col in row) for row in cursor.fetchall())
+
+
+class MetricsMiddleware:
+    def __init__(self, get_response):
+        if not settings.METRICS_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        counter = QueryCounter()
+        start = perf_counter()
+        with connection.execute_wrapper(counter):
+            response = self.get_response(request)
+        metrics.observe_request(
+            get_view_name(request),
+            request.method,
+            response.status_code,
+            perf_counter() - start,
+            counter.count,
+            counter.seconds,
+        )
+        return response
+
+
+class SqlBudgetMiddleware:
+    """Log requests over the ``SQL_BUDGET_QUERIES`` or ``SQL_BUDGET_SECONDS``
+    database budget with the queries responsible."""
+
+    def __init__(self, get_response):
+        if not settings.SQL_BUDGET_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        recorder = QueryRecorder()
+        with connection.execute_wrapper(recorder):
+            response = self.get_response(request)
+
+        if (
+            recorder.count > settings.SQL_BUDGET_QUERIES
+            or recorder.seconds > settings.SQL_BUDGET_SECONDS
+        ):
+            self.report(request, recorder)
+        return response
+
+    def report(self, request, recorder):
+        view = get_view_name(request)
+        metrics.sql_budget_exceeded.labels(view).inc()
+
+        lines = [
+            f"SQL budget exceeded by {view} ({request.method} {request.path}): "
+            f"{recorder.count} queries in {recorder.seconds * 1000:.1f}ms"
+        ]
+        for sql, fingerprint, group in recorder.get_groups()[:5]:
+            lines.append(
+                f"  {group['count']}x {group['seconds'] * 1000:.1f}ms "
+                f"[{fingerprint}] {sql}"
+            )
+            lines.extend(f"    {frame}" for frame in group["stack"][:3])
+
+        sql, params, seconds, _stack = recorder.get_slowest()
+        lines.append(f"  slowest {seconds * 1000:.1f}ms: {sql}")
+        if settings.SQL_BUDGET_EXPLAIN and sql.lstrip().upper().startswith("SELECT"):
+            try:
+                lines.append(explain(sql, params))
+            except Exception as e:
+                logger.exception(e)
+
+        logger.warning("\n".join(lines))
+
+
+class ProfilerMiddleware:
+    """Record a sampled stack profile of staff requests asking for one with
+    ``?profile=1`` or an ``X-Profile`` header, and of one in every
+    ``PROFILER_SAMPLE_RATE`` other staff requests when that is set.  Old
+    profiles are pruned by the ``prune_request_profiles`` task."""
+
+    def __init__(self, get_response):
+        if not settings.PROFILER_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def should_profile(self, request):
+        if not (request.user.is_authenticated and request.user.is_staff):
+            return False
+        if request.GET.get("profile") or request.META.get("HTTP_X_PROFILE"):
+            return True
+
+        rate = settings.PROFILER_SAMPLE_RATE
+        return rate > 0 and random.randrange(rate) == 0
+
+    def __call__(self, request):
+        if not self.should_profile(request):
+            return self.get_response(request)
+
+        sampler = Sampler(threading.get_ident(), settings.PROFILER_INTERVAL)
+        sampler.start()
+        try:
+            response = self.get_response(request)
+        finally:
+            sampler.stop()
+
+        RequestProfile.objects.create(
+            user=request.user,
+            view_name=get_view_name(request),
+            method=request.method,
+            path=request.get_full_path()[:2000],
+            status=response.status_code,
+            seconds=sampler.seconds,
+            samples=sampler.samples,
+            stacks=sampler.collapse(),
+        )
+        return response
@@ -0,0 +1,70 @@
+# Generated by Django 3.1.4 on 2026-10-19 12:00
+
+import uuid
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("boltstream", "0005_auto_20201208_2243"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="Recording",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "uuid",
+                    models.UUIDField(
+                        default=uuid.uuid4,
+                        editable=False,
+                        unique=True,
+                        verbose_name="UUID",
+                    ),
+                ),
+                (
+                    "created_at",
+                    models.DateTimeField(
+                        default=django.utils.timezone.now, verbose_name="Created"
+                    ),
+                ),
+                (
+                    "key",
+                    models.CharField(max_length=500, verbose_name="Storage key"),
+                ),
+                ("size", models.PositiveBigIntegerField(default=0)),
+                ("remux_seconds", models.FloatField(blank=True, null=True)),
+                ("upload_seconds", models.FloatField(blank=True, null=True)),
+                (
+                    "uploaded_at",
+                    models.DateTimeField(
+                        blank=True, null=True, verbose_name="Uploaded"
+                    ),
+                ),
+                (
+                    "stream",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="recordings",
+                        to="boltstream.stream",
+                    ),
+                ),
+            ],
+            options={
+                "ordering": ("created_at",),
+            },
+        ),
+    ]
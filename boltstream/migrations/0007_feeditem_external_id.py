@@ -0,0 +1,28 @@
+# Generated by Django 3.1.4 on 2026-10-19 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("boltstream", "0006_recording"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="feeditem",
+            name="external_id",
+            field=models.CharField(
+                blank=True,
+                help_text="Client supplied ID used to deduplicate bulk imports.",
+                max_length=200,
+                null=True,
+                verbose_name="External ID",
+            ),
+        ),
+        migrations.AlterUniqueTogether(
+            name="feeditem",
+            unique_together={("feed", "external_id")},
+        ),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 3.1.4 on 2026-10-19 12:00
+
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def encode_cues(apps, schema_editor):
+    FeedItem = apps.get_model("boltstream", "FeedItem")
+    items = FeedItem.objects.only("uuid", "starts_at", "ends_at", "payload")
+    batch = []
+    for item in items.iterator():
+        head = {
+            "uuid": item.uuid,
+            "starts_at": item.starts_at.astimezone(timezone.utc).isoformat(),
+            "ends_at": item.ends_at.astimezone(timezone.utc).isoformat(),
+        }
+        tail = {"payload": item.payload}
+        item.cue = (
+            json.dumps(head, cls=DjangoJSONEncoder)[:-1]
+            + "\n"
+            + json.dumps(tail, cls=DjangoJSONEncoder)[1:]
+        )
+        batch.append(item)
+        if len(batch) >= 1000:
+            FeedItem.objects.bulk_update(batch, ["cue"])
+            batch = []
+    FeedItem.objects.bulk_update(batch, ["cue"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("boltstream", "0007_feeditem_external_id"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="feeditem",
+            name="cue",
+            field=models.TextField(
+                blank=True,
+                editable=False,
+                help_text="Pre-encoded WebVTT cue body, split where the timecodes go.",
+            ),
+        ),
+        migrations.RunPython(encode_cues, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 3.1.4 on 2026-10-19 12:00
+
+import datetime
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("boltstream", "0008_feeditem_cue"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="streamsession",
+            name="sync_offset",
+            field=models.DurationField(
+                default=datetime.timedelta(0),
+                help_text=(
+                    "Offset from the stream's program date time to feed item "
+                    "wall clock, updated when the program date time changes."
+                ),
+                verbose_name="Sync offset",
+            ),
+        ),
+    ]
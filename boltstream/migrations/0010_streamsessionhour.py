@@ -0,0 +1,49 @@
+# Generated by Django 3.1.4 on 2026-10-19 12:00
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+import boltstream.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("boltstream", "0009_streamsession_sync_offset"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="StreamSessionHour",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("hour", models.DateTimeField(db_index=True)),
+                (
+                    "minutes",
+                    models.BinaryField(default=boltstream.models.make_viewer_minutes),
+                ),
+                ("peak_viewers", models.PositiveIntegerField(default=0)),
+                ("viewer_minutes", models.PositiveIntegerField(default=0)),
+                (
+                    "session",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="hours",
+                        to="boltstream.streamsession",
+                    ),
+                ),
+            ],
+            options={
+                "ordering": ("session", "hour"),
+                "unique_together": {("session", "hour")},
+            },
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 3.1.4 on 2026-10-19 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("boltstream", "0011_requestprofile"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="recording",
+            name="source_path",
+            field=models.CharField(
+                blank=True,
+                editable=False,
+                help_text="The recording finalization was started from.",
+                max_length=500,
+                null=True,
+            ),
+        ),
+    ]
@@ -1,3 +1,6 @@
+import json
+import os
+import struct
 from datetime import timedelta
 from functools import partial
 from uuid import UUID, uuid4
@@ -5,9 +8,10 @@ from uuid import UUID, uuid4
 from django.conf import settings
 from django.contrib.auth.models import AbstractUser
 from django.contrib.auth.models import UserManager as DjangoUserManager
+from django.core.serializers.json import DjangoJSONEncoder
 from django.db import models, transaction
-from django.db.models import F, Q
-from django.db.models.signals import post_save
+from django.db.models import Count, F, OuterRef, Q, Subquery
+from django.db.models.signals import post_save, pre_save
 from django.dispatch import receiver
 from django.urls import reverse
 from django.utils import timezone
@@ -21,6 +25,9 @@ from .control import drop_stream, fetch_info
 
 make_stream_key = partial(get_random_string, 20)
 
+# Splits a feed item's cue where the timecodes go
+CUE_SEPARATOR = "\n"
+
 
 class UserManager(DjangoUserManager):
     def get_by_natural_key(self, uuid):
@@ -111,6 +118,34 @@ class StreamManager(models.Manager):
     def live(self):
         return self.active().filter(started_at__isnull=False)
 
+    def live_now(self):
+        """Live streams with everything a listing renders: the streamer and
+        their profile, ``viewer_count`` and the ``ordinal`` untitled streams
+        are named by."""
+        return (
+            self.live()
+            .select_related("user__profile")
+            .annotate(viewer_count=Count("viewers"), ordinal=make_stream_ordinal())
+        )
+
+
+def make_stream_ordinal():
+    """The position of a stream among its user's streams, which
+    ``Stream.__str__`` uses for untitled streams when annotated as
+    ``ordinal``."""
+    earlier = (
+        Stream.objects.filter(user=OuterRef("user"))
+        .filter(
+            Q(created_at__lt=OuterRef("created_at"))
+            | Q(created_at=OuterRef("created_at"), pk__lte=OuterRef("pk"))
+        )
+        .order_by()
+        .values("user")
+        .annotate(count=Count("pk"))
+        .values("count")
+    )
+    return Subquery(earlier)
+
 
 class Stream(models.Model):
 
@@ -160,7 +195,11 @@ class Stream(models.Model):
         if self.title:
             return self.title
 
-        index = list(self.user.streams.values_list("pk", flat=True)).index(self.pk) + 1
+        index = getattr(self, "ordinal", None)
+        if index is None:
+            streams = self.user.streams.order_by("created_at", "pk")
+            pks = list(streams.values_list("pk", flat=True))
+            index = pks.index(self.pk) + 1
         return f"{self.user} #{index}"
 
     def natural_key(self):
@@ -211,6 +250,14 @@ class Stream(models.Model):
     def index_manifest_url(self):
         return reverse("index-manifest", args=(self.uuid,))
 
+    @property
+    def dvr_manifest_url(self):
+        return reverse("dvr-manifest", args=(self.uuid,))
+
+    @property
+    def metadata_manifest_url(self):
+        return reverse("metadata-manifest", args=(self.uuid,))
+
     @property
     def image_url(self):
         return reverse("stream-image", args=(self.uuid,))
@@ -232,6 +279,18 @@ class Stream(models.Model):
         if self.is_live:
             return fetch_info(self)
 
+    @cached_property
+    def current_session(self):
+        if self.is_live:
+            return self.sessions.live().order_by("-started_at").first()
+
+    def get_sync_offset(self):
+        """Offset from the playlist's program date time to feed item wall
+        clock."""
+        if self.program_date_time and self.started_at:
+            return self.program_date_time - self.started_at
+        return timedelta(0)
+
     @transaction.atomic
     def use_credits(self, user, amount=1):
         ok = (
@@ -251,6 +310,9 @@ class StreamSessionManager(models.Manager):
     def get_by_natural_key(self, uuid):
         return self.get(uuid=uuid)
 
+    def live(self):
+        return self.filter(stopped_at__isnull=True)
+
 
 class StreamSession(models.Model):
 
@@ -263,6 +325,14 @@ class StreamSession(models.Model):
     started_at = models.DateTimeField(default=timezone.now, verbose_name=_("Started"))
     stopped_at = models.DateTimeField(null=True, blank=True, verbose_name=_("Stopped"))
     ingest_host = models.CharField(max_length=200, null=True, blank=True)
+    sync_offset = models.DurationField(
+        default=timedelta(0),
+        verbose_name=_("Sync offset"),
+        help_text=_(
+            "Offset from the stream's program date time to feed item wall "
+            "clock, updated when the program date time changes."
+        ),
+    )
 
     objects = StreamSessionManager()
 
@@ -279,6 +349,147 @@ class StreamSession(models.Model):
     def is_live(self):
         return self.started_at is not None and self.stopped_at is None
 
+    @property
+    def epoch(self):
+        """Wall clock time of the session's first feed cue timecode."""
+        return self.started_at + self.sync_offset
+
+
+VIEWER_MINUTES_FORMAT = struct.Struct("<60I")
+
+
+def make_viewer_minutes():
+    return VIEWER_MINUTES_FORMAT.pack(*([0] * 60))
+
+
+class StreamSessionHourManager(models.Manager):
+    def for_period(self, start, end):
+        return self.filter(hour__gte=start, hour__lt=end)
+
+
+class StreamSessionHour(models.Model):
+    """Concurrent viewers for each minute of one hour of a stream session,
+    packed as 60 little endian unsigned ints."""
+
+    session = models.ForeignKey(
+        StreamSession, related_name="hours", on_delete=models.CASCADE
+    )
+    hour = models.DateTimeField(db_index=True)
+    minutes = models.BinaryField(default=make_viewer_minutes)
+    peak_viewers = models.PositiveIntegerField(default=0)
+    viewer_minutes = models.PositiveIntegerField(default=0)
+
+    objects = StreamSessionHourManager()
+
+    class Meta:
+        ordering = ("session", "hour")
+        unique_together = ("session", "hour")
+
+    def __str__(self):
+        return f"{self.session} - {self.hour}"
+
+    @property
+    def viewers(self):
+        return list(VIEWER_MINUTES_FORMAT.unpack(bytes(self.minutes)))
+
+    def set_viewers(self, minute, count):
+        viewers = self.viewers
+        viewers[minute] = count
+        self.minutes = VIEWER_MINUTES_FORMAT.pack(*viewers)
+        self.peak_viewers = max(viewers)
+        self.viewer_minutes = sum(viewers)
+
+
+class RecordingManager(models.Manager):
+    def get_by_natural_key(self, uuid):
+        return self.get(uuid=uuid)
+
+    def uploaded(self):
+        return self.filter(uploaded_at__isnull=False)
+
+
+class Recording(models.Model):
+
+    uuid = models.UUIDField(
+        default=uuid4, unique=True, editable=False, verbose_name=_("UUID")
+    )
+    stream = models.ForeignKey(
+        Stream, related_name="recordings", on_delete=models.CASCADE
+    )
+    created_at = models.DateTimeField(default=timezone.now, verbose_name=_("Created"))
+    key = models.CharField(max_length=500, verbose_name=_("Storage key"))
+    source_path = models.CharField(
+        max_length=500,
+        null=True,
+        blank=True,
+        editable=False,
+        help_text=_("The recording finalization was started from."),
+    )
+    size = models.PositiveBigIntegerField(default=0)
+    remux_seconds = models.FloatField(null=True, blank=True)
+    upload_seconds = models.FloatField(null=True, blank=True)
+    uploaded_at = models.DateTimeField(
+        null=True, blank=True, verbose_name=_("Uploaded")
+    )
+
+    objects = RecordingManager()
+
+    class Meta:
+        ordering = ("created_at",)
+
+    def __str__(self):
+        return f"{self.stream} - {self.created_at}"
+
+    def natural_key(self):
+        return (self.uuid,)
+
+    @property
+    def index_path(self):
+        return os.path.join(settings.WEB_ROOT, f"{self.key}.idx")
+
+    @property
+    def upload_bytes_per_second(self):
+        if self.upload_seconds:
+            return int(self.size / self.upload_seconds)
+
+
+class RequestProfileManager(models.Manager):
+    def prune(self, keep):
+        pks = self.order_by("-created_at").values_list("pk", flat=True)[keep:]
+        return self.filter(pk__in=list(pks)).delete()
+
+
+class RequestProfile(models.Model):
+
+    uuid = models.UUIDField(
+        default=uuid4, unique=True, editable=False, verbose_name=_("UUID")
+    )
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        related_name="request_profiles",
+        null=True,
+        blank=True,
+        on_delete=models.SET_NULL,
+    )
+    created_at = models.DateTimeField(default=timezone.now, verbose_name=_("Created"))
+    view_name = models.CharField(max_length=200, db_index=True)
+    method = models.CharField(max_length=10)
+    path = models.CharField(max_length=2000)
+    status = models.PositiveSmallIntegerField()
+    seconds = models.FloatField()
+    samples = models.PositiveIntegerField()
+    stacks = models.TextField(
+        blank=True, help_text=_("Sampled stacks in collapsed flamegraph format.")
+    )
+
+    objects = RequestProfileManager()
+
+    class Meta:
+        ordering = ("-created_at",)
+
+    def __str__(self):
+        return f"{self.view_name} - {self.created_at}"
+
 
 class CreditManager(models.Manager):
     def get_by_natural_key(self, uuid):
@@ -391,11 +602,24 @@ class FeedItem(models.Model):
     starts_at = models.DateTimeField(db_index=True)
     ends_at = models.DateTimeField(db_index=True)
     payload = JSONField(blank=True)
+    external_id = models.CharField(
+        max_length=200,
+        null=True,
+        blank=True,
+        verbose_name=_("External ID"),
+        help_text=_("Client supplied ID used to deduplicate bulk imports."),
+    )
+    cue = models.TextField(
+        blank=True,
+        editable=False,
+        help_text=_("Pre-encoded WebVTT cue body, split where the timecodes go."),
+    )
 
     objects = FeedItemManager()
 
     class Meta:
         ordering = ("starts_at", "ends_at")
+        unique_together = ("feed", "external_id")
 
     def __str__(self):
         return f"{self.feed} - {self.starts_at} - {self.ends_at}"
@@ -403,6 +627,32 @@ class FeedItem(models.Model):
     def natural_key(self):
         return (self.uuid,)
 
+    def encode_cue(self):
+        """Return this item's cue body split around the per-request timecodes.
+
+        The members before the timecodes and those after them are separated
+        by ``CUE_SEPARATOR``, which JSON never leaves unescaped, so cues keep
+        the exact text and key order they had when encoded per request.
+        Updates that bypass ``save()``, like ``queryset.update(payload=...)``,
+        must re-encode the cue too.
+        """
+        head = {
+            "uuid": self.uuid,
+            "starts_at": self.starts_at.astimezone(timezone.utc).isoformat(),
+            "ends_at": self.ends_at.astimezone(timezone.utc).isoformat(),
+        }
+        tail = {"payload": self.payload}
+        return (
+            json.dumps(head, cls=DjangoJSONEncoder)[:-1]
+            + CUE_SEPARATOR
+            + json.dumps(tail, cls=DjangoJSONEncoder)[1:]
+        )
+
+
+@receiver(pre_save, sender=FeedItem)
+def encode_feed_item_cue(sender, instance=None, **kwargs):
+    instance.cue = instance.encode_cue()
+
 
 @receiver(post_save, sender=Stream)
 def drop_inactive_stream(sender, instance=None, **kwargs):
@@ -0,0 +1,71 @@
+import json
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+
+from .control import build_url
+from .manifests import get_sync_offset
+from .metrics import http
+from .models import Stream
+
+MESSAGE_FEED_ITEMS = "feed_items"
+
+
+def publish(stream, message):
+    url = build_url(settings.NCHAN_HOST, stream.channel_url)
+    data = json.dumps(message, cls=DjangoJSONEncoder, separators=(",", ":"))
+    r = http.post(
+        url,
+        data=data.encode(),
+        headers={"Content-Type": "application/json"},
+        timeout=settings.NCHAN_PUBLISH_TIMEOUT,
+    )
+    r.raise_for_status()
+
+
+def serialize_feed_item(item, offset):
+    return {
+        "uuid": item.uuid,
+        "feed": item.feed.uuid,
+        "starts_at": item.starts_at,
+        "ends_at": item.ends_at,
+        "start_date": item.starts_at - offset,
+        "end_date": item.ends_at - offset,
+        "payload": item.payload,
+    }
+
+
+def publish_feed_items(items):
+    """Publish feed items to the channels of the live streams showing their feed.
+
+    Items are batched into messages of at most ``NCHAN_BATCH_SIZE`` per stream.
+    ``start_date``/``end_date`` are on the stream's program date time timeline
+    so players can schedule them against the playhead.
+    """
+    by_feed = defaultdict(list)
+    for item in items:
+        by_feed[item.feed_id].append(item)
+
+    links = Stream.feeds.through.objects.filter(
+        feed_id__in=by_feed, stream__in=Stream.objects.live()
+    ).select_related("stream")
+
+    streams, by_stream = {}, defaultdict(list)
+    for link in links:
+        streams[link.stream_id] = link.stream
+        by_stream[link.stream_id].extend(by_feed[link.feed_id])
+
+    for stream_id, stream_items in by_stream.items():
+        stream = streams[stream_id]
+        offset = get_sync_offset(stream)
+        stream_items.sort(key=lambda item: item.starts_at)
+        size = settings.NCHAN_BATCH_SIZE
+        for start in range(0, len(stream_items), size):
+            end = start + size
+            batch = stream_items[start:end]
+            message = {
+                "type": MESSAGE_FEED_ITEMS,
+                "items": [serialize_feed_item(item, offset) for item in batch],
+            }
+            publish(stream, message)
@@ -0,0 +1,58 @@
+import os
+import sys
+import threading
+from collections import Counter
+from time import perf_counter
+
+
+def get_frame_name(code):
+    filename = code.co_filename
+    if "site-packages" + os.sep in filename:
+        filename = filename.split("site-packages" + os.sep, 1)[1]
+    else:
+        filename = os.path.basename(filename)
+    return f"{code.co_name} ({filename}:{code.co_firstlineno})"
+
+
+def fold(frame):
+    """Return ``frame``'s stack outermost first, in collapsed format."""
+    names = []
+    while frame is not None:
+        names.append(get_frame_name(frame.f_code))
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+class Sampler(threading.Thread):
+    """Sample another thread's stack every ``interval`` seconds.
+
+    Stacks are counted in the collapsed format read by flamegraph.pl and
+    speedscope.
+    """
+
+    def __init__(self, thread_id, interval):
+        super().__init__(daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self.seconds = 0.0
+        self.finished = threading.Event()
+
+    def run(self):
+        start = perf_counter()
+        while not self.finished.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                self.stacks[fold(frame)] += 1
+                self.samples += 1
+        self.seconds = perf_counter() - start
+
+    def stop(self):
+        self.finished.set()
+        self.join()
+
+    def collapse(self):
+        return "\n".join(
+            f"{stack} {count}" for stack, count in self.stacks.most_common()
+        )
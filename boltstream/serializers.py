@@ -1,9 +1,11 @@
+from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.utils.translation import gettext as _
 from furl import furl
 from rest_framework import serializers
 
-from .fields import UUIDHyperlinkedIdentityField
-from .models import Stream
+from .fields import UUIDHyperlinkedIdentityField, UUIDHyperlinkedRelatedField
+from .models import Recording, Stream
 
 User = get_user_model()
 
@@ -82,3 +84,27 @@ class StreamSerializer(serializers.ModelSerializer):
         url = furl(self.context["request"].build_absolute_uri(stream.channel_url))
         scheme = {"http": "ws", "https": "wss"}[url.scheme]
         return url.set(scheme=scheme).url
+
+
+class RecordingSerializer(serializers.ModelSerializer):
+
+    id = serializers.ReadOnlyField(source="uuid")
+    url = UUIDHyperlinkedIdentityField(view_name="recording-detail")
+    stream = UUIDHyperlinkedRelatedField(view_name="stream-detail", read_only=True)
+
+    class Meta:
+        model = Recording
+        fields = ("id", "url", "stream", "created_at", "size")
+
+
+class ClipSerializer(serializers.Serializer):
+
+    start = serializers.FloatField(min_value=0)
+    end = serializers.FloatField(min_value=0)
+
+    def validate(self, data):
+        if data["end"] <= data["start"]:
+            raise serializers.ValidationError(_("end must be after start"))
+        if data["end"] - data["start"] > settings.MAX_CLIP_SECONDS:
+            raise serializers.ValidationError(_("Clip is too long"))
+        return data
@@ -72,6 +72,9 @@ MIDDLEWARE = [
     "django.contrib.auth.middleware.AuthenticationMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
+    "boltstream.middleware.MetricsMiddleware",
+    "boltstream.middleware.SqlBudgetMiddleware",
+    "boltstream.middleware.ProfilerMiddleware",
 ]
 
 ROOT_URLCONF = "boltstream.urls"
@@ -157,6 +160,29 @@ AUTH_PASSWORD_VALIDATORS = [
 
 # Celery
 BROKER_URL = ENV.str("BROKER_URL", None)
+CELERY_ROUTES = {"boltstream.tasks.finalize_vod": {"queue": "vod"}}
+CELERYBEAT_SCHEDULE = {
+    "sync-acrcloud-channels": {
+        "task": "boltstream.tasks.sync_acrcloud_channels",
+        "schedule": ENV.int("ACRCLOUD_SYNC_INTERVAL", 30),
+    },
+    "index-dvr-segments": {
+        "task": "boltstream.tasks.index_dvr_segments",
+        "schedule": ENV.int("DVR_INDEX_INTERVAL", 5),
+    },
+    "rollup-viewers": {
+        "task": "boltstream.tasks.rollup_viewers",
+        "schedule": 60,
+    },
+    "prune-request-profiles": {
+        "task": "boltstream.tasks.prune_request_profiles",
+        "schedule": ENV.int("PROFILER_PRUNE_INTERVAL", 300),
+    },
+    "sample-telemetry": {
+        "task": "boltstream.tasks.sample_telemetry",
+        "schedule": ENV.int("TELEMETRY_INTERVAL", 10),
+    },
+}
 
 
 # Internationalization
@@ -196,6 +222,64 @@ RTMP_ENDPOINT = ENV.str("RTMP_ENDPOINT", None)
 FFMPEG_PATH = ENV.str("FFMPEG_PATH", "ffmpeg")
 FFPROBE_PATH = ENV.str("FFPROBE_PATH", "ffprobe")
 
+# Recordings
+WEB_ROOT = ENV.str("WEB_ROOT", "/var/www")
+VOD_STORAGE_BUCKET_NAME = ENV.str("VOD_STORAGE_BUCKET_NAME", AWS_STORAGE_BUCKET_NAME)
+VOD_UPLOAD_PART_SIZE = ENV.int("VOD_UPLOAD_PART_SIZE", 64 * 1024 * 1024)
+VOD_UPLOAD_CONCURRENCY = ENV.int("VOD_UPLOAD_CONCURRENCY", 8)
+MAX_CLIP_SECONDS = ENV.int("MAX_CLIP_SECONDS", 300)
+CLIP_LOCK_SECONDS = ENV.int("CLIP_LOCK_SECONDS", 600)
+
+# Feeds
+FEED_DELIVERY = ENV.str("FEED_DELIVERY", "webvtt")
+FEED_BULK_CHUNK_SIZE = ENV.int("FEED_BULK_CHUNK_SIZE", 1000)
+
+# nchan
+NCHAN_HOST = ENV.str("NCHAN_HOST", "127.0.0.1:8082")
+NCHAN_BATCH_SIZE = ENV.int("NCHAN_BATCH_SIZE", 100)
+NCHAN_PUBLISH_TIMEOUT = ENV.int("NCHAN_PUBLISH_TIMEOUT", 5)
+
+# DVR
+DVR_ENABLED = ENV.bool("DVR_ENABLED", False)
+DVR_WINDOW_SECONDS = ENV.int("DVR_WINDOW_SECONDS", 2 * 60 * 60)
+DVR_LOCK_SECONDS = ENV.int("DVR_LOCK_SECONDS", 60)
+
+# Metrics
+# Set prometheus_multiproc_dir in the environment to aggregate across workers
+METRICS_ENABLED = ENV.bool("METRICS_ENABLED", False)
+# Bearer token scrapers must send, metrics are never served without one
+METRICS_TOKEN = ENV.str("METRICS_TOKEN", None)
+
+# SQL budget
+SQL_BUDGET_ENABLED = ENV.bool("SQL_BUDGET_ENABLED", False)
+SQL_BUDGET_QUERIES = ENV.int("SQL_BUDGET_QUERIES", 20)
+SQL_BUDGET_SECONDS = ENV.float("SQL_BUDGET_SECONDS", 0.25)
+SQL_BUDGET_EXPLAIN = ENV.bool("SQL_BUDGET_EXPLAIN", False)
+
+# Profiler
+PROFILER_ENABLED = ENV.bool("PROFILER_ENABLED", False)
+PROFILER_INTERVAL = ENV.float("PROFILER_INTERVAL", 0.005)
+PROFILER_SAMPLE_RATE = ENV.int("PROFILER_SAMPLE_RATE", 0)
+PROFILER_MAX_PROFILES = ENV.int("PROFILER_MAX_PROFILES", 200)
+
+# Home
+HOME_FRAGMENT_SECONDS = ENV.int("HOME_FRAGMENT_SECONDS", 30)
+
+# Varnish
+VARNISH_ENABLED = ENV.bool("VARNISH_ENABLED", False)
+VARNISH_NODES = ENV.list("VARNISH_NODES", default=["127.0.0.1:80"])
+VARNISH_PURGE_BATCH_SIZE = ENV.int("VARNISH_PURGE_BATCH_SIZE", 50)
+VARNISH_PURGE_TIMEOUT = ENV.int("VARNISH_PURGE_TIMEOUT", 5)
+VARNISH_MANIFEST_TTL = ENV.int("VARNISH_MANIFEST_TTL", 60)
+VARNISH_PLAYLIST_TTL = ENV.int("VARNISH_PLAYLIST_TTL", 2)
+VARNISH_WEBVTT_TTL = ENV.int("VARNISH_WEBVTT_TTL", 3600)
+VARNISH_PAGE_TTL = ENV.int("VARNISH_PAGE_TTL", 10)
+
+# Telemetry (requires a Redis cache)
+TELEMETRY_ENABLED = ENV.bool("TELEMETRY_ENABLED", False)
+TELEMETRY_INTERVAL = ENV.int("TELEMETRY_INTERVAL", 10)
+TELEMETRY_SAMPLES = ENV.int("TELEMETRY_SAMPLES", 360)
+
 # API
 # http://www.django-rest-framework.org/
 # https://django-oauth-toolkit.readthedocs.io/en/latest/index.html
@@ -231,6 +315,26 @@ ACRCLOUD_API_SIGNATURE_VERSION = ENV.str("ACRCLOUD_API_SIGNATURE_VERSION", "1")
 ACRCLOUD_CONSOLE_ACCESS_KEY = ENV.str("ACRCLOUD_CONSOLE_ACCESS_KEY", None)
 ACRCLOUD_CONSOLE_ACCESS_SECRET = ENV.str("ACRCLOUD_CONSOLE_ACCESS_SECRET", None)
 ACRCLOUD_BUCKET_NAME = ENV.str("ACRCLOUD_BUCKET_NAME", None)
+ACRCLOUD_SYNC_CONCURRENCY = ENV.int("ACRCLOUD_SYNC_CONCURRENCY", 4)
+ACRCLOUD_STREAMER_QUEUE_SIZE = ENV.int("ACRCLOUD_STREAMER_QUEUE_SIZE", 8)
+ACRCLOUD_STREAMER_QUEUE_POLICY = ENV.str(
+    "ACRCLOUD_STREAMER_QUEUE_POLICY", "drop_oldest"
+)
+ACRCLOUD_STREAMER_MAX_QUEUED_BYTES = ENV.int(
+    "ACRCLOUD_STREAMER_MAX_QUEUED_BYTES", 256 * 1024 * 1024
+)
+ACRCLOUD_STREAMER_STATS_INTERVAL = ENV.int("ACRCLOUD_STREAMER_STATS_INTERVAL", 60)
+ACRCLOUD_STREAMER_FINGERPRINT_PROCESSES = ENV.int(
+    "ACRCLOUD_STREAMER_FINGERPRINT_PROCESSES", os.cpu_count() or 1
+)
+ACRCLOUD_STREAMER_FINGERPRINT_TIMEOUT = ENV.int(
+    "ACRCLOUD_STREAMER_FINGERPRINT_TIMEOUT", 10
+)
+ACRCLOUD_STREAMER_SILENCE_RMS = ENV.float("ACRCLOUD_STREAMER_SILENCE_RMS", 0.001)
+ACRCLOUD_STREAMER_UNCHANGED_THRESHOLD = ENV.float(
+    "ACRCLOUD_STREAMER_UNCHANGED_THRESHOLD", 0.02
+)
+ACRCLOUD_STREAMER_MAX_SKIP_SECONDS = ENV.int("ACRCLOUD_STREAMER_MAX_SKIP_SECONDS", 30)
 
 # SportRadar
 SPORTRADAR_API_ENDPOINT = ENV.str(
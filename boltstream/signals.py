@@ -0,0 +1,66 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from .fragments import bump_live_version
+from .models import Feed, FeedItem, Stream
+from .tasks import purge_cache
+from .varnish import LIVE_KEY, get_feed_key, get_stream_key
+
+
+def purge_on_commit(keys):
+    if settings.VARNISH_ENABLED:
+        keys = list(keys)
+        transaction.on_commit(lambda: purge_cache.delay(keys))
+
+
+@receiver(post_save, sender=Stream)
+@receiver(post_delete, sender=Stream)
+def purge_stream(sender, instance=None, **kwargs):
+    # Starting and stopping a stream both save it
+    purge_on_commit([get_stream_key(instance.uuid), LIVE_KEY])
+    transaction.on_commit(bump_live_version)
+
+
+@receiver(post_save, sender=Stream)
+def sync_session_offset(sender, instance=None, **kwargs):
+    # The program date time may be set after the stream was published
+    if instance.is_live:
+        offset = instance.get_sync_offset()
+        instance.sessions.live().exclude(sync_offset=offset).update(sync_offset=offset)
+
+
+@receiver(post_save, sender=Feed)
+@receiver(pre_delete, sender=Feed)
+def purge_feed(sender, instance=None, **kwargs):
+    # Master playlists list their stream's feeds, and are only tagged with
+    # the stream key.  Links are gone after a delete, so it is handled before.
+    uuids = instance.streams.values_list("uuid", flat=True)
+    purge_on_commit(
+        [get_feed_key(instance.uuid)] + [get_stream_key(uuid) for uuid in uuids]
+    )
+
+
+@receiver(post_delete, sender=FeedItem)
+def purge_feed_item(sender, instance=None, **kwargs):
+    # Added and changed items are purged by the publish_feed_items task, and
+    # items deleted along with their feed by purge_feed
+    feed = Feed.objects.filter(pk=instance.feed_id).first()
+    if feed:
+        purge_on_commit([get_feed_key(feed.uuid)])
+
+
+@receiver(m2m_changed, sender=Stream.feeds.through)
+def purge_stream_feeds(sender, instance=None, action=None, pk_set=None, **kwargs):
+    # Links are gone after a clear, so clears are handled before it
+    if action not in ("post_add", "post_remove", "pre_clear"):
+        return
+
+    if isinstance(instance, Stream):
+        uuids = [instance.uuid]
+    elif pk_set:
+        uuids = Stream.objects.filter(pk__in=pk_set).values_list("uuid", flat=True)
+    else:
+        uuids = instance.streams.values_list("uuid", flat=True)
+    purge_on_commit(get_stream_key(uuid) for uuid in uuids)
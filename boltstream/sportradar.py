@@ -1,7 +1,8 @@
-import requests
 from django.conf import settings
 from furl import furl
 
+from .metrics import http
+
 
 def get_play_by_play(game_id):
     url = (
@@ -9,6 +10,6 @@ def get_play_by_play(game_id):
         .join(f"/nba/trial/v5/en/games/{game_id}/pbp.json")
         .url
     )
-    r = requests.get(url, params={"api_key": settings.SPORTRADAR_API_KEY})
+    r = http.get(url, params={"api_key": settings.SPORTRADAR_API_KEY})
     r.raise_for_status()
     return r.json()
@@ -1,6 +1,7 @@
 import json
 import os
 
+import boto3
 from django.conf import settings
 from django.contrib.staticfiles.storage import ManifestFilesMixin, StaticFilesStorage
 from django.core.files.base import ContentFile
@@ -8,6 +9,14 @@ from django.core.files.storage import FileSystemStorage
 from storages.backends.s3boto3 import S3Boto3Storage, SpooledTemporaryFile
 
 
+def get_s3_client():
+    return boto3.client(
+        "s3",
+        endpoint_url=settings.AWS_S3_ENDPOINT_URL,
+        region_name=settings.AWS_S3_REGION_NAME,
+    )
+
+
 class ManifestStaticFilesStorageFileSystem(ManifestFilesMixin, StaticFilesStorage):
     pass
 
@@ -1,28 +1,166 @@
+from concurrent.futures import ThreadPoolExecutor
+
 from celery import shared_task
 from celery.utils.log import get_task_logger
-from django.db import transaction
+from django.conf import settings
+from django.core.cache import cache
 
-from . import acrcloud
-from .models import Stream
+from . import acrcloud, analytics, clips, dvr, nchan, telemetry, varnish, vod
+from .models import (
+    FeedItem,
+    Recording,
+    RequestProfile,
+    Stream,
+    StreamSession,
+    make_stream_ordinal,
+)
 
 logger = get_task_logger(__name__)
 
 
+def create_acrcloud_channel(stream):
+    resp = acrcloud.create_channel(stream)
+    Stream.objects.filter(pk=stream.pk).update(acrcloud_acr_id=resp["acr_id"])
+
+
+def update_acrcloud_channel(stream):
+    acrcloud.update_channel(stream)
+
+
+def delete_acrcloud_channel(acr_id):
+    acrcloud.delete_channel_by_acr_id(acr_id)
+    Stream.objects.filter(acrcloud_acr_id=acr_id).update(acrcloud_acr_id=None)
+
+
+def get_acrcloud_changes(streams, channels, owned):
+    """Diff live streams against ACRCloud channels keyed by ``channel_id``.
+
+    Only channels whose ``acr_id`` is in ``owned`` (tracked on a stream) are
+    deleted, so channels other apps keep in the bucket are left alone.
+    """
+    changes = []
+    for uuid, stream in streams.items():
+        channel = channels.get(uuid)
+        if channel is None:
+            changes.append((create_acrcloud_channel, stream))
+        elif stream.acrcloud_acr_id != channel["acr_id"]:
+            stream.acrcloud_acr_id = channel["acr_id"]
+            Stream.objects.filter(pk=stream.pk).update(
+                acrcloud_acr_id=stream.acrcloud_acr_id
+            )
+        elif channel.get("title") != str(stream):
+            changes.append((update_acrcloud_channel, stream))
+
+    for uuid, channel in channels.items():
+        if uuid not in streams and channel["acr_id"] in owned:
+            changes.append((delete_acrcloud_channel, channel["acr_id"]))
+
+    return changes
+
+
 @shared_task
-@transaction.atomic
-def create_acrcloud_channel(stream_pk):
-    stream = Stream.objects.get(pk=stream_pk)
-    if not stream.acrcloud_acr_id:
-        resp = acrcloud.create_channel(stream)
-        stream.acrcloud_acr_id = resp["acr_id"]
-        stream.save()
+def sync_acrcloud_channels():
+    if not settings.ACRCLOUD_BUCKET_NAME:
+        return
+
+    live = Stream.objects.live().select_related("user__profile")
+    streams = {
+        str(stream.uuid): stream
+        for stream in live.annotate(ordinal=make_stream_ordinal())
+    }
+    channels = {}
+    for channel in acrcloud.iter_all_channels():
+        if not channel.get("channel_id") or not channel.get("acr_id"):
+            logger.warning(f"Skipping malformed channel {channel!r}")
+            continue
+        channels[channel["channel_id"]] = channel
+    acr_ids = [channel["acr_id"] for channel in channels.values()]
+    owned = set(
+        Stream.objects.filter(acrcloud_acr_id__in=acr_ids).values_list(
+            "acrcloud_acr_id", flat=True
+        )
+    )
+    changes = get_acrcloud_changes(streams, channels, owned)
+
+    with ThreadPoolExecutor(settings.ACRCLOUD_SYNC_CONCURRENCY) as executor:
+        futures = [executor.submit(func, arg) for func, arg in changes]
+
+    for future in futures:
+        try:
+            future.result()
+        except Exception as e:
+            logger.exception(e)
+
+    # Forget channels that are gone; ones that failed to delete are retried
+    Stream.objects.exclude(pk__in=[s.pk for s in streams.values()]).filter(
+        acrcloud_acr_id__isnull=False
+    ).exclude(acrcloud_acr_id__in=acr_ids).update(acrcloud_acr_id=None)
+    logger.info(f"streams={len(streams)}, changes={len(changes)}")
+
+
+@shared_task(
+    acks_late=True,
+    autoretry_for=vod.RETRY_ERRORS,
+    retry_backoff=True,
+    retry_kwargs={"max_retries": 8},
+)
+def finalize_vod(stream_uuid, path):
+    stream = Stream.objects.get(uuid=stream_uuid)
+    vod.finalize_vod(stream, path)
+
+
+@shared_task(acks_late=True)
+def extract_clip(recording_uuid, start, end):
+    recording = Recording.objects.get(uuid=recording_uuid)
+    key = clips.get_clip_key(recording, start, end)
+    try:
+        clips.extract_clip(recording, start, end)
+    finally:
+        cache.delete(clips.get_clip_lock_key(key))
+
+
+@shared_task
+def index_dvr_segments():
+    if not settings.DVR_ENABLED:
+        return
+
+    for stream in Stream.objects.live():
+        try:
+            dvr.index_segments(stream)
+        except Exception as e:
+            logger.exception(e)
+
+
+@shared_task
+def publish_feed_items(item_uuids):
+    items = list(FeedItem.objects.filter(uuid__in=item_uuids).select_related("feed"))
+    varnish.purge({varnish.get_feed_key(item.feed.uuid) for item in items})
+    nchan.publish_feed_items(items)
+
+
+@shared_task
+def purge_cache(keys):
+    varnish.purge(keys)
+
+
+@shared_task
+def rollup_viewers():
+    analytics.rollup_viewers(StreamSession.objects.live())
 
 
 @shared_task
-@transaction.atomic
-def delete_acrcloud_channel(stream_pk):
-    stream = Stream.objects.get(pk=stream_pk)
-    if stream.acrcloud_acr_id:
-        acrcloud.delete_channel(stream)
-        stream.acrcloud_acr_id = None
-        stream.save()
+def prune_request_profiles():
+    if settings.PROFILER_ENABLED:
+        RequestProfile.objects.prune(settings.PROFILER_MAX_PROFILES)
+
+
+@shared_task
+def sample_telemetry():
+    if not settings.TELEMETRY_ENABLED:
+        return
+
+    streams = Stream.objects.live().filter(ingest_host__isnull=False)
+    try:
+        telemetry.sample_streams(streams)
+    except Exception as e:
+        logger.exception(e)
@@ -0,0 +1,110 @@
+import logging
+import struct
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django_redis import get_redis_connection
+
+from .control import fetch_streams_info
+
+logger = logging.getLogger(__name__)
+
+FIELDS = ("bw_in", "bw_out", "fps", "width", "height", "clients")
+
+# One sample per slot: a unix timestamp followed by a float per field
+SAMPLE_FORMAT = struct.Struct("<I" + "f" * len(FIELDS))
+
+
+def get_buffer_key(stream):
+    return f"telemetry:{stream.uuid}"
+
+
+def get_head_key(stream):
+    return f"telemetry:{stream.uuid}:head"
+
+
+def get_sample(info, ts):
+    video = (info.get("meta") or {}).get("video") or {}
+    values = (
+        info.get("bw_in"),
+        info.get("bw_out"),
+        video.get("frame_rate"),
+        video.get("width"),
+        video.get("height"),
+        info.get("nclients"),
+    )
+    return SAMPLE_FORMAT.pack(int(ts), *(float(v or 0) for v in values))
+
+
+def record_samples(samples):
+    """Write ``(stream, sample)`` pairs into each stream's ring buffer.
+
+    Buffers are ``TELEMETRY_SAMPLES`` fixed size slots, so memory per stream
+    does not grow with the stream's duration.
+    """
+    size = settings.TELEMETRY_SAMPLES
+    ttl = settings.TELEMETRY_SAMPLES * settings.TELEMETRY_INTERVAL
+    conn = get_redis_connection()
+
+    pipe = conn.pipeline()
+    for stream, _sample in samples:
+        pipe.incr(get_head_key(stream))
+        pipe.expire(get_head_key(stream), ttl)
+    heads = pipe.execute()[::2]
+
+    pipe = conn.pipeline()
+    for (stream, sample), head in zip(samples, heads):
+        offset = (head - 1) % size * SAMPLE_FORMAT.size
+        pipe.setrange(get_buffer_key(stream), offset, sample)
+        pipe.expire(get_buffer_key(stream), ttl)
+    pipe.execute()
+
+
+def sample_streams(streams):
+    """Sample ``streams`` with one stat request per ingest host.  Hosts that
+    can't be reached are logged and skipped."""
+    by_host = defaultdict(list)
+    for stream in streams:
+        by_host[stream.ingest_host].append(stream)
+
+    ts, samples = time.time(), []
+    for host, host_streams in by_host.items():
+        try:
+            info = fetch_streams_info(host)
+        except Exception as e:
+            logger.exception(f"host={host}: {e}")
+            continue
+        for stream in host_streams:
+            if str(stream.uuid) in info:
+                samples.append((stream, get_sample(info[str(stream.uuid)], ts)))
+
+    if samples:
+        record_samples(samples)
+
+
+def get_samples(stream):
+    """Return a stream's samples, oldest first, as a dict of field lists with
+    their ``timestamps``."""
+    conn = get_redis_connection()
+    pipe = conn.pipeline()
+    pipe.get(get_buffer_key(stream))
+    pipe.get(get_head_key(stream))
+    buf, head = pipe.execute()
+
+    series = {field: [] for field in ("timestamps",) + FIELDS}
+    if not buf or not head:
+        return series
+
+    count = len(buf) // SAMPLE_FORMAT.size
+    start = int(head) % count if int(head) >= count else 0
+    for i in range(count):
+        ts, *values = SAMPLE_FORMAT.unpack_from(
+            buf, (start + i) % count * SAMPLE_FORMAT.size
+        )
+        if not ts:
+            continue
+        series["timestamps"].append(ts)
+        for field, value in zip(FIELDS, values):
+            series[field].append(value)
+    return series
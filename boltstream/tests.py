@@ -0,0 +1,727 @@
+import json
+import os
+import tempfile
+import threading
+from datetime import datetime, timedelta
+from datetime import timezone as tz
+from functools import partial
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from unittest import mock
+from urllib.parse import quote
+
+import numpy as np
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.exceptions import MiddlewareNotUsed
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from prometheus_client import REGISTRY
+from webvtt import Caption, WebVTT
+
+from . import (
+    analytics,
+    clips,
+    dvr,
+    nchan,
+    signals,
+    tasks,
+    telemetry,
+    varnish,
+)
+from .audio import SPECTRUM_BANDS, SilenceGate, analyze_pcm
+from .control import build_url, drop_stream, fetch_info
+from .fakeingest import FakeIngestServer
+from .ingest import ingest_feed_items
+from .manifests import sign_key_uris
+from .middleware import QueryRecorder, SqlBudgetMiddleware
+from .models import (
+    Feed,
+    FeedItem,
+    Recording,
+    RequestProfile,
+    Stream,
+    StreamSessionHour,
+)
+from .signing import get_signature
+from .views import FeedWebVTTView
+from .vtt import iter_webvtt
+
+User = get_user_model()
+
+
+class RecordingHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self.server.requests.append((self.command, self.path, self.headers, body))
+        self.send_response(200)
+        self.end_headers()
+
+    do_BAN = do_POST
+
+    def log_message(self, *args):
+        pass
+
+
+class RecordingServer:
+    """A local HTTP server on a free port that records the requests it gets."""
+
+    def __enter__(self):
+        self.server = HTTPServer(("127.0.0.1", 0), RecordingHandler)
+        self.server.requests = []
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+
+    @property
+    def host(self):
+        return f"127.0.0.1:{self.server.server_port}"
+
+    @property
+    def requests(self):
+        return self.server.requests
+
+
+class BuildUrlTestCase(TestCase):
+    def test_host(self):
+        self.assertEqual(build_url("example.com", "/a/b"), "http://example.com/a/b")
+
+    def test_host_with_port(self):
+        self.assertEqual(
+            build_url("127.0.0.1:8082", "/channel/x", scheme="https"),
+            "https://127.0.0.1:8082/channel/x",
+        )
+
+
+class NchanTestCase(TestCase):
+    def setUp(self):
+        user = User.objects.create_user("streamer")
+        self.stream = Stream.objects.create(user=user)
+
+    def test_publish_to_host_with_port(self):
+        with RecordingServer() as server, override_settings(NCHAN_HOST=server.host):
+            nchan.publish(self.stream, {"type": "ping"})
+
+        [(method, path, headers, body)] = server.requests
+        self.assertEqual(method, "POST")
+        self.assertEqual(path, self.stream.channel_url)
+        self.assertEqual(headers["Content-Type"], "application/json")
+        self.assertEqual(json.loads(body), {"type": "ping"})
+
+
+class IngestTestCase(TestCase):
+    def setUp(self):
+        self.feed = Feed.objects.create(name="Feed")
+
+    def make_records(self, *external_ids):
+        item = {
+            "starts_at": "2020-01-01T00:00:00Z",
+            "ends_at": "2020-01-01T00:00:05Z",
+        }
+        return enumerate(({**item, "id": i} for i in external_ids), 1)
+
+    def test_duplicates(self):
+        ingest_feed_items(self.feed, self.make_records("a"), 10)
+        result = ingest_feed_items(self.feed, self.make_records("a", "b", "b"), 10)
+        self.assertEqual(result["accepted"], 1)
+        self.assertEqual(result["duplicates"], 2)
+        self.assertEqual(
+            result["created"], [str(self.feed.items.get(external_id="b").uuid)]
+        )
+
+    def test_concurrent_insert(self):
+        bulk_create = FeedItem.objects.bulk_create
+
+        def insert_first(items, **kwargs):
+            # Another request inserts "a" after the existing IDs were checked
+            FeedItem.objects.create(
+                feed=self.feed,
+                starts_at=items[0].starts_at,
+                ends_at=items[0].ends_at,
+                external_id="a",
+            )
+            return bulk_create(items, **kwargs)
+
+        with mock.patch.object(FeedItem.objects, "bulk_create", insert_first):
+            result = ingest_feed_items(self.feed, self.make_records("a", "b"), 10)
+
+        self.assertEqual(result["accepted"], 1)
+        self.assertEqual(result["duplicates"], 1)
+        self.assertEqual(
+            result["created"], [str(self.feed.items.get(external_id="b").uuid)]
+        )
+
+
+class FeedItemCueTestCase(TestCase):
+    def test_cue_text_matches_payload_encoding(self):
+        view = FeedWebVTTView()
+        epoch = timezone.now()
+        item = FeedItem.objects.create(
+            feed=Feed.objects.create(name="Feed"),
+            starts_at=epoch + timedelta(seconds=1.5),
+            ends_at=epoch + timedelta(seconds=6),
+            payload={"id": 1, "description": "Jump shot\n", "score": [52, 48]},
+        )
+        item.refresh_from_db()
+
+        start_timecode = view.get_vtt_timecode(epoch, item.starts_at)
+        end_timecode = view.get_vtt_timecode(epoch, item.ends_at)
+        # Cues were previously encoded from the payload on every request
+        data = {
+            "uuid": item.uuid,
+            "starts_at": item.starts_at.isoformat(),
+            "ends_at": item.ends_at.isoformat(),
+            "start_timecode": start_timecode,
+            "end_timecode": end_timecode,
+            "payload": item.payload,
+        }
+        self.assertEqual(
+            view.get_cue_text(start_timecode, end_timecode, item.cue),
+            json.dumps(data, cls=DjangoJSONEncoder),
+        )
+
+
+class WebVTTTestCase(TestCase):
+    def test_matches_webvtt_py(self):
+        cues = [
+            ("00:00:01.500", "00:00:06.000", '{"a": 1}'),
+            ("01:02:03.004", "01:02:08.004", '{"b": "\\u00e9"}'),
+        ]
+        webvtt = WebVTT()
+        for start, end, text in cues:
+            webvtt.captions.append(Caption(start, end, [text]))
+
+        self.assertEqual("".join(iter_webvtt(cues)), webvtt.content)
+
+    def test_empty(self):
+        self.assertEqual("".join(iter_webvtt([])), WebVTT().content)
+
+
+class FeedWebVTTViewTestCase(TestCase):
+    def setUp(self):
+        now = timezone.now().replace(microsecond=0)
+        self.feed = Feed.objects.create(name="Feed")
+        self.stream = Stream.objects.create(
+            user=User.objects.create_user("streamer"),
+            started_at=now,
+            program_date_time=now + timedelta(seconds=10),
+        )
+        self.stream.feeds.add(self.feed)
+        self.item = FeedItem.objects.create(
+            feed=self.feed,
+            starts_at=now + timedelta(seconds=12),
+            ends_at=now + timedelta(seconds=14),
+            payload={},
+        )
+
+    def get_cues(self, params):
+        response = self.client.get(self.feed.webvtt_url, params)
+        self.assertEqual(response.status_code, 200)
+        return response.content.decode()
+
+    def test_session(self):
+        session = self.stream.sessions.create(
+            started_at=self.stream.started_at,
+            sync_offset=self.stream.get_sync_offset(),
+        )
+        content = self.get_cues({"session": session.uuid, "t": 0, "d": 4000})
+        self.assertIn("00:00:02.000 --> 00:00:04.000", content)
+        self.assertIn(str(self.item.uuid), content)
+
+    def test_program_date_time_set_after_publish(self):
+        session = self.stream.sessions.create(started_at=self.stream.started_at)
+        self.stream.save()
+        session.refresh_from_db()
+        self.assertEqual(session.sync_offset, timedelta(seconds=10))
+
+        content = self.get_cues({"session": session.uuid, "t": 0, "d": 4000})
+        self.assertIn("00:00:02.000 --> 00:00:04.000", content)
+
+    def test_stream_without_session(self):
+        start = self.stream.started_at
+        content = self.get_cues(
+            {
+                "stream": self.stream.uuid,
+                "start": start.isoformat(),
+                "end": (start + timedelta(seconds=4)).isoformat(),
+                "epoch": self.stream.started_at.isoformat(),
+            }
+        )
+        self.assertIn("00:00:02.000 --> 00:00:04.000", content)
+        self.assertIn(str(self.item.uuid), content)
+
+    def test_bad_request(self):
+        response = self.client.get(self.feed.webvtt_url, {"stream": "x"})
+        self.assertEqual(response.status_code, 400)
+
+
+@override_settings(RTMP_SECRET="secret")
+class StreamSessionHourTestCase(TestCase):
+    def setUp(self):
+        self.stream = Stream.objects.create(user=User.objects.create_user("streamer"))
+        self.hour = datetime(2030, 1, 1, 12, tzinfo=tz.utc)
+
+    def post(self, name, at):
+        with mock.patch("django.utils.timezone.now", return_value=at):
+            return self.client.post(
+                reverse(name),
+                {"name": self.stream.key},
+                HTTP_X_RTMP_SECRET="secret",
+                HTTP_X_INGEST_HOST="127.0.0.1:8081",
+            )
+
+    def add_viewer(self, username, at):
+        self.stream.viewers.create(
+            viewer=User.objects.create_user(username), last_viewed_at=at
+        )
+
+    def test_session_across_hour(self):
+        before = self.hour - timedelta(minutes=1)
+        after = self.hour + timedelta(minutes=2)
+
+        self.assertEqual(self.post("start-stream", before).status_code, 302)
+        self.add_viewer("a", before)
+        analytics.rollup_viewers(self.stream.sessions.live(), at=before)
+        self.stream.viewers.update(last_viewed_at=after)
+        self.add_viewer("b", after)
+        self.assertEqual(self.post("stop-stream", after).status_code, 200)
+
+        session = self.stream.sessions.get()
+        self.assertEqual((session.started_at, session.stopped_at), (before, after))
+        first, second = session.hours.all()
+        self.assertEqual(first.hour, self.hour - timedelta(hours=1))
+        self.assertEqual(second.hour, self.hour)
+
+        self.assertEqual(len(bytes(first.minutes)), 240)
+        self.assertEqual(first.viewers, [0] * 59 + [1])
+        self.assertEqual((first.peak_viewers, first.viewer_minutes), (1, 1))
+        self.assertEqual(second.viewers, [0, 0, 2] + [0] * 57)
+        self.assertEqual((second.peak_viewers, second.viewer_minutes), (2, 2))
+        self.assertEqual(
+            list(StreamSessionHour.objects.for_period(self.hour, after)), [second]
+        )
+
+
+@override_settings(
+    CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+)
+class HomeViewTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def start_stream(self, username, title):
+        return Stream.objects.create(
+            user=User.objects.create_user(username),
+            title=title,
+            started_at=timezone.now(),
+        )
+
+    def get_home(self):
+        response = self.client.get(reverse("home"))
+        self.assertEqual(response.status_code, 200)
+        return response.content.decode()
+
+    def test_constant_queries(self):
+        self.start_stream("a", "Stream a")
+        with self.assertNumQueries(1):
+            self.assertIn("Stream a", self.get_home())
+
+        cache.clear()
+        for username in "bcde":
+            self.start_stream(username, f"Stream {username}")
+        with self.assertNumQueries(1):
+            self.assertIn("Stream e", self.get_home())
+
+        with self.assertNumQueries(0):
+            self.get_home()
+
+    def test_live_version_invalidates_fragment(self):
+        stream = self.start_stream("a", "Old title")
+        self.assertIn("Old title", self.get_home())
+
+        Stream.objects.filter(pk=stream.pk).update(title="New title")
+        self.assertIn("Old title", self.get_home())
+
+        stream.title = "New title"
+        with mock.patch.object(signals.transaction, "on_commit", lambda f: f()):
+            stream.save()
+        content = self.get_home()
+        self.assertIn("New title", content)
+        self.assertNotIn("Old title", content)
+
+
+class TelemetryTestCase(TestCase):
+    def test_unreachable_host(self):
+        user = User.objects.create_user("streamer")
+        down = Stream.objects.create(user=user, ingest_host="10.0.0.1:8081")
+        up = Stream.objects.create(user=user, ingest_host="10.0.0.2:8081")
+
+        def fetch_streams_info(host):
+            if host == down.ingest_host:
+                raise ConnectionError(host)
+            return {str(up.uuid): {"bw_in": 1000}}
+
+        with mock.patch.object(
+            telemetry, "fetch_streams_info", fetch_streams_info
+        ), mock.patch.object(telemetry, "record_samples") as record_samples:
+            with self.assertLogs(telemetry.logger, "ERROR"):
+                telemetry.sample_streams([down, up])
+
+        [(samples,), _kwargs] = record_samples.call_args
+        self.assertEqual([stream for stream, _sample in samples], [up])
+
+
+@override_settings(METRICS_ENABLED=True)
+class MetricsTestCase(TestCase):
+    def test_no_token_configured(self):
+        with override_settings(METRICS_TOKEN=None):
+            response = self.client.get("/app-metrics")
+        self.assertEqual(response.status_code, 403)
+
+    @override_settings(METRICS_TOKEN="secret")
+    def test_token(self):
+        response = self.client.get("/app-metrics", HTTP_AUTHORIZATION="Bearer nope")
+        self.assertEqual(response.status_code, 403)
+        response = self.client.get("/app-metrics", HTTP_AUTHORIZATION="Bearer secret")
+        self.assertEqual(response.status_code, 200)
+
+
+@override_settings(RTMP_SECRET="secret")
+class IngestControlTestCase(TestCase):
+    def setUp(self):
+        self.ingest = FakeIngestServer()
+        self.ingest.start()
+        self.addCleanup(self.ingest.server_close)
+        self.addCleanup(self.ingest.shutdown)
+
+        user = User.objects.create_user("streamer")
+        self.stream = Stream.objects.create(user=user, ingest_host=self.ingest.host)
+        self.ingest.publish(str(self.stream.uuid), bw_in=1000)
+
+    def test_fetch_info(self):
+        info = fetch_info(self.stream)
+        self.assertEqual(info["name"], str(self.stream.uuid))
+        self.assertEqual(info["bw_in"], "1000")
+
+    def test_drop_stream(self):
+        drop_stream(self.stream)
+        self.assertEqual(self.ingest.dropped, [str(self.stream.uuid)])
+        self.assertIsNone(fetch_info(self.stream))
+
+
+def count_streams(request, repeat=3):
+    for _ in range(repeat):
+        Stream.objects.count()
+    Feed.objects.count()
+    return HttpResponse()
+
+
+@override_settings(SQL_BUDGET_ENABLED=True, SQL_BUDGET_QUERIES=3)
+class SqlBudgetTestCase(TestCase):
+    def get_exceeded(self):
+        return (
+            REGISTRY.get_sample_value(
+                "boltstream_sql_budget_exceeded_total", {"view": "<unresolved>"}
+            )
+            or 0
+        )
+
+    def test_groups(self):
+        recorder = QueryRecorder()
+        with connection.execute_wrapper(recorder):
+            count_streams(None)
+
+        self.assertEqual(recorder.count, 4)
+        (sql, fingerprint, group), (_, other, _) = recorder.get_groups()
+        self.assertIn("boltstream_stream", sql)
+        self.assertEqual(group["count"], 3)
+        self.assertNotEqual(fingerprint, other)
+        self.assertTrue(group["stack"][0].startswith("tests.py:"))
+        self.assertTrue(group["stack"][0].endswith(" count_streams"))
+
+    def test_over_budget(self):
+        exceeded = self.get_exceeded()
+        middleware = SqlBudgetMiddleware(count_streams)
+        with self.assertLogs("boltstream.middleware", "WARNING") as logs:
+            middleware(RequestFactory().get("/"))
+
+        self.assertEqual(self.get_exceeded(), exceeded + 1)
+        [message] = logs.output
+        self.assertIn("4 queries", message)
+        self.assertRegex(message, r"\n  3x [0-9.]+ms \[[0-9a-f]{8}\] SELECT")
+
+    def test_within_budget(self):
+        exceeded = self.get_exceeded()
+        middleware = SqlBudgetMiddleware(partial(count_streams, repeat=2))
+        middleware(RequestFactory().get("/"))
+        self.assertEqual(self.get_exceeded(), exceeded)
+
+    @override_settings(SQL_BUDGET_ENABLED=False)
+    def test_disabled(self):
+        with self.assertRaises(MiddlewareNotUsed):
+            SqlBudgetMiddleware(count_streams)
+
+
+@override_settings(PROFILER_ENABLED=True, PROFILER_SAMPLE_RATE=0)
+class ProfilerTestCase(TestCase):
+    def setUp(self):
+        self.staff = User.objects.create_user("staff", is_staff=True)
+        self.user = User.objects.create_user("viewer")
+
+    def test_query_param(self):
+        self.client.force_login(self.staff)
+        self.client.get(reverse("home"), {"profile": 1})
+        profile = RequestProfile.objects.get()
+        self.assertEqual(profile.user, self.staff)
+        self.assertEqual(profile.view_name, "home")
+        self.assertEqual(profile.path, "/?profile=1")
+
+    def test_header(self):
+        self.client.force_login(self.staff)
+        self.client.get(reverse("home"), HTTP_X_PROFILE="1")
+        self.assertEqual(RequestProfile.objects.get().user, self.staff)
+
+    def test_not_staff(self):
+        self.client.force_login(self.user)
+        self.client.get(reverse("home"), {"profile": 1})
+        self.client.get(reverse("home"), HTTP_X_PROFILE="1")
+        self.assertFalse(RequestProfile.objects.exists())
+
+    @override_settings(PROFILER_SAMPLE_RATE=1)
+    def test_sampled(self):
+        self.client.get(reverse("home"))
+        self.client.force_login(self.user)
+        self.client.get(reverse("home"))
+        self.assertFalse(RequestProfile.objects.exists())
+
+        self.client.force_login(self.staff)
+        self.client.get(reverse("home"))
+        self.assertEqual(RequestProfile.objects.count(), 1)
+
+    @override_settings(PROFILER_MAX_PROFILES=2)
+    def test_prune(self):
+        now = timezone.now()
+        for seconds in range(3):
+            RequestProfile.objects.create(
+                created_at=now + timedelta(seconds=seconds),
+                view_name="home",
+                method="GET",
+                path="/",
+                status=200,
+                seconds=0,
+                samples=0,
+            )
+
+        tasks.prune_request_profiles()
+        self.assertEqual(
+            list(RequestProfile.objects.values_list("created_at", flat=True)),
+            [now + timedelta(seconds=2), now + timedelta(seconds=1)],
+        )
+
+
+class VarnishTestCase(TestCase):
+    def test_purge(self):
+        with RecordingServer() as server, override_settings(
+            VARNISH_ENABLED=True,
+            VARNISH_NODES=[server.host],
+            VARNISH_PURGE_BATCH_SIZE=2,
+        ):
+            varnish.purge(["feed-b", "stream-a", "feed-b", "live"])
+
+        self.assertEqual(
+            sorted(
+                (method, path, headers["X-Purge-Keys"])
+                for method, path, headers, _body in server.requests
+            ),
+            [("BAN", "/", "feed-b live"), ("BAN", "/", "stream-a")],
+        )
+
+    def test_disabled(self):
+        with RecordingServer() as server, override_settings(
+            VARNISH_ENABLED=False, VARNISH_NODES=[server.host]
+        ):
+            varnish.purge(["live"])
+
+        self.assertEqual(server.requests, [])
+
+
+def make_tone(frequency, seconds=1, rate=8000, amplitude=8000):
+    t = np.arange(seconds * rate) / rate
+    return (amplitude * np.sin(2 * np.pi * frequency * t)).astype("<i2").tobytes()
+
+
+class SilenceGateTestCase(TestCase):
+    def setUp(self):
+        self.gate = SilenceGate(0.001, 0.02, 30, name="test")
+
+    def get_skipped(self, reason):
+        return REGISTRY.get_sample_value(
+            "boltstream_fingerprint_windows_skipped_total",
+            {"stream": "test", "reason": reason},
+        )
+
+    def test_analyze_pcm(self):
+        rms, spectrum = analyze_pcm(make_tone(440))
+        self.assertAlmostEqual(rms, 8000 / 32768 / 2 ** 0.5, places=3)
+        self.assertEqual(spectrum.shape, (SPECTRUM_BANDS,))
+        self.assertAlmostEqual(float(np.linalg.norm(spectrum)), 1.0, places=5)
+
+    def test_skips_silent_and_unchanged(self):
+        self.assertTrue(self.gate.should_fingerprint(make_tone(440), now=0))
+        self.assertFalse(self.gate.should_fingerprint(make_tone(440), now=2))
+        self.assertFalse(self.gate.should_fingerprint(bytes(16000), now=4))
+        self.assertTrue(self.gate.should_fingerprint(make_tone(1000), now=6))
+
+        self.assertEqual(self.gate.skipped_unchanged, 1)
+        self.assertEqual(self.gate.skipped_silent, 1)
+        self.assertEqual(self.get_skipped("unchanged"), 1)
+        self.assertEqual(self.get_skipped("silent"), 1)
+
+    def test_max_skip_seconds(self):
+        self.assertTrue(self.gate.should_fingerprint(make_tone(440), now=0))
+        self.assertTrue(self.gate.should_fingerprint(make_tone(440), now=30))
+
+
+class ClipTestCase(TestCase):
+    def setUp(self):
+        self.index = np.array(
+            [(0.0, 0), (2.0, 100), (4.0, 250), (6.0, 400)], dtype=clips.INDEX_DTYPE
+        )
+
+    def test_find_clip_range(self):
+        self.assertEqual(clips.find_clip_range(self.index, 3, 5), (2.0, 6.0, 300))
+        self.assertEqual(clips.find_clip_range(self.index, 2, 4), (2.0, 4.0, 150))
+        self.assertEqual(clips.find_clip_range(self.index, -1, 1), (0.0, 2.0, 100))
+        self.assertEqual(clips.find_clip_range(self.index, 5, 7), (4.0, None, None))
+
+    def test_no_keyframes(self):
+        with self.assertRaises(ValueError):
+            clips.find_clip_range(self.index[:0], 0, 1)
+
+    def test_plan_clip(self):
+        stream = Stream.objects.create(user=User.objects.create_user("streamer"))
+        recording = Recording.objects.create(stream=stream, key="vod/a.mp4")
+        with tempfile.TemporaryDirectory() as root, override_settings(WEB_ROOT=root):
+            clips.write_index(self.index, recording.index_path)
+            self.assertEqual(
+                clips.plan_clip(recording, 3, 5),
+                (f"clips/{recording.uuid}/2000-6000.mp4", 2.0, 6.0, 300),
+            )
+            self.assertEqual(
+                clips.plan_clip(recording, 5, 7),
+                (f"clips/{recording.uuid}/4000-end.mp4", 4.0, None, None),
+            )
+
+
+@override_settings(
+    CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}},
+    DVR_WINDOW_SECONDS=2 * 60 * 60,
+)
+class DVRTestCase(TestCase):
+    def setUp(self):
+        self.stream = Stream.objects.create(
+            user=User.objects.create_user("streamer"), started_at=timezone.now()
+        )
+        self.root = tempfile.TemporaryDirectory()
+        self.addCleanup(self.root.cleanup)
+        self.live = os.path.join(self.root.name, "live", str(self.stream.uuid))
+        os.makedirs(self.live)
+        os.makedirs(os.path.join(self.root.name, "keys"))
+        with open(os.path.join(self.root.name, "keys", "1.key"), "wb") as f:
+            f.write(bytes(16))
+
+    def write_playlist(self, start):
+        lines = [
+            "#EXTM3U",
+            "#EXT-X-VERSION:3",
+            "#EXT-X-TARGETDURATION:4",
+            "#EXT-X-MEDIA-SEQUENCE:7",
+            '#EXT-X-KEY:METHOD=AES-128,URI="/keys/1.key"',
+        ]
+        for i in range(3):
+            name = f"{7 + i}.ts"
+            with open(os.path.join(self.live, name), "wb") as f:
+                f.write(bytes(188))
+            program_date_time = start + timedelta(seconds=4 * i)
+            lines.append(f"#EXT-X-PROGRAM-DATE-TIME:{program_date_time.isoformat()}")
+            lines += ["#EXTINF:4.000,", name]
+        with open(os.path.join(self.live, "index.m3u8"), "w") as f:
+            f.write("\n".join(lines) + "\n")
+
+    def test_get_bucket(self):
+        self.assertEqual(
+            dvr.get_bucket(datetime(2020, 1, 2, 3, 59, 59, tzinfo=tz.utc)),
+            "2020010203",
+        )
+
+    def test_index_segments_across_hour(self):
+        hour = timezone.now().replace(minute=0, second=0, microsecond=0)
+        start = hour - timedelta(seconds=4)
+        self.write_playlist(start)
+        before, after = dvr.get_bucket(start), dvr.get_bucket(hour)
+
+        with override_settings(WEB_ROOT=self.root.name):
+            self.assertEqual(dvr.index_segments(self.stream), 3)
+            self.assertEqual(dvr.index_segments(self.stream), 0)
+
+        base = os.path.join(self.root.name, "dvr", str(self.stream.uuid))
+        self.assertEqual(
+            sorted(os.listdir(os.path.join(base, before))), ["1.key", "7.ts"]
+        )
+        self.assertEqual(
+            sorted(os.listdir(os.path.join(base, after))), ["1.key", "8.ts", "9.ts"]
+        )
+        self.assertTrue(
+            os.path.samefile(
+                os.path.join(self.live, "8.ts"), os.path.join(base, after, "8.ts")
+            )
+        )
+
+        manifest = dvr.get_manifest(self.stream)
+        self.assertIn("#EXT-X-MEDIA-SEQUENCE:7\n", manifest)
+        self.assertIn(f"/dvr/{self.stream.uuid}/{before}/7.ts\n", manifest)
+        self.assertIn(f"/dvr/{self.stream.uuid}/{after}/9.ts\n", manifest)
+        # Each bucket carries its own link to the key
+        self.assertIn(f'URI="/dvr/{self.stream.uuid}/{before}/1.key"', manifest)
+        self.assertIn(f'URI="/dvr/{self.stream.uuid}/{after}/1.key"', manifest)
+
+
+@override_settings(RTMP_SECRET="secret")
+class SignKeyUrisTestCase(TestCase):
+    manifest = (
+        '#EXT-X-KEY:METHOD=AES-128,URI="/dvr/a/1.key"\n#EXTINF:4.000,\n/dvr/a/1.ts\n'
+    )
+
+    def setUp(self):
+        self.stream = Stream.objects.create(user=User.objects.create_user("streamer"))
+        self.factory = RequestFactory()
+
+    def get_uri(self, token):
+        sig = get_signature("secret", f"{token} {self.stream.uuid}").decode()
+        return f'URI="/dvr/a/1.key?s={quote(sig)}"'
+
+    def test_authorization(self):
+        request = self.factory.get("/", HTTP_AUTHORIZATION="Token abc")
+        manifest = sign_key_uris(request, self.stream, self.manifest)
+        self.assertIn(self.get_uri("Token abc"), manifest)
+        self.assertIn("\n/dvr/a/1.ts\n", manifest)
+
+    def test_session_cookie(self):
+        self.factory.cookies[settings.SESSION_COOKIE_NAME] = "session"
+        manifest = sign_key_uris(self.factory.get("/"), self.stream, self.manifest)
+        self.assertIn(self.get_uri("session"), manifest)
+
+    def test_unencrypted(self):
+        manifest = "#EXTM3U\n#EXTINF:4.000,\n/dvr/a/1.ts\n"
+        self.assertEqual(
+            sign_key_uris(self.factory.get("/"), self.stream, manifest), manifest
+        )
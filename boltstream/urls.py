@@ -21,19 +21,23 @@ from django.urls import include, path, re_path
 from django.views.generic import TemplateView
 
 from .views import (
+    DvrManifestView,
     FeedManifestView,
     FeedWebVTTView,
     HomeView,
     MasterManifestView,
+    MetadataManifestView,
     ProfileView,
     UserView,
     api_redirect,
     authorize_channel_access,
     authorize_channel_message,
     expire_viewers,
+    export_metrics,
     health_check,
     start_stream,
     stop_stream,
+    vod_record_done,
 )
 
 
@@ -74,6 +78,7 @@ urlpatterns = [
         name="password_reset_complete",
     ),
     path("app-health", health_check, name="health-check"),
+    path("app-metrics", export_metrics, name="metrics"),
     path("admin/", admin.site.urls),
     path("api/<version>/", include("boltstream.apiurls")),
     path("api/auth/", include("rest_framework.urls", namespace="rest_framework")),
@@ -104,6 +109,7 @@ urlpatterns = [
     path("start-stream", start_stream, name="start-stream"),
     path("stop-stream", stop_stream, name="stop-stream"),
     path("expire-viewers", expire_viewers, name="expire-viewers"),
+    path("vod-record-done", vod_record_done, name="vod-record-done"),
     path("stream-info", fake_view, name="stream-info"),
     path("stream-control/drop/publisher", fake_view, name="drop-stream"),
     path("offline.mp4", fake_view, name="stream-offline"),
@@ -111,6 +117,12 @@ urlpatterns = [
         "live/<uuid>/master.m3u8", MasterManifestView.as_view(), name="master-manifest"
     ),
     path("live/<uuid>/index.m3u8", fake_view, name="index-manifest"),
+    path("live/<uuid>/dvr.m3u8", DvrManifestView.as_view(), name="dvr-manifest"),
+    path(
+        "live/<uuid>/metadata.m3u8",
+        MetadataManifestView.as_view(),
+        name="metadata-manifest",
+    ),
     path("live/<uuid>/preview.jpg", fake_view, name="stream-image"),
     path("live/<uuid>/preview.mp4", fake_view, name="stream-preview"),
     path("feed/<uuid>.m3u8", FeedManifestView.as_view(), name="feed-manifest"),
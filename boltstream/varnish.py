@@ -0,0 +1,74 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.utils.cache import add_never_cache_headers, patch_cache_control
+
+from .control import build_url
+from .metrics import http
+
+logger = logging.getLogger(__name__)
+
+# Tags everything listing live streams, purged whenever one starts or stops
+LIVE_KEY = "live"
+
+
+def get_stream_key(stream_uuid):
+    return f"stream-{stream_uuid}"
+
+
+def get_feed_key(feed_uuid):
+    return f"feed-{feed_uuid}"
+
+
+def cache_response(response, keys, ttl):
+    """Let Varnish cache ``response`` for ``ttl`` seconds under the surrogate
+    ``keys``.  Browsers always revalidate, so a purge is never outlived by a
+    private copy."""
+    if not settings.VARNISH_ENABLED:
+        add_never_cache_headers(response)
+        return response
+
+    patch_cache_control(response, public=True, max_age=0, s_maxage=ttl)
+    response["Surrogate-Key"] = " ".join(keys)
+    return response
+
+
+def ban(node, keys):
+    r = http.request(
+        "BAN",
+        build_url(node, "/"),
+        headers={"X-Purge-Keys": " ".join(keys)},
+        timeout=settings.VARNISH_PURGE_TIMEOUT,
+    )
+    r.raise_for_status()
+
+
+def purge(keys):
+    """Ban every object tagged with any of ``keys`` on all Varnish nodes.
+
+    Keys are sent ``VARNISH_PURGE_BATCH_SIZE`` at a time, one ban per batch,
+    and the nodes are banned concurrently.
+    """
+    if not settings.VARNISH_ENABLED or not settings.VARNISH_NODES:
+        return
+
+    keys = sorted(set(keys))
+    size = settings.VARNISH_PURGE_BATCH_SIZE
+    batches = []
+    for start in range(0, len(keys), size):
+        end = start + size
+        batches.append(keys[start:end])
+
+    with ThreadPoolExecutor(len(settings.VARNISH_NODES)) as executor:
+        futures = [
+            executor.submit(ban, node, batch)
+            for node in settings.VARNISH_NODES
+            for batch in batches
+        ]
+
+    for future in futures:
+        try:
+            future.result()
+        except Exception as e:
+            logger.exception(e)
@@ -1,22 +1,25 @@
 import json
 import logging
+import os
 from datetime import timedelta
 from socket import gethostname
 
 from braces.views import LoginRequiredMixin
 from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.core.serializers.json import DjangoJSONEncoder
+from django.core.exceptions import ValidationError
 from django.db import transaction
-from django.db.models import Count
 from django.http import (
+    Http404,
     HttpResponse,
     HttpResponseBadRequest,
+    HttpResponseForbidden,
     HttpResponseRedirect,
     JsonResponse,
 )
 from django.shortcuts import get_object_or_404
 from django.utils import timezone
+from django.utils.crypto import constant_time_compare
 from django.utils.dateparse import parse_datetime
 from django.utils.decorators import method_decorator
 from django.utils.translation import gettext as _
@@ -25,14 +28,21 @@ from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_POST
 from django.views.generic import DetailView, RedirectView, TemplateView
 from furl import furl
-from webvtt import Caption, WebVTT
 
-from .filters import StreamFilter
-from .manifests import make_feed_manifest, make_master_manifest
-from .models import Feed, Stream
+from . import analytics, dvr, metrics, varnish
+from .filters import StreamFilter, normalize_search
+from .fragments import get_live_version
+from .manifests import (
+    make_feed_manifest,
+    make_master_manifest,
+    make_metadata_manifest,
+    sign_key_uris,
+)
+from .models import CUE_SEPARATOR, Feed, Stream, StreamSession
 from .permissions import require_rtmp_secret
 from .responses import HttpResponseNoContent
-from .tasks import create_acrcloud_channel, delete_acrcloud_channel
+from .tasks import finalize_vod
+from .vtt import get_offset, get_timecode, iter_webvtt
 
 User = get_user_model()
 logger = logging.getLogger(__name__)
@@ -48,20 +58,49 @@ def health_check(request):
     return HttpResponse(f"OK\n{gethostname()}\n", content_type="text/plain")
 
 
+@never_cache
+def export_metrics(request):
+    if not settings.METRICS_ENABLED:
+        raise Http404(_("Not found"))
+
+    # Requests all reach the app through the proxy, so a token is the only
+    # way to tell scrapers apart and nothing is served without one.
+    auth = request.META.get("HTTP_AUTHORIZATION", "")
+    token = f"Bearer {settings.METRICS_TOKEN}"
+    if not settings.METRICS_TOKEN or not constant_time_compare(auth, token):
+        return HttpResponseForbidden(_("Forbidden"))
+
+    output, content_type = metrics.render()
+    return HttpResponse(output, content_type=content_type)
+
+
 class HomeView(TemplateView):
 
     template_name = "boltstream/home.html"
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        streams = Stream.objects.live().annotate(viewer_count=Count("viewers"))
+        search = normalize_search(self.request.GET.get("search", ""))
+        streams = Stream.objects.live_now()
 
-        if self.request.GET.get("search"):
-            streams = StreamFilter(self.request.GET, queryset=streams).qs
+        if search:
+            streams = StreamFilter({"search": search}, queryset=streams).qs
 
+        # The queryset is only evaluated when the fragment is not cached
         context["streams"] = streams.order_by("-viewer_count")
+        context["search"] = search
+        context["live_version"] = get_live_version()
+        context["fragment_seconds"] = settings.HOME_FRAGMENT_SECONDS
         return context
 
+    def get(self, request, *args, **kwargs):
+        response = super().get(request, *args, **kwargs)
+        if request.user.is_authenticated:
+            return response
+        return varnish.cache_response(
+            response, [varnish.LIVE_KEY], settings.VARNISH_PAGE_TTL
+        )
+
 
 class UserView(DetailView):
 
@@ -108,6 +147,24 @@ class ProfileView(LoginRequiredMixin, DetailView):
 
 class MasterManifestView(DetailView):
 
+    queryset = Stream.objects.live().prefetch_related("feeds")
+    slug_field = "uuid"
+    slug_url_kwarg = "uuid"
+
+    def get(self, request, *args, **kwargs):
+        stream = self.get_object()
+        manifest = make_master_manifest(request, stream)
+        # Feed changes purge the stream keys of the streams showing the feed,
+        # so new feed items don't purge the master playlist.
+        return varnish.cache_response(
+            HttpResponse(manifest, content_type="application/vnd.apple.mpegurl"),
+            [varnish.get_stream_key(stream.uuid)],
+            settings.VARNISH_MANIFEST_TTL,
+        )
+
+
+class DvrManifestView(DetailView):
+
     queryset = Stream.objects.live()
     slug_field = "uuid"
     slug_url_kwarg = "uuid"
@@ -115,7 +172,27 @@ class MasterManifestView(DetailView):
     @method_decorator(never_cache)
     def get(self, request, *args, **kwargs):
         stream = self.get_object()
-        manifest = make_master_manifest(request, stream)
+        manifest = dvr.get_manifest(stream)
+        if manifest is None:
+            raise Http404(_("No DVR window"))
+
+        manifest = sign_key_uris(request, stream, manifest)
+        return HttpResponse(manifest, content_type="application/vnd.apple.mpegurl")
+
+
+class MetadataManifestView(DetailView):
+
+    queryset = Stream.objects.live()
+    slug_field = "uuid"
+    slug_url_kwarg = "uuid"
+
+    @method_decorator(never_cache)
+    def get(self, request, *args, **kwargs):
+        stream = self.get_object()
+        try:
+            manifest = make_metadata_manifest(request, stream)
+        except FileNotFoundError:
+            raise Http404(_("Not found"))
         return HttpResponse(manifest, content_type="application/vnd.apple.mpegurl")
 
 
@@ -125,7 +202,6 @@ class FeedManifestView(DetailView):
     slug_field = "uuid"
     slug_url_kwarg = "uuid"
 
-    @method_decorator(never_cache)
     def get(self, request, *args, **kwargs):
         feed = self.get_object()
         try:
@@ -133,7 +209,12 @@ class FeedManifestView(DetailView):
         except KeyError:
             return HttpResponseBadRequest(_("Bad request"))
         manifest = make_feed_manifest(request, stream, feed)
-        return HttpResponse(manifest, content_type="application/vnd.apple.mpegurl")
+        keys = [varnish.get_stream_key(stream.uuid), varnish.get_feed_key(feed.uuid)]
+        return varnish.cache_response(
+            HttpResponse(manifest, content_type="application/vnd.apple.mpegurl"),
+            keys,
+            settings.VARNISH_PLAYLIST_TTL,
+        )
 
 
 class FeedWebVTTView(DetailView):
@@ -143,62 +224,74 @@ class FeedWebVTTView(DetailView):
     slug_url_kwarg = "uuid"
 
     def get_vtt_timecode(self, start, end):
-        msecs = int((end - start).total_seconds() * 1000)
-        hours, remainder = divmod(msecs, 3600 * 1000)
-        minutes, remainder = divmod(remainder, 60 * 1000)
-        seconds, millis = divmod(remainder, 1000)
-        return f"{hours:02d}:{minutes:02d}:{seconds:02d}.{millis:03d}"
+        return get_timecode(get_offset(start, end))
 
-    @method_decorator(never_cache)
-    def get(self, request, *args, **kwargs):
-        feed = self.get_object()
-
-        try:
-            stream = get_object_or_404(feed.streams.all(), uuid=request.GET["stream"])
-        except KeyError:
-            return HttpResponseBadRequest(_("Bad request"))
-
-        webvtt = WebVTT()
-        resp = HttpResponse(content_type="text/vtt; charset=utf-8")
+    def get_cue_text(self, start_timecode, end_timecode, cue):
+        head, tail = cue.split(CUE_SEPARATOR, 1)
+        return (
+            f'{head}, "start_timecode": "{start_timecode}", '
+            f'"end_timecode": "{end_timecode}", {tail}'
+        )
 
-        try:
-            start = parse_datetime(request.GET["start"])
-            end = parse_datetime(request.GET["end"])
-            epoch = parse_datetime(request.GET["epoch"])
-        except KeyError:
-            return HttpResponseBadRequest(_("Bad request"))
+    def iter_cues(self, epoch, items):
+        for starts_at, ends_at, cue in items:
+            start_timecode = get_timecode(get_offset(epoch, starts_at))
+            end_timecode = get_timecode(get_offset(epoch, ends_at))
+            text = self.get_cue_text(start_timecode, end_timecode, cue)
+            yield start_timecode, end_timecode, text
+
+    def get_session_window(self, request, feed):
+        sessions = StreamSession.objects.filter(stream__feeds=feed)
+        session = get_object_or_404(sessions, uuid=request.GET["session"])
+        offset = int(request.GET["t"])
+        duration = int(request.GET["d"])
+
+        epoch = session.epoch
+        start = epoch + timedelta(milliseconds=offset - 5000)
+        end = epoch + timedelta(milliseconds=offset + duration + 5000)
+        return epoch, start, end
+
+    def get_stream_window(self, request, feed):
+        """Window of the timestamped URLs manifests use for streams without a
+        session, like those already live when sessions were introduced."""
+        stream = get_object_or_404(feed.streams.all(), uuid=request.GET["stream"])
+        start = parse_datetime(request.GET["start"])
+        end = parse_datetime(request.GET["end"])
+        epoch = parse_datetime(request.GET["epoch"])
 
         if stream.program_date_time:
-            start_diff = start - stream.started_at
-            end_diff = end - stream.started_at
-            start = stream.program_date_time + start_diff
-            end = stream.program_date_time + end_diff
+            start = stream.program_date_time + (start - stream.started_at)
+            end = stream.program_date_time + (end - stream.started_at)
             epoch = stream.program_date_time
 
-        start = start - timedelta(seconds=5)
-        end = end + timedelta(seconds=5)
+        return epoch, start - timedelta(seconds=5), end + timedelta(seconds=5)
 
-        items = feed.items.filter(starts_at__gte=start, ends_at__lt=end).order_by(
-            "starts_at"
-        )
-        for item in items:
-            start_timecode = self.get_vtt_timecode(epoch, item.starts_at)
-            end_timecode = self.get_vtt_timecode(epoch, item.ends_at)
-            data = {
-                "uuid": item.uuid,
-                "starts_at": item.starts_at.isoformat(),
-                "ends_at": item.ends_at.isoformat(),
-                "start_timecode": start_timecode,
-                "end_timecode": end_timecode,
-                "payload": item.payload,
-            }
-            cap = Caption(
-                start_timecode, end_timecode, [json.dumps(data, cls=DjangoJSONEncoder)]
-            )
-            webvtt.captions.append(cap)
+    def get(self, request, *args, **kwargs):
+        feed = self.get_object()
+
+        try:
+            if "session" in request.GET:
+                epoch, start, end = self.get_session_window(request, feed)
+            else:
+                epoch, start, end = self.get_stream_window(request, feed)
+        except (KeyError, TypeError, ValueError, ValidationError):
+            return HttpResponseBadRequest(_("Bad request"))
 
-        webvtt.write(resp)
-        return resp
+        # The cue column holds the encoded body, so the payload column is
+        # never fetched or decoded here.
+        items = (
+            feed.items.filter(starts_at__gte=start, ends_at__lt=end)
+            .order_by("starts_at")
+            .values_list("starts_at", "ends_at", "cue")
+        )
+        return varnish.cache_response(
+            HttpResponse(
+                iter_webvtt(self.iter_cues(epoch, items)),
+                content_type="text/vtt; charset=utf-8",
+            ),
+            [varnish.get_feed_key(feed.uuid)],
+            settings.VARNISH_WEBVTT_TTL,
+        )
 
 
 @never_cache
@@ -243,8 +336,13 @@ def start_stream(request):
         stream.started_at = timezone.now()
         stream.ingest_host = request.META["HTTP_X_INGEST_HOST"]
         stream.save()
+        stream.sessions.live().update(stopped_at=stream.started_at)
+        stream.sessions.create(
+            started_at=stream.started_at,
+            ingest_host=stream.ingest_host,
+            sync_offset=stream.get_sync_offset(),
+        )
 
-    create_acrcloud_channel.delay(stream.pk)
     return HttpResponseRedirect(str(stream.uuid))
 
 
@@ -259,8 +357,10 @@ def stop_stream(request):
         stream.started_at = None
         stream.ingest_host = None
         stream.save()
+        analytics.rollup_viewers(stream.sessions.live())
+        stream.sessions.live().update(stopped_at=timezone.now())
 
-    delete_acrcloud_channel.delay(stream.pk)
+    dvr.clear(stream)
     stream.expire_all_viewers()
     return HttpResponse("OK")
 
@@ -278,3 +378,20 @@ def expire_viewers(request):
         stream.expire_viewers(since=since)
 
     return HttpResponse(_("OK"))
+
+
+@csrf_exempt
+@require_POST
+@require_rtmp_secret
+def vod_record_done(request):
+    try:
+        stream = get_object_or_404(Stream, uuid=request.POST["name"])
+        path = os.path.realpath(request.POST["path"])
+    except (KeyError, ValidationError):
+        return HttpResponseBadRequest(_("Bad request"))
+
+    if not path.startswith(os.path.join(settings.WEB_ROOT, "record", "")):
+        return HttpResponseBadRequest(_("Bad request"))
+
+    finalize_vod.delay(str(stream.uuid), path)
+    return HttpResponse(_("OK"))
@@ -1,15 +1,33 @@
+import json
+import os
+
+from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.http import Http404, HttpResponse
+from django.shortcuts import get_object_or_404
+from django.utils.cache import patch_cache_control
 from django.utils.decorators import method_decorator
 from django.utils.translation import gettext as _
 from django.views.decorators.cache import never_cache
 from rest_framework import status, viewsets
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.decorators import action
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
-from .models import Stream
+from . import varnish
+from .clips import get_clip_lock_key, get_clip_path, plan_clip
+from .ingest import ingest_feed_items, iter_ndjson
+from .models import Feed, Recording, Stream
 from .permissions import RtmpSecretRequired
-from .serializers import StreamSerializer, UserSerializer
+from .serializers import (
+    ClipSerializer,
+    RecordingSerializer,
+    StreamSerializer,
+    UserSerializer,
+)
+from .tasks import extract_clip, publish_feed_items
 
 User = get_user_model()
 
@@ -29,7 +47,33 @@ class AuthorizeKeyAccessView(APIView):
         return Response(_("OK"))
 
 
-class UserViewSet(viewsets.ReadOnlyModelViewSet):
+class CachedReadMixin:
+    """Let Varnish cache anonymous reads under the live set key, plus the
+    keys from ``get_object_keys`` for a single object."""
+
+    def get_object_keys(self):
+        return []
+
+    def get_surrogate_keys(self):
+        keys = [varnish.LIVE_KEY]
+        if self.lookup_url_kwarg in self.kwargs:
+            keys += self.get_object_keys()
+        return keys
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        if (
+            request.method == "GET"
+            and response.status_code == status.HTTP_200_OK
+            and not request.user.is_authenticated
+        ):
+            varnish.cache_response(
+                response, self.get_surrogate_keys(), settings.VARNISH_PAGE_TTL
+            )
+        return response
+
+
+class UserViewSet(CachedReadMixin, viewsets.ReadOnlyModelViewSet):
 
     queryset = User.objects.live()
     lookup_field = "uuid"
@@ -37,9 +81,112 @@ class UserViewSet(viewsets.ReadOnlyModelViewSet):
     serializer_class = UserSerializer
 
 
-class StreamViewSet(viewsets.ReadOnlyModelViewSet):
+class StreamViewSet(CachedReadMixin, viewsets.ReadOnlyModelViewSet):
 
     queryset = Stream.objects.live()
     lookup_field = "uuid"
     lookup_url_kwarg = "uuid"
     serializer_class = StreamSerializer
+
+    def get_object_keys(self):
+        return [varnish.get_stream_key(self.kwargs["uuid"])]
+
+
+class RecordingViewSet(viewsets.ReadOnlyModelViewSet):
+
+    queryset = Recording.objects.select_related("stream")
+    permission_classes = (IsAuthenticated,)
+    lookup_field = "uuid"
+    lookup_url_kwarg = "uuid"
+    serializer_class = RecordingSerializer
+
+    def get_queryset(self):
+        qs = super().get_queryset()
+        if self.request.user.is_privileged:
+            return qs
+        return qs.filter(stream__user=self.request.user)
+
+    @action(detail=True, methods=["post"])
+    def clip(self, request, **kwargs):
+        """Start cutting a clip out of the recording.  Answers 201 when the
+        clip already exists, otherwise 202 while a worker extracts it."""
+        recording = self.get_object()
+        serializer = ClipSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+        try:
+            key, start, end, size = plan_clip(recording, data["start"], data["end"])
+        except (OSError, ValueError):
+            return Response(
+                _("Recording can't be clipped"), status=status.HTTP_400_BAD_REQUEST
+            )
+
+        if os.path.exists(get_clip_path(key)):
+            code = status.HTTP_201_CREATED
+        else:
+            code = status.HTTP_202_ACCEPTED
+            lock_key = get_clip_lock_key(key)
+            if cache.add(lock_key, True, settings.CLIP_LOCK_SECONDS):
+                extract_clip.delay(str(recording.uuid), start, end)
+
+        url = self.reverse_action(
+            "clip-file",
+            kwargs={"uuid": recording.uuid, "name": os.path.basename(key)},
+        )
+        return Response(
+            {"url": url, "start": start, "end": end, "size": size}, status=code
+        )
+
+    @action(
+        detail=True,
+        methods=["get"],
+        url_path=r"clips/(?P<name>[0-9]+-(?:[0-9]+|end)\.mp4)",
+        url_name="clip-file",
+    )
+    def clip_file(self, request, name, **kwargs):
+        """Let nginx send a clip once the recording's permissions pass."""
+        recording = self.get_object()
+        key = f"clips/{recording.uuid}/{name}"
+        if not os.path.exists(get_clip_path(key)):
+            raise Http404
+
+        response = HttpResponse(content_type="video/mp4")
+        response["X-Accel-Redirect"] = f"/{key}"
+        patch_cache_control(response, private=True, max_age=3600)
+        return response
+
+
+class FeedItemBulkView(APIView):
+    """Bulk create feed items from an NDJSON (or JSON array) request body.
+
+    NDJSON bodies are read and written line by line in chunks instead of
+    being parsed as a whole.
+    """
+
+    permission_classes = (IsAdminUser,)
+    parser_classes = ()
+
+    def post(self, request, feed_uuid, **kwargs):
+        feed = get_object_or_404(Feed, uuid=feed_uuid)
+        body = request.stream
+        if body is None:
+            return Response(_("Empty body"), status=status.HTTP_400_BAD_REQUEST)
+
+        if request.content_type.startswith("application/json"):
+            try:
+                items = json.load(body)
+            except ValueError:
+                return Response(_("Bad request"), status=status.HTTP_400_BAD_REQUEST)
+            if not isinstance(items, list):
+                return Response(
+                    _("Expected an array"), status=status.HTTP_400_BAD_REQUEST
+                )
+            records = enumerate(items, 1)
+        else:
+            records = iter_ndjson(body)
+
+        result = ingest_feed_items(feed, records, settings.FEED_BULK_CHUNK_SIZE)
+        created = result.pop("created")
+        if created:
+            publish_feed_items.delay(created)
+        return Response(result)
@@ -0,0 +1,136 @@
+import logging
+import os
+import time
+from subprocess import DEVNULL, CalledProcessError, run
+
+from boto3.s3.transfer import TransferConfig
+from botocore.exceptions import BotoCoreError, ClientError
+from django.conf import settings
+from django.utils import timezone
+
+from .clips import build_index, write_index
+from .models import Recording
+from .storage import get_s3_client
+
+logger = logging.getLogger(__name__)
+
+
+class UploadVerificationError(Exception):
+    pass
+
+
+# Errors finalize_vod is retried on
+RETRY_ERRORS = (
+    OSError,
+    CalledProcessError,
+    BotoCoreError,
+    ClientError,
+    UploadVerificationError,
+)
+
+
+def get_transfer_config():
+    return TransferConfig(
+        multipart_threshold=settings.VOD_UPLOAD_PART_SIZE,
+        multipart_chunksize=settings.VOD_UPLOAD_PART_SIZE,
+        max_concurrency=settings.VOD_UPLOAD_CONCURRENCY,
+    )
+
+
+def get_vod_key(stream, created_at):
+    return f"vod/{stream.uuid}/{created_at.isoformat()}.mp4"
+
+
+def remux_vod(src, dst):
+    cmd = [
+        settings.FFMPEG_PATH,
+        "-hide_banner",
+        "-v",
+        "error",
+        "-y",
+        "-i",
+        src,
+        "-c",
+        "copy",
+        "-movflags",
+        "+faststart",
+        dst,
+    ]
+    run(cmd, stdin=DEVNULL, stdout=DEVNULL, check=True)
+
+
+def upload_vod(path, key):
+    client = get_s3_client()
+    client.upload_file(
+        path,
+        settings.VOD_STORAGE_BUCKET_NAME,
+        key,
+        ExtraArgs={"ContentType": "video/mp4"},
+        Config=get_transfer_config(),
+    )
+
+    head = client.head_object(Bucket=settings.VOD_STORAGE_BUCKET_NAME, Key=key)
+    size = os.path.getsize(path)
+    if head["ContentLength"] != size:
+        raise UploadVerificationError(
+            f"{key} is {head['ContentLength']} bytes, expected {size}"
+        )
+
+
+def remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def finalize_vod(stream, path):
+    """Remux a finished ``_vod.flv`` recording into a faststart MP4 and move it
+    to object storage, or into ``WEB_ROOT/vod`` when no bucket is configured.
+
+    Safe to retry: the ``Recording`` is saved before the upload, and the
+    source is only removed once the MP4 is in place.
+    """
+    mp4_path = f"{os.path.splitext(path)[0]}.mp4"
+    recording = stream.recordings.filter(source_path=path).first()
+    if recording is None:
+        created_at = timezone.now()
+        recording = Recording(
+            stream=stream,
+            created_at=created_at,
+            key=get_vod_key(stream, created_at),
+            source_path=path,
+        )
+    elif recording.uploaded_at or not os.path.exists(path):
+        # Finished by an earlier attempt
+        remove(path)
+        return recording
+
+    if recording.pk is None or not os.path.exists(mp4_path):
+        start = time.monotonic()
+        remux_vod(path, mp4_path)
+        recording.remux_seconds = time.monotonic() - start
+        recording.size = os.path.getsize(mp4_path)
+        write_index(build_index(mp4_path), recording.index_path)
+        recording.save()
+
+    if settings.VOD_STORAGE_BUCKET_NAME:
+        start = time.monotonic()
+        upload_vod(mp4_path, recording.key)
+        recording.upload_seconds = time.monotonic() - start
+        recording.uploaded_at = timezone.now()
+        recording.save(update_fields=("upload_seconds", "uploaded_at"))
+        remove(mp4_path)
+    else:
+        dst = os.path.join(settings.WEB_ROOT, recording.key)
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+        os.replace(mp4_path, dst)
+
+    remove(path)
+    logger.info(
+        f"stream={stream.uuid}, key={recording.key}, size={recording.size}, "
+        f"remux_seconds={recording.remux_seconds:.1f}, "
+        f"upload_seconds={recording.upload_seconds or 0:.1f}, "
+        f"upload_bytes_per_second={recording.upload_bytes_per_second or 0}"
+    )
+    return recording
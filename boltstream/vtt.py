@@ -0,0 +1,25 @@
+from datetime import timedelta
+
+HEADER = "WEBVTT"
+MILLISECOND = timedelta(milliseconds=1)
+
+
+def get_offset(epoch, dt):
+    """Return the whole milliseconds from ``epoch`` to ``dt``."""
+    return (dt - epoch) // MILLISECOND
+
+
+def get_timecode(msecs):
+    hours, remainder = divmod(msecs, 3600 * 1000)
+    minutes, remainder = divmod(remainder, 60 * 1000)
+    seconds, millis = divmod(remainder, 1000)
+    return f"{hours:02d}:{minutes:02d}:{seconds:02d}.{millis:03d}"
+
+
+def iter_webvtt(cues):
+    """Yield a WebVTT document for ``(start_timecode, end_timecode, text)``
+    cues.  The output matches webvtt-py's writer for single line cues without
+    building (and reparsing) a Caption per cue."""
+    yield HEADER
+    for start, end, text in cues:
+        yield f"\n\n{start} --> {end}\n{text}"
@@ -0,0 +1,25 @@
+import os
+import re
+
+MULTIPROC_DIR_ENV = "prometheus_multiproc_dir"
+
+# Files prometheus_client writes per process, e.g. counter_1234.db or
+# gauge_livesum_1234.db
+METRICS_FILE_RE = re.compile(r"^(counter|gauge_[a-z]+|histogram|summary)_[0-9]+\.db$")
+
+
+def on_starting(server):
+    # Drop samples left over from a previous master, leaving any other files
+    # sharing the directory alone
+    if MULTIPROC_DIR_ENV in os.environ:
+        path = os.environ[MULTIPROC_DIR_ENV]
+        for name in os.listdir(path):
+            if METRICS_FILE_RE.match(name):
+                os.remove(os.path.join(path, name))
+
+
+def child_exit(server, worker):
+    if MULTIPROC_DIR_ENV in os.environ:
+        from prometheus_client import multiprocess
+
+        multiprocess.mark_process_dead(worker.pid)